@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark for decoding map.apps app.json configurations with the available
+JSON decoders. Either uses all *.json files from the specified directory or
+a synthetic corpus of large version 3 and version 4 configurations with
+embedded symbol definitions.
+'''
+import os
+import sys
+import json
+import glob
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.json_utils as json_utils  # noqa: E402
+
+
+def get_decoders():
+    """
+    Gets all JSON decoders available in the current environment.
+    """
+    decoders = {'json': json.loads}
+    try:
+        import simplejson
+        decoders['simplejson'] = simplejson.loads
+    except ImportError:
+        pass
+    if json_utils.orjson is not None:
+        decoders['orjson'] = json_utils.orjson.loads
+    return decoders
+
+
+def get_symbol(rnd):
+    """
+    Creates a (deliberately verbose) symbol definition.
+    """
+    return {
+        'type': 'esriPMS',
+        'url': '%032x.png' % rnd.getrandbits(128),
+        'imageData': ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+/') for _ in range(2048)),
+        'contentType': 'image/png',
+        'width': rnd.randint(8, 32),
+        'height': rnd.randint(8, 32),
+        'angle': 0, 'xoffset': 0, 'yoffset': 0,
+    }
+
+
+def get_layer(rnd, idx):
+    """
+    Creates a layer definition referencing an ArcGIS server service.
+    """
+    return {
+        'id': 'layer_%d' % idx,
+        'title': 'Layer %d' % idx,
+        'type': rnd.choice(['AGS_DYNAMIC', 'AGS_FEATURE', 'AGS_TILED']),
+        'url': 'https://ags.gis.example.com/arcgis/rest/services/folder_%d/service_%d/MapServer' % (
+            rnd.randint(1, 60), rnd.randint(1, 2000)),
+        'renderer': {'uniqueValueInfos': [
+            {'value': str(v), 'symbol': get_symbol(rnd)} for v in range(rnd.randint(0, 6))]},
+    }
+
+
+def get_search_stores(rnd, cnt):
+    """
+    Creates search store definitions.
+    """
+    return [{
+        'id': 'store_%d' % i,
+        'title': 'Search %d' % i,
+        'url': 'https://ags.gis.example.com/arcgis/rest/services/folder/service_%d/MapServer/%d' % (i, i % 10),
+        'omniSearchSearchAttr': 'name',
+        'omniSearchPageSize': 10,
+        'useIn': ['omnisearch', 'selection'],
+    } for i in range(cnt)]
+
+
+def get_app_json(rnd, version, layer_cnt):
+    """
+    Creates a synthetic app.json configuration for the given map.apps version.
+    """
+    layers = [get_layer(rnd, i) for i in range(layer_cnt)]
+    bundles = {'agssearch': {'AGSStore': get_search_stores(rnd, rnd.randint(0, 20))}}
+    bundles.update({'bundle_%d' % i: {'Config': {'enabled': True}} for i in range(30)})
+    if version == 3:
+        bundles['map'] = {'MappingResourceRegistryFactory': {'_knownServices': {'services': layers}}}
+    else:
+        bundles['map-init'] = {'Config': {
+            'basemaps': [{'id': 'base_%d' % i, 'basemap': 'streets'} for i in range(5)],
+            'map': {'layers': layers}}}
+    return {
+        'properties': {'id': 'app_%d' % rnd.getrandbits(32), 'title': 'Synthetic map'},
+        'load': {'allowedBundles': sorted(bundles.keys()) + ['domain-example@^1.0.0']},
+        'bundles': bundles,
+    }
+
+
+def get_corpus(src_dir, app_cnt, layer_cnt):
+    """
+    Gets raw app.json contents, either read from the specified directory or
+    created synthetically.
+    """
+    if src_dir:
+        corpus = list()
+        for json_src in sorted(glob.glob(os.path.join(src_dir, '*.json'))):
+            with open(json_src, 'rb') as f:
+                corpus.append(f.read())
+        return corpus
+
+    rnd = random.Random(42)
+    return [
+        json.dumps(get_app_json(rnd, 3 if i % 2 else 4, layer_cnt)).encode('utf-8') for i in range(app_cnt)]
+
+
+def extract(app_json):
+    """
+    Walks the parts of the configuration that are used by the extractors.
+    """
+    bundles = app_json['bundles']
+    items = len(app_json['load']['allowedBundles'])
+    items += len(bundles.get('agssearch', dict()).get('AGSStore', list()))
+    if 'map' in bundles:
+        items += len(bundles['map']['MappingResourceRegistryFactory']['_knownServices']['services'])
+    elif 'map-init' in bundles:
+        items += len(bundles['map-init']['Config']['map']['layers'])
+    return items
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark decoding of map.apps configurations")
+    parser.add_argument(
+        '-d', '--directory', dest='src_dir', default=None, help='Directory containing app.json files')
+    parser.add_argument(
+        '-a', '--apps', dest='app_cnt', default=20, type=int, help='Number of synthetic configurations')
+    parser.add_argument(
+        '-l', '--layers', dest='layer_cnt', default=300, type=int, help='Number of layers per configuration')
+    parser.add_argument(
+        '-r', '--repeat', dest='repeat', default=3, type=int, help='Number of repetitions per decoder')
+    args = parser.parse_args()
+
+    corpus = get_corpus(args.src_dir, args.app_cnt, args.layer_cnt)
+    size = sum(len(content) for content in corpus)
+    print("Corpus: %d configurations, %.1f MB" % (len(corpus), size / 1024 ** 2))
+
+    for name, decode in get_decoders().items():
+        timings = list()
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            for content in corpus:
+                extract(decode(content))
+            timings.append(time.perf_counter() - t0)
+        best = min(timings)
+        print("%-12s %8.3f s %8.1f MB/s" % (name, best, size / 1024 ** 2 / best))
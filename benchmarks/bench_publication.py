@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark of report publication for synthetic snapshots of increasing size.
+For each report type, snapshot size and publication mode a local SQLite
+database is seeded with synthetic report rows that are then retrieved,
+rendered and uploaded to a local stand-in for the Confluence REST API. Wall
+time and peak (Python) memory are measured per phase and compared to stored
+baselines, flagging phases that got slower or more memory-hungry.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.bench_publication --sizes 1000 10000
+    python -m benchmarks.bench_publication --save-baseline
+
+Baselines are only meaningful for the machine they were recorded on.
+'''
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import datetime
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from sqlalchemy import create_engine, event
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+
+from confluence.confluence_publisher import ConfluencePublisher
+from reports.publish_report import (
+    TPL_DIR, PUBLISH_MODES, prepare_report, prepare_summary, write_csv)
+from table_defs.ags_service_layer_report import ags_service_layer_report_table_def
+from table_defs.mapapps_reports import mapapps_service_table_def
+
+SIZES = [1000, 10000, 100000]
+REPORT_TYPES = ['ags_service_layers', 'mapapps_maps']
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'bench_publication.json')
+# relative increase of time or memory regarded as regression
+TOLERANCE = 0.25
+# phases below these absolute values are never flagged, avoiding noise
+MIN_SECONDS = 0.05
+MIN_PEAK_MB = 1.0
+
+# publication settings as in the example configuration
+BENCH_CFL_CFG = {
+    'ags_service_layers': {
+        'src_tbl': 'reports.arcgis_service_report', 'title': 'ArcGIS Service Report', 'page_id': 1,
+        'report_tpl': 'servicereport.html.jinja2', 'summary_tpl': 'servicereport_summary.html.jinja2',
+        'sort_cols': 'env, svc_name'},
+    'mapapps_maps': {
+        'src_tbl': 'reports.mapapps_service_report', 'title': 'MapApps Map Report', 'page_id': 1,
+        'report_tpl': 'mapappsreport.html.jinja2', 'summary_tpl': 'mapappsreport_summary.html.jinja2',
+        'sort_cols': 'env, app_title'},
+}
+TABLE_DEFS = {
+    'ags_service_layers': ags_service_layer_report_table_def,
+    'mapapps_maps': mapapps_service_table_def,
+}
+ENVS = ['dev', 'test', 'prod']
+
+
+def get_synthetic_rows(report_type, size, ref_date):
+    """
+    Creates specified number of synthetic report rows, using a fixed seed to
+    get identical snapshots in every run.
+    """
+    rnd = random.Random(size)
+    rows = list()
+    for i in range(size):
+        env = rnd.choice(ENVS)
+        svc_name = "service_%05d" % (i // 8)
+        if report_type == 'ags_service_layers':
+            rows.append({
+                'svc_name': svc_name, 'svc_folder': "folder_%03d" % (i // 200), 'env': env,
+                'db': "gisdb_%d" % rnd.randint(1, 4), 'db_schema': "schema_%02d" % rnd.randint(1, 20),
+                'db_table': "table_%06d" % rnd.randint(1, size), 'sde': "connection_%02d.sde" % rnd.randint(1, 10),
+                'mxd': "D:\\arcgisserver\\mxd\\%s\\%s.mxd" % (env, svc_name), 'reference_date': ref_date})
+        else:
+            valid = rnd.random() > 0.05
+            rows.append({
+                'app_id': "app_%05d" % (i // 12), 'app_title': "Map %05d" % (i // 12), 'env': env,
+                'svc_id': "svc_%d" % (i % 12), 'svc_title': "Layer %d of %s" % (i % 12, svc_name),
+                'svc_type': rnd.choice(['AGS_DYNAMIC', 'AGS_FEATURE', 'WMS']),
+                'svc_url': "https://gis-%s.example.com/arcgis/rest/services/%s/MapServer" % (env, svc_name),
+                'svc_name': svc_name, 'svc_env': env, 'valid': valid,
+                'secured': rnd.random() > 0.1 if valid else None, 'reference_date': ref_date})
+    return rows
+
+
+def seed_database(db_dir, report_type, size):
+    """
+    Creates a local SQLite database containing a synthetic snapshot of the
+    specified report type and size, returning its engine.
+    """
+    db_path = os.path.join(db_dir, "%s_%d.sqlite" % (report_type, size))
+    engine = create_engine("sqlite:///%s" % db_path)
+
+    # providing the schema of the report tables as attached database
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, connection_record):
+        schema = BENCH_CFL_CFG[report_type]['src_tbl'].split('.')[0]
+        dbapi_connection.execute("ATTACH DATABASE '%s_%s' AS %s" % (db_path, schema, schema))
+
+    tbl = TABLE_DEFS[report_type](BENCH_CFL_CFG[report_type]['src_tbl'])
+    tbl.create(engine)
+    with engine.begin() as connection:
+        db_utils.insert_rows(connection, tbl, get_synthetic_rows(report_type, size, datetime.date.today()))
+    return engine
+
+
+class ConfluenceStandIn(BaseHTTPRequestHandler):
+    """
+    Minimal in-memory stand-in for the parts of the Confluence REST API used
+    for publishing, i.e. looking up, creating and updating pages as well as
+    attaching files.
+    """
+    CONTENT_PATH = re.compile(r'^/rest/api/content/?(?P<id>\d+)?(?P<sub>/history|/child/attachment.*)?$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def get_page(self, page_id):
+        page = self.server.pages.get(page_id)
+        if page is None:
+            page = {'id': page_id, 'title': "Page %s" % page_id, 'body': ''}
+        return {
+            'id': page['id'], 'type': 'page', 'status': 'current', 'title': page['title'],
+            'space': {'key': 'BENCH'}, 'version': {'number': page.get('version', 1)},
+            'body': {'storage': {'value': page['body'], 'representation': 'storage'}},
+            '_links': {'webui': "/pages/viewpage.action?pageId=%s" % page['id']}}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        match = self.CONTENT_PATH.match(url.path)
+        if match is None:
+            return self.send_json(404, {'statusCode': 404, 'message': 'Not found'})
+        page_id, sub = match.group('id'), match.group('sub')
+        if page_id is None:
+            # searching pages by space and title
+            title = params.get('title', [None])[0]
+            results = [self.get_page(p['id']) for p in self.server.pages.values() if p['title'] == title]
+            return self.send_json(200, {'results': results, 'size': len(results)})
+        if sub == '/history':
+            return self.send_json(200, {'lastUpdated': {'number': self.get_page(page_id)['version']['number']}})
+        if sub:
+            return self.send_json(200, {'results': [], 'size': 0})
+        return self.send_json(200, self.get_page(page_id))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        match = self.CONTENT_PATH.match(url.path)
+        body = self.read_body()
+        if match is None:
+            return self.send_json(404, {'statusCode': 404, 'message': 'Not found'})
+        if match.group('sub'):
+            return self.send_json(200, {'results': [{'id': 'att1', 'type': 'attachment', 'status': 'current'}]})
+        data = json.loads(body.decode('utf-8'))
+        with self.server.lock:
+            page_id = str(len(self.server.pages) + 1000)
+            self.server.pages[page_id] = {
+                'id': page_id, 'title': data.get('title'), 'body': data['body']['storage']['value']}
+        return self.send_json(200, self.get_page(page_id))
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        match = self.CONTENT_PATH.match(url.path)
+        body = self.read_body()
+        if match is None or match.group('id') is None:
+            return self.send_json(404, {'statusCode': 404, 'message': 'Not found'})
+        data = json.loads(body.decode('utf-8'))
+        with self.server.lock:
+            page = self.server.pages.setdefault(match.group('id'), {'id': match.group('id')})
+            page.update(
+                title=data.get('title'), body=data['body']['storage']['value'],
+                version=(data.get('version') or dict()).get('number', page.get('version', 1) + 1))
+        return self.send_json(200, self.get_page(match.group('id')))
+
+
+def serve_confluence_stand_in(port_queue):
+    """
+    Serves Confluence stand-in on a free local port, reporting the port via
+    the given queue.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ConfluenceStandIn)
+    server.daemon_threads = True
+    server.pages = dict()
+    server.lock = threading.Lock()
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_confluence_stand_in():
+    """
+    Starts Confluence stand-in in a separate process, keeping its memory usage
+    out of the measurements. Returns the process and the stand-in's base url.
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_confluence_stand_in, args=(port_queue, ), daemon=True)
+    process.start()
+    return process, "http://127.0.0.1:%d/" % port_queue.get(timeout=30)
+
+
+def measure(results, key, fn, *args, **kwargs):
+    """
+    Calls specified function, recording its wall time and peak memory under
+    the given key. Returns the function's result.
+    """
+    tracemalloc.reset_peak()
+    start_mem = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    peak_mb = (tracemalloc.get_traced_memory()[1] - start_mem) / 1024 ** 2
+    results[key] = {'seconds': round(elapsed, 4), 'peak_mb': round(peak_mb, 2)}
+    return result
+
+
+def publish_attachment(publisher, cfl_cfg, attachment_path, summary_content):
+    """
+    Uploads summary page and attaches the report file, as done in attachment
+    publication mode.
+    """
+    response = publisher.create_or_update_page(
+        parent_id=cfl_cfg['page_id'], title=cfl_cfg['title'], content=summary_content)
+    publisher.attach_file(
+        response['id'], attachment_path, name=os.path.basename(attachment_path), content_type='application/gzip')
+
+
+def run_benchmark(sizes, report_types, modes):
+    """
+    Runs publication phases for all combinations of the specified sizes,
+    report types and publication modes. Returns measurements by phase key.
+    """
+    results = dict()
+    process, cfl_base_url = start_confluence_stand_in()
+    publisher = ConfluencePublisher({'cfl_base_url': cfl_base_url, 'cfl_user': 'bench', 'cfl_pwd': 'bench'})
+
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for report_type in report_types:
+                cfl_cfg = BENCH_CFL_CFG[report_type]
+                for size in sizes:
+                    prefix = "%s/%d" % (report_type, size)
+                    engine = measure(results, "%s/seed" % prefix, seed_database, tmp_dir, report_type, size)
+                    for mode in modes:
+                        prefix = "%s/%d/%s" % (report_type, size, mode)
+                        # dropping reflected definitions to measure complete retrieval
+                        db_utils.TABLE_DEFS.clear()
+                        rows = measure(results, "%s/source_read" % prefix, prepare_report, cfl_cfg, engine)
+                        if mode == 'page':
+                            content = measure(
+                                results, "%s/render" % prefix, publisher.render,
+                                template=os.path.join(TPL_DIR, cfl_cfg['report_tpl']), data=rows)
+                            measure(
+                                results, "%s/upload" % prefix, publisher.create_or_update_page,
+                                parent_id=cfl_cfg['page_id'], title="%s %d" % (cfl_cfg['title'], size),
+                                content=content)
+                        else:
+                            summary = measure(results, "%s/summarize" % prefix, prepare_summary, report_type, rows)
+                            summary['attachment'] = 'report.csv.gz'
+                            content = measure(
+                                results, "%s/render" % prefix, publisher.render,
+                                template=os.path.join(TPL_DIR, cfl_cfg['summary_tpl']), data=summary)
+                            attachment_path = os.path.join(tmp_dir, "%s_%d.csv.gz" % (report_type, size))
+                            measure(results, "%s/write_attachment" % prefix, write_csv, attachment_path, rows)
+                            measure(
+                                results, "%s/upload" % prefix, publish_attachment,
+                                publisher, cfl_cfg, attachment_path, content)
+                        del rows, content
+                        logging.info("%s done" % prefix)
+                    engine.dispose()
+    finally:
+        tracemalloc.stop()
+        process.terminate()
+
+    return results
+
+
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    """
+    Compares measurements to the given baseline, returning phase keys and
+    metrics that exceed their baseline by more than the tolerance.
+    """
+    regressions = dict()
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+        for metric, min_value in [('seconds', MIN_SECONDS), ('peak_mb', MIN_PEAK_MB)]:
+            if metrics[metric] < min_value:
+                continue
+            if metrics[metric] > baseline[key][metric] * (1 + tolerance):
+                regressions.setdefault(key, list()).append(metric)
+    return regressions
+
+
+def print_results(results, baseline, regressions):
+    """
+    Prints measurements next to their baseline values.
+    """
+    print("%-52s %10s %10s %10s %10s  %s" % ('phase', 'time (s)', 'base (s)', 'peak (MB)', 'base (MB)', 'status'))
+    for key, metrics in results.items():
+        base = baseline.get(key, dict())
+        status = "REGRESSION (%s)" % ", ".join(regressions[key]) if key in regressions else ''
+        print("%-52s %10.3f %10s %10.1f %10s  %s" % (
+            key, metrics['seconds'], "%.3f" % base['seconds'] if base else '-',
+            metrics['peak_mb'], "%.1f" % base['peak_mb'] if base else '-', status))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Benchmark report publication for synthetic snapshots"))
+    parser.add_argument(
+        '-s', '--sizes', dest='sizes', required=False, default=SIZES, type=int, nargs='+',
+        help='Numbers of rows of synthetic snapshots')
+    parser.add_argument(
+        '-r', '--report-type', dest='report_types', required=False, default=REPORT_TYPES,
+        choices=REPORT_TYPES, nargs='+', help='Report types to be benchmarked')
+    parser.add_argument(
+        '-m', '--mode', dest='modes', required=False, default=PUBLISH_MODES,
+        choices=PUBLISH_MODES, nargs='+', help='Publication modes to be benchmarked')
+    parser.add_argument(
+        '-b', '--baseline', dest='baseline', required=False, default=BASELINE_PATH,
+        help='Path to the JSON file with baseline measurements')
+    parser.add_argument(
+        '-t', '--tolerance', dest='tolerance', required=False, default=TOLERANCE, type=float,
+        help='Relative increase of time or memory regarded as regression')
+    parser.add_argument(
+        '--save-baseline', dest='save_baseline', required=False, default=False,
+        action='store_true', help='Store measurements as new baseline, merged into existing ones')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    baseline = dict()
+    if os.path.isfile(args['baseline']):
+        with open(args['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run_benchmark(args['sizes'], args['report_types'], args['modes'])
+    regressions = find_regressions(results, baseline, args['tolerance'])
+    print_results(results, baseline, regressions)
+
+    if args['save_baseline']:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args['baseline'])), exist_ok=True)
+        with open(args['baseline'], 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        logging.info("Baseline stored in %s" % args['baseline'])
+    elif regressions:
+        logging.error("%d phases regressed compared to baseline" % len(regressions))
+        sys.exit(1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark comparing memory footprint and construction time of slotted row
+records with free-form dictionaries for a synthetic estate of map service
+rows, including the hand-off to the database writer.
+'''
+import os
+import sys
+import time
+import datetime
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from table_defs.row_records import ServiceRecord  # noqa: E402
+
+
+def get_values(i, ref_date):
+    """
+    Gets column values for a single synthetic map service row.
+    """
+    return {
+        'app_id': 'app_%d' % (i // 50),
+        'app_title': 'Map %d' % (i // 50),
+        'env': 'prod',
+        'svc_id': 'layer_%d' % i,
+        'svc_title': 'Layer %d' % i,
+        'svc_type': 'AGS_DYNAMIC',
+        'svc_url': 'https://ags.gis.example.com/arcgis/rest/services/folder/service_%d/MapServer' % (i % 2000),
+        'svc_name': 'service_%d' % (i % 2000),
+        'svc_env': 'prod',
+        'valid': True,
+        'secured': False,
+        'reference_date': ref_date,
+    }
+
+
+def build_dicts(row_cnt, ref_date):
+    rows = list()
+    for i in range(row_cnt):
+        row = dict()
+        row.update(get_values(i, ref_date))
+        rows.append(row)
+    return rows
+
+
+def build_records(row_cnt, ref_date):
+    rows = list()
+    for i in range(row_cnt):
+        row = ServiceRecord()
+        for key, value in get_values(i, ref_date).items():
+            row[key] = value
+        rows.append(row)
+    return rows
+
+
+def hand_off(rows, batch_size=10000):
+    """
+    Mimics preparation of row batches for the database driver.
+    """
+    cnt = 0
+    for i in range(0, len(rows), batch_size):
+        batch = [row.as_dict() if hasattr(row, 'as_dict') else row for row in rows[i:i + batch_size]]
+        cnt += len(batch)
+    return cnt
+
+
+def measure(name, build, row_cnt):
+    ref_date = datetime.date.today()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    rows = build(row_cnt, ref_date)
+    t_build = time.perf_counter() - t0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    hand_off(rows)
+    t_hand_off = time.perf_counter() - t0
+    print("%-10s %8.1f MB %8.1f bytes/row %8.3f s build %8.3f s hand-off" % (
+        name, current / 1024 ** 2, current / row_cnt, t_build, t_hand_off))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark row representations")
+    parser.add_argument('-r', '--rows', dest='row_cnt', default=100000, type=int, help='Number of rows')
+    args = parser.parse_args()
+
+    print("Building %d rows" % args.row_cnt)
+    measure('dict', build_dicts, args.row_cnt)
+    measure('record', build_records, args.row_cnt)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Micro-benchmark comparing the classification of service urls via the
+precomputed host index with the previous approach of looping over all
+configured environments and matching the service pattern for every layer.
+'''
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.url_utils as url_utils  # noqa: E402
+
+ENVIRONMENTS = {
+    'dev': {'ags_host': 'ags.gistest.example.com'},
+    'int': {'ags_host': 'ags.gisint.example.com'},
+    'prod': {'ags_host': 'ags.gis.example.com'},
+    'ext': {'ma_base_url': 'https://ext.example.com/MapApps'},
+}
+FOREIGN_HOSTS = ['services.arcgisonline.com', 'geodienste.example.org', 'wms.example.net']
+SERVICE_REGEX = R"/rest/services/(.+)/(.+)/(?:Map|Feature)Server/?(\d+)?"
+
+
+def get_urls(layer_cnt, distinct_cnt):
+    """
+    Creates the specified number of layer urls, drawn from a pool of distinct
+    service urls on configured and foreign hosts.
+    """
+    rnd = random.Random(42)
+    hosts = [e['ags_host'] for e in ENVIRONMENTS.values() if 'ags_host' in e] + FOREIGN_HOSTS
+    pool = list()
+    for i in range(distinct_cnt):
+        host = rnd.choice(hosts)
+        relay = 'ags-relay/' if rnd.random() < 0.3 else ''
+        pool.append("https://%s/%sarcgis/rest/services/folder_%d/service_%d/MapServer/%d" % (
+            host, relay, rnd.randint(1, 60), i, rnd.randint(0, 30)))
+    return [rnd.choice(pool) for _ in range(layer_cnt)]
+
+
+def classify_by_loop(cfg, url):
+    """
+    Classifies the specified url as previously done by the extractors.
+    """
+    svc_env = None
+    secured = None
+    available_ags_hosts = set()
+    for env_name in cfg['environments']:
+        if 'ags_host' not in cfg['environments'][env_name]:
+            continue
+        available_ags_hosts.add(cfg['environments'][env_name]['ags_host'])
+        if url and cfg['environments'][env_name]['ags_host'] in url:
+            svc_env = env_name
+    if url and any([sub in url for sub in available_ags_hosts]):
+        secured = 'ags-relay' in url
+    match = re.search(SERVICE_REGEX, url)
+    if match:
+        return svc_env, match.group(1), match.group(2), match.group(3), secured
+    return svc_env, None, None, None, secured
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark classification of service urls")
+    parser.add_argument(
+        '-l', '--layers', dest='layer_cnt', default=200000, type=int, help='Number of configured layers')
+    parser.add_argument(
+        '-d', '--distinct', dest='distinct_cnt', default=5000, type=int, help='Number of distinct service urls')
+    args = parser.parse_args()
+
+    cfg = {'environments': ENVIRONMENTS}
+    urls = get_urls(args.layer_cnt, args.distinct_cnt)
+    print("Classifying %d layer urls (%d distinct)" % (len(urls), args.distinct_cnt))
+
+    t0 = time.perf_counter()
+    for url in urls:
+        classify_by_loop(cfg, url)
+    t_loop = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    url_index = url_utils.build_url_index(cfg['environments'])
+    for url in urls:
+        url_utils.classify_url(url_index, url)
+    t_index = time.perf_counter() - t0
+
+    print("%-16s %8.3f s %8.2f us/layer" % ('environment loop', t_loop, t_loop / len(urls) * 1e6))
+    print("%-16s %8.3f s %8.2f us/layer" % ('host index', t_index, t_index / len(urls) * 1e6))
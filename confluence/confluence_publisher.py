@@ -13,14 +13,15 @@ class ConfluencePublisher:
 
     config = dict()
 
-    def __init__(self, config):
+    def __init__(self, config, session=None):
         if type(config) is dict:
             self.config = config
         elif os.path.isfile(config):
             self.config = yaml.safe_load(open(config))
         self.basepath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
         self.confluence = Confluence(
-            url=self.config['cfl_base_url'], username=self.config['cfl_user'], password=self.config['cfl_pwd'])
+            url=self.config['cfl_base_url'], username=self.config['cfl_user'], password=self.config['cfl_pwd'],
+            session=session)
         # self.redirect_rest_logging_to_logfile()
 
     def redirect_rest_logging_to_logfile(self):
@@ -51,6 +52,11 @@ class ConfluencePublisher:
             print(response)
         return response
 
+    def attach_file(self, page_id: int, file_path: str, name: str=None, content_type: str=None, comment: str=None):
+        # an existing attachment with the same name is replaced by a new version
+        return self.confluence.attach_file(
+            file_path, name=name, content_type=content_type, page_id=page_id, comment=comment)
+
     def render(self, template: str, data: dict) -> str:
         with open(template, encoding='utf-8') as file_:
             template = Template(file_.read())
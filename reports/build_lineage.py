@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Builds a table linking maps via the map services (and search stores) they use
+to the database tables serving the underlying service layers. The table
+contains the most recent snapshot only and allows for fast impact analyses in
+both directions, i.e. finding maps using a database table and finding
+database tables used by a map.
+'''
+import os
+import time
+import logging
+
+from sqlalchemy import select, literal, null, and_, cast, func, String
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+
+from table_defs.lineage_report import lineage_report_table_def
+from table_defs.mapapps_reports import mapapps_service_table_def
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+
+def build_lineage(args):
+    """
+    (Re-)Builds lineage table from most recent entries in map service, search
+    store and ArcGIS service layer reports.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+
+    t0 = time.time()
+
+    logging.info("Building lineage of maps, services and database tables in %s" % cfg['lineage_tgt_tbl'])
+
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+
+    if cfg.get('initial'):
+        db_utils.drop_create_table_by_def(lineage_report_table_def(cfg['lineage_tgt_tbl']), engine, True)
+    if not db_utils.table_exists(engine, cfg['lineage_tgt_tbl']):
+        db_utils.drop_create_table_by_def(lineage_report_table_def(cfg['lineage_tgt_tbl']), engine)
+
+    # service folders of map services have been added to existing reports
+    if db_utils.table_exists(engine, cfg['ma_tgt_service_tbl']):
+        db_utils.add_missing_columns(mapapps_service_table_def(cfg['ma_tgt_service_tbl']), engine)
+
+    tgt_tbl = db_utils.get_table_definition_with_engine(cfg['lineage_tgt_tbl'], engine)
+    ags_tbl = db_utils.get_table_definition_with_engine(cfg['ags_tgt_table'], engine)
+    svc_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_service_tbl'], engine)
+    search_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_search_tbl'], engine)
+
+    ags_date = db_utils.get_most_recent_date(ags_tbl, 'reference_date', engine)
+    svc_date = db_utils.get_most_recent_date(svc_tbl, 'reference_date', engine)
+    search_date = db_utils.get_most_recent_date(search_tbl, 'reference_date', engine)
+
+    if ags_date is None or svc_date is None:
+        logging.warning("Unable to build lineage without entries in service reports")
+        return
+
+    # using the most recent report of each environment, as environments may
+    # have been queried on different dates
+    ags_dates = get_latest_dates(ags_tbl)
+    svc_dates = get_latest_dates(svc_tbl)
+    search_dates = get_latest_dates(search_tbl)
+
+    cols = [
+        'app_id', 'app_title', 'app_env', 'source', 'app_layer_id', 'svc_env', 'svc_folder', 'svc_name',
+        'svc_layer_id', 'db', 'db_schema', 'db_table', 'reference_date']
+
+    # linking services used in maps to layers of ArcGIS services
+    svc_select = select([
+        svc_tbl.c.app_id, svc_tbl.c.app_title, svc_tbl.c.env, literal('map'), svc_tbl.c.svc_id,
+        svc_tbl.c.svc_env, ags_tbl.c.svc_folder, svc_tbl.c.svc_name, cast(null(), ags_tbl.c.objectid.type),
+        ags_tbl.c.db, ags_tbl.c.db_schema, ags_tbl.c.db_table, svc_tbl.c.reference_date
+    ]).select_from(svc_tbl.join(svc_dates, and_(
+        svc_dates.c.env == svc_tbl.c.env,
+        svc_dates.c.reference_date == svc_tbl.c.reference_date)
+    ).join(ags_tbl, and_(
+        ags_tbl.c.svc_folder == svc_tbl.c.svc_folder,
+        ags_tbl.c.svc_name == svc_tbl.c.svc_name,
+        ags_tbl.c.env == svc_tbl.c.svc_env)
+    ).join(ags_dates, and_(
+        ags_dates.c.env == ags_tbl.c.env,
+        ags_dates.c.reference_date == ags_tbl.c.reference_date)))
+
+    # linking search stores used in maps to layers of ArcGIS services
+    search_select = select([
+        search_tbl.c.app_id, search_tbl.c.app_title, search_tbl.c.env, literal('search'),
+        cast(search_tbl.c.search_id, String), search_tbl.c.svc_env, ags_tbl.c.svc_folder, search_tbl.c.svc_name,
+        search_tbl.c.svc_layer_id, ags_tbl.c.db, ags_tbl.c.db_schema, ags_tbl.c.db_table,
+        search_tbl.c.reference_date
+    ]).select_from(search_tbl.join(search_dates, and_(
+        search_dates.c.env == search_tbl.c.env,
+        search_dates.c.reference_date == search_tbl.c.reference_date)
+    ).join(ags_tbl, and_(
+        ags_tbl.c.svc_folder == search_tbl.c.svc_directory,
+        ags_tbl.c.svc_name == search_tbl.c.svc_name,
+        ags_tbl.c.env == search_tbl.c.svc_env)
+    ).join(ags_dates, and_(
+        ags_dates.c.env == ags_tbl.c.env,
+        ags_dates.c.reference_date == ags_tbl.c.reference_date)))
+
+    if cfg.get('dry_run'):
+        logging.info(
+            "Lineage would be rebuilt from most recent reports per environment up to %s (maps) and %s (services)" % (
+                svc_date, ags_date))
+        return
+
+    # replacing previous snapshot in a single transaction
+    with engine.begin() as connection:
+        connection.execute(tgt_tbl.delete())
+        result = connection.execute(tgt_tbl.insert().from_select(cols, svc_select))
+        logging.info("%d links between maps and database tables found" % result.rowcount)
+        if search_date is not None:
+            result = connection.execute(tgt_tbl.insert().from_select(cols, search_select))
+            logging.info("%d links between search stores and database tables found" % result.rowcount)
+
+    t1 = time.time()
+    logging.info("Lineage built in %s" % (utils.format_interval(t1 - t0)))
+
+
+def get_latest_dates(tbl):
+    """
+    Gets selectable of the most recent reference date per environment in the
+    specified report table.
+    """
+    return select([
+        tbl.c.env, func.max(tbl.c.reference_date).label('reference_date')]).group_by(tbl.c.env).alias()
+
+
+def get_apps_by_table(args):
+    """
+    Retrieves maps (directly or via search stores) using the specified
+    database table, optionally qualified by schema and database.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+    tgt_tbl = db_utils.get_table_definition_with_engine(cfg['lineage_tgt_tbl'], engine)
+
+    tokens = cfg['db_table'].lower().split('.')
+    conditions = [tgt_tbl.c.db_table == tokens[-1]]
+    if len(tokens) > 1:
+        conditions.append(tgt_tbl.c.db_schema == tokens[-2])
+    if len(tokens) > 2:
+        conditions.append(func.lower(tgt_tbl.c.db) == tokens[-3])
+    if cfg.get('query_environment') not in (None, 'all'):
+        conditions.append(tgt_tbl.c.svc_env == cfg['query_environment'])
+
+    select_stmt = select([
+        tgt_tbl.c.app_env, tgt_tbl.c.app_id, tgt_tbl.c.app_title, tgt_tbl.c.source,
+        tgt_tbl.c.svc_env, tgt_tbl.c.svc_folder, tgt_tbl.c.svc_name
+    ]).where(and_(*conditions)).distinct().order_by(tgt_tbl.c.app_env, tgt_tbl.c.app_id)
+
+    with engine.connect() as connection:
+        return connection.execute(select_stmt).fetchall()
+
+
+def get_tables_by_app(args):
+    """
+    Retrieves database tables used (directly or via search stores) by the
+    specified map.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+    tgt_tbl = db_utils.get_table_definition_with_engine(cfg['lineage_tgt_tbl'], engine)
+
+    conditions = [tgt_tbl.c.app_id == cfg['app_id']]
+    if cfg.get('query_environment') not in (None, 'all'):
+        conditions.append(tgt_tbl.c.app_env == cfg['query_environment'])
+
+    select_stmt = select([
+        tgt_tbl.c.app_env, tgt_tbl.c.db, tgt_tbl.c.db_schema, tgt_tbl.c.db_table, tgt_tbl.c.source,
+        tgt_tbl.c.svc_env, tgt_tbl.c.svc_folder, tgt_tbl.c.svc_name
+    ]).where(and_(*conditions)).distinct().order_by(
+        tgt_tbl.c.app_env, tgt_tbl.c.db_schema, tgt_tbl.c.db_table)
+
+    with engine.connect() as connection:
+        return connection.execute(select_stmt).fetchall()
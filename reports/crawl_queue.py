@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Work queue for distributed crawling. A coordinator enqueues services and maps
+into a queue table in the target database, any number of workers claim
+batches of items using row-level locks (FOR UPDATE SKIP LOCKED), crawl them
+and write their results. Claimed items are leased to a worker for a limited
+time that is extended by heartbeats, i.e. items of crashed workers are claimed
+again after their lease expired. Items are handed over as JSON, i.e. workers
+never execute anything read from the queue table.
+'''
+import json
+import logging
+import datetime
+
+from types import SimpleNamespace
+
+from sqlalchemy import select, func, and_, or_
+
+import utils.db_utils as db_utils
+
+from table_defs.crawl_queue import crawl_queue_table_def
+
+STATUS_QUEUED = 'queued'
+STATUS_CLAIMED = 'claimed'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+DEFAULT_QUEUE_CFG = {
+    # number of items claimed by a worker at once
+    'batch_size': 10,
+    # seconds a claimed item is reserved for a worker without heartbeat
+    'lease_seconds': 300,
+    # maximum number of times an item is claimed
+    'max_attempts': 3,
+    # seconds an idle worker waits before polling the queue again
+    'poll_interval': 10,
+}
+
+
+def get_queue_cfg(cfg):
+    """
+    Gets queue settings from the specified configuration, completed by default
+    values.
+    """
+    queue_cfg = dict(DEFAULT_QUEUE_CFG)
+    queue_cfg.update(cfg.get('queue_cfg') or dict())
+    return queue_cfg
+
+
+def get_queue_table(cfg, engine):
+    """
+    Gets definition of the queue table, creating the table if necessary.
+    """
+    if not db_utils.table_exists(engine, cfg['queue_tbl']):
+        db_utils.drop_create_table_by_def(crawl_queue_table_def(cfg['queue_tbl']), engine)
+    return db_utils.get_table_definition_with_engine(cfg['queue_tbl'], engine)
+
+
+def get_item_key(report_type, item):
+    """
+    Gets identifier for the specified item.
+    """
+    if report_type == 'ags_service_layers':
+        return "%s/%s" % (item['folderName'], item['serviceName'])
+    return item.id
+
+
+def enqueue_items(cfg, engine, report_type, items):
+    """
+    Enqueues specified items to be crawled for the given report type in the
+    currently queried environment, replacing items enqueued previously for the
+    same reference date.
+    """
+    if cfg['dry_run']:
+        logging.info("%d items would be enqueued for distributed crawling" % len(items))
+        return
+
+    queue_tbl = get_queue_table(cfg, engine)
+    now = datetime.datetime.now()
+
+    with engine.begin() as connection:
+        connection.execute(queue_tbl.delete().where(and_(
+            queue_tbl.c.report_type == report_type,
+            queue_tbl.c.env == cfg['query_environment'],
+            queue_tbl.c.reference_date == cfg['ref_date'])))
+        db_utils.insert_rows(connection, queue_tbl, [{
+            'report_type': report_type,
+            'env': cfg['query_environment'],
+            'reference_date': cfg['ref_date'],
+            'item_key': get_item_key(report_type, item),
+            'payload': encode_payload(item),
+            'status': STATUS_QUEUED,
+            'attempts': 0,
+            'enqueued_at': now,
+        } for item in items])
+
+    logging.info("%d items enqueued for distributed crawling in %s" % (len(items), cfg['queue_tbl']))
+
+
+def claim_items(engine, queue_tbl, worker_id, queue_cfg, report_type=None, env=None):
+    """
+    Claims a batch of queued items (or items whose lease has expired) for the
+    specified worker. Items currently locked by other workers are skipped.
+    """
+    now = func.now()
+    lease_expires = now + datetime.timedelta(seconds=queue_cfg['lease_seconds'])
+
+    conditions = [
+        or_(
+            queue_tbl.c.status == STATUS_QUEUED,
+            and_(queue_tbl.c.status == STATUS_CLAIMED, queue_tbl.c.lease_expires < now)),
+        queue_tbl.c.attempts < queue_cfg['max_attempts']]
+    if report_type:
+        conditions.append(queue_tbl.c.report_type == report_type)
+    if env:
+        conditions.append(queue_tbl.c.env == env)
+
+    candidates = select([queue_tbl.c.objectid]).where(and_(*conditions)).order_by(
+        queue_tbl.c.objectid).limit(queue_cfg['batch_size']).with_for_update(skip_locked=True)
+
+    claim_stmt = queue_tbl.update().where(queue_tbl.c.objectid.in_(candidates)).values(
+        status=STATUS_CLAIMED, worker=worker_id, attempts=queue_tbl.c.attempts + 1,
+        lease_expires=lease_expires
+    ).returning(
+        queue_tbl.c.objectid, queue_tbl.c.report_type, queue_tbl.c.env, queue_tbl.c.reference_date,
+        queue_tbl.c.item_key, queue_tbl.c.payload)
+
+    with engine.begin() as connection:
+        # giving up on items whose lease expired too often, i.e. probably crashing workers
+        connection.execute(queue_tbl.update().where(and_(
+            queue_tbl.c.status == STATUS_CLAIMED,
+            queue_tbl.c.lease_expires < now,
+            queue_tbl.c.attempts >= queue_cfg['max_attempts'])
+        ).values(status=STATUS_FAILED, reason='Lease expired too often', finished_at=now))
+        rows = connection.execute(claim_stmt).fetchall()
+
+        items = list()
+        for row in rows:
+            try:
+                item = decode_payload(row.payload)
+            except (ValueError, TypeError, KeyError) as e:
+                logging.warning("Unable to decode queued item '%s': %s", row.item_key, e)
+                connection.execute(queue_tbl.update().where(queue_tbl.c.objectid == row.objectid).values(
+                    status=STATUS_FAILED, reason='Invalid payload', finished_at=now))
+                continue
+            items.append({
+                'objectid': row.objectid, 'report_type': row.report_type, 'env': row.env,
+                'reference_date': row.reference_date, 'item_key': row.item_key, 'item': item})
+
+    return items
+
+
+def encode_value(value):
+    """
+    Encodes values of queued items not natively supported by JSON, i.e.
+    dates and timestamps.
+    """
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    raise TypeError("Unable to enqueue value of type %s" % type(value).__name__)
+
+
+def decode_value(obj):
+    """
+    Restores dates and timestamps of queued items.
+    """
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def encode_payload(item):
+    """
+    Serializes specified item, i.e. a service dictionary or a source database
+    row, as JSON.
+    """
+    if isinstance(item, SimpleNamespace):
+        payload = {'namespace': vars(item)}
+    else:
+        payload = {'dict': item}
+    return json.dumps(payload, default=encode_value).encode('utf-8')
+
+
+def decode_payload(payload):
+    """
+    Restores item from its JSON serialization.
+    """
+    payload = json.loads(bytes(payload).decode('utf-8'), object_hook=decode_value)
+    if 'namespace' in payload:
+        return SimpleNamespace(**payload['namespace'])
+    return payload['dict']
+
+
+def extend_leases(engine, queue_tbl, worker_id, queue_cfg):
+    """
+    Extends leases of all items currently claimed by the specified worker.
+    """
+    lease_expires = func.now() + datetime.timedelta(seconds=queue_cfg['lease_seconds'])
+    with engine.begin() as connection:
+        connection.execute(queue_tbl.update().where(and_(
+            queue_tbl.c.worker == worker_id, queue_tbl.c.status == STATUS_CLAIMED)
+        ).values(lease_expires=lease_expires))
+
+
+def finish_item(connection, queue_tbl, objectid, worker_id, reason=None):
+    """
+    Marks specified item as done (or failed if a reason is given) using the
+    provided connection. Returns False if the item has been claimed by another
+    worker in the meantime.
+    """
+    result = connection.execute(queue_tbl.update().where(and_(
+        queue_tbl.c.objectid == objectid, queue_tbl.c.worker == worker_id,
+        queue_tbl.c.status == STATUS_CLAIMED)
+    ).values(
+        status=STATUS_FAILED if reason else STATUS_DONE, reason=reason[:1024] if reason else None,
+        finished_at=func.now()))
+    return result.rowcount == 1
+
+
+def count_pending_items(engine, queue_tbl, report_type=None, env=None):
+    """
+    Counts items not yet processed, i.e. queued or currently claimed.
+    """
+    conditions = [queue_tbl.c.status.in_([STATUS_QUEUED, STATUS_CLAIMED])]
+    if report_type:
+        conditions.append(queue_tbl.c.report_type == report_type)
+    if env:
+        conditions.append(queue_tbl.c.env == env)
+    with engine.connect() as connection:
+        return connection.execute(
+            select([func.count()]).select_from(queue_tbl).where(and_(*conditions))).scalar()
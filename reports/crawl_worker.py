@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Worker for distributed crawling. Claims batches of services and maps from the
+crawl queue, crawls them using the per-item logic of the corresponding report
+and writes the results together with the item status in one transaction.
+'''
+import os
+import time
+import socket
+import logging
+import threading
+
+from lxml import etree
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+import utils.http_utils as http_utils
+import utils.progress_utils as progress_utils
+
+import reports.crawl_queue as crawl_queue
+import reports.query_ags_service_layers as ags_query
+import reports.query_mapapps_maps as mapapps_query
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+
+class LeaseLost(Exception):
+    """
+    Raised if an item has been claimed by another worker in the meantime.
+    """
+    pass
+
+
+def run_worker(args):
+    """
+    Claims and crawls queued items until no items are left (if requested to
+    exit when idle) or forever.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+    queue_cfg = crawl_queue.get_queue_cfg(cfg)
+    worker_id = "%s:%d:%s" % (socket.gethostname(), os.getpid(), utils.get_random_string(4, lower=True))
+
+    logging.info("Starting crawl worker %s" % worker_id)
+
+    http_utils.configure(cfg)
+
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+    queue_tbl = crawl_queue.get_queue_table(cfg, engine)
+
+    # per-environment configurations, tokens and target tables
+    item_cfgs = dict()
+    tokens = dict()
+    tgt_tables = dict()
+
+    # extending leases of claimed items periodically
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=send_heartbeats, args=(engine, queue_tbl, worker_id, queue_cfg, stop_heartbeat), daemon=True)
+    heartbeat.start()
+
+    item_cnt = 0
+    failed_cnt = 0
+    t0 = time.time()
+    progress = progress_utils.Progress("Worker %s" % worker_id, interval=cfg.get('progress_interval'))
+
+    try:
+        while True:
+            items = crawl_queue.claim_items(
+                engine, queue_tbl, worker_id, queue_cfg, cfg.get('worker_report_type'), cfg.get('worker_env'))
+            if not items:
+                if cfg.get('exit_when_idle') and not crawl_queue.count_pending_items(
+                        engine, queue_tbl, cfg.get('worker_report_type'), cfg.get('worker_env')):
+                    break
+                time.sleep(queue_cfg['poll_interval'])
+                continue
+
+            for item in items:
+                item_key = (item['report_type'], item['env'], item['reference_date'])
+                if item_key not in item_cfgs:
+                    item_cfg = utils.complete_configuration(ENV, dict(args, query_environment=item['env']))
+                    item_cfg['ref_date'] = item['reference_date']
+                    item_cfgs[item_key] = item_cfg
+                item_cfg = item_cfgs[item_key]
+
+                reason = None
+                rows = dict()
+                logging.debug("Crawling %s item '%s' in '%s'", item['report_type'], item['item_key'], item['env'])
+                try:
+                    rows = crawl_item(item_cfg, item, tokens)
+                except http_utils.RequestFailed as e:
+                    reason = e.reason
+                except etree.XMLSyntaxError as e:
+                    reason = "Invalid manifest (%s)" % e
+                except mapapps_query.InvalidConfiguration as e:
+                    reason = "Invalid JSON configuration (%s)" % e
+                except ValueError as e:
+                    reason = "Invalid response (%s)" % e
+                except Exception as e:
+                    logging.exception("Unexpected error while crawling '%s'", item['item_key'])
+                    reason = "Unexpected error (%s: %s)" % (e.__class__.__name__, e)
+
+                try:
+                    with engine.begin() as connection:
+                        if not crawl_queue.finish_item(connection, queue_tbl, item['objectid'], worker_id, reason):
+                            raise LeaseLost()
+                        for tbl_key, tbl_rows in rows.items():
+                            if tbl_key not in tgt_tables:
+                                tgt_tables[tbl_key] = db_utils.get_table_definition_with_engine(
+                                    item_cfg[tbl_key], engine)
+                            if tbl_rows:
+                                db_utils.insert_rows(connection, tgt_tables[tbl_key], tbl_rows)
+                except LeaseLost:
+                    logging.warning("Lease for '%s' lost, discarding results", item['item_key'])
+                    continue
+
+                item_cnt += 1
+                progress.update(failed=bool(reason))
+                if reason:
+                    failed_cnt += 1
+                    logging.warning("Unable to crawl '%s': %s", item['item_key'], reason)
+    finally:
+        stop_heartbeat.set()
+
+    logging.info("%d items crawled (%d failed) in %s" % (
+        item_cnt, failed_cnt, utils.format_interval(time.time() - t0)))
+    http_utils.log_failed_requests()
+
+
+def crawl_item(cfg, item, tokens):
+    """
+    Crawls specified queue item, returning resulting rows by configuration key
+    of the corresponding target table.
+    """
+    if item['report_type'] == 'ags_service_layers':
+        if item['env'] not in tokens:
+            tokens[item['env']] = ags_query.get_env_token(cfg, cfg['environments'][item['env']])
+        return {'ags_tgt_table': ags_query.crawl_service(cfg, tokens[item['env']], item['item'])}
+
+    single_app_info, searches, basemaps, maps = mapapps_query.crawl_app(cfg, item['item'])
+    return {
+        'ma_tgt_tbl': [single_app_info],
+        'ma_tgt_search_tbl': searches,
+        'ma_tgt_basemap_tbl': basemaps,
+        'ma_tgt_service_tbl': maps,
+    }
+
+
+def send_heartbeats(engine, queue_tbl, worker_id, queue_cfg, stop_event):
+    """
+    Extends leases of items claimed by the specified worker until stopped.
+    """
+    while not stop_event.wait(queue_cfg['lease_seconds'] / 3):
+        try:
+            crawl_queue.extend_leases(engine, queue_tbl, worker_id, queue_cfg)
+        except Exception as e:
+            logging.warning("Unable to extend leases: %s" % e)
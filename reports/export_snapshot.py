@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Exports daily snapshots of report tables into compressed, column-typed Parquet
+files partitioned by reference date and environment, i.e.
+
+    <export_dir>/<table>/reference_date=<YYYY-MM-DD>/env=<env>/part-0.parquet
+
+Exported snapshots may be queried locally (and memory-mapped) without putting
+load on the reporting database.
+'''
+import os
+import time
+import shutil
+import logging
+import datetime
+
+from sqlalchemy import select
+from sqlalchemy.types import Integer, Boolean, Date, DateTime, ARRAY, JSON
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+# configuration keys of report tables exported by default
+EXPORT_TABLE_KEYS = ['ags_tgt_table', 'ma_tgt_tbl', 'ma_tgt_search_tbl', 'ma_tgt_basemap_tbl', 'ma_tgt_service_tbl']
+# columns used to partition exported files
+PARTITION_COLS = ['reference_date', 'env']
+
+
+def export_snapshot(args):
+    """
+    Exports snapshot of report tables for the specified (or most recent)
+    reference date.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+
+    if pa is None:
+        logging.error("Unable to export snapshots, pyarrow is not available")
+        return
+
+    t0 = time.time()
+
+    export_dir = cfg.get('export_dir', 'export')
+    compression = cfg.get('export_compression', 'zstd')
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+
+    for tbl_key in cfg.get('export_tables') or EXPORT_TABLE_KEYS:
+        src_tbl = db_utils.get_table_definition_with_engine(cfg[tbl_key], engine)
+
+        if cfg.get('ref_date'):
+            ref_date = datetime.date.fromisoformat(str(cfg['ref_date']))
+        else:
+            ref_date = db_utils.get_most_recent_date(src_tbl, 'reference_date', engine)
+        if ref_date is None:
+            logging.warning("No entries found in %s" % cfg[tbl_key])
+            continue
+
+        select_stmt = select([src_tbl]).where(src_tbl.c.reference_date == ref_date)
+        if cfg.get('query_environment') not in (None, 'all'):
+            select_stmt = select_stmt.where(src_tbl.c.env == cfg['query_environment'])
+
+        with engine.connect() as connection:
+            rows = connection.execute(select_stmt.order_by(src_tbl.c.env, src_tbl.c.objectid)).fetchall()
+
+        logging.info("%d rows retrieved from %s for %s" % (len(rows), cfg[tbl_key], ref_date))
+
+        schema = get_arrow_schema(src_tbl)
+        env_idx = list(src_tbl.columns.keys()).index('env')
+        for env_name in sorted(set(row[env_idx] for row in rows)):
+            env_rows = [row for row in rows if row[env_idx] == env_name]
+            arrow_tbl = pa.Table.from_pylist([
+                {name: row[name] for name in schema.names} for row in env_rows], schema=schema)
+            tgt_dir = os.path.join(
+                export_dir, src_tbl.name, "reference_date=%s" % ref_date.isoformat(), "env=%s" % env_name)
+            if cfg.get('dry_run'):
+                logging.info("%d rows would be exported to %s" % (len(env_rows), tgt_dir))
+                continue
+            # replacing previous export of the same snapshot
+            if os.path.isdir(tgt_dir):
+                shutil.rmtree(tgt_dir)
+            os.makedirs(tgt_dir)
+            pq.write_table(arrow_tbl, os.path.join(tgt_dir, 'part-0.parquet'), compression=compression)
+            logging.info("%d rows exported to %s" % (len(env_rows), tgt_dir))
+
+    t1 = time.time()
+    logging.info("Export finished in %s" % (utils.format_interval(t1 - t0)))
+
+
+def get_arrow_type(col_type):
+    """
+    Gets Arrow data type corresponding to the specified SQLAlchemy column type.
+    """
+    if isinstance(col_type, ARRAY):
+        return pa.list_(get_arrow_type(col_type.item_type))
+    # arrays of strings are stored as JSON in databases without native arrays
+    if isinstance(col_type, JSON):
+        return pa.list_(pa.string())
+    if isinstance(col_type, Boolean):
+        return pa.bool_()
+    if isinstance(col_type, Integer):
+        return pa.int64()
+    if isinstance(col_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(col_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def get_arrow_schema(src_tbl):
+    """
+    Gets Arrow schema for all columns of the specified table except the ones
+    used for partitioning.
+    """
+    return pa.schema([
+        pa.field(c.name, get_arrow_type(c.type)) for c in src_tbl.columns if c.name not in PARTITION_COLS])
+
+
+def read_snapshots(export_dir, table_name, columns=None, filters=None):
+    """
+    Reads exported snapshots of the specified table as (memory-mapped) Arrow
+    table, optionally restricted to given columns and matching filters, e.g.
+    [('env', '=', 'prod'), ('reference_date', '>=', datetime.date(2021, 1, 1))].
+    """
+    partitioning = ds.partitioning(
+        pa.schema([('reference_date', pa.date32()), ('env', pa.string())]), flavor='hive')
+    return pq.read_table(
+        os.path.join(export_dir, table_name), columns=columns, filters=filters,
+        partitioning=partitioning, memory_map=True)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Loads spooled rows into the report tables whenever the target database is
+reachable. Every segment replaces the rows for its table, environment and
+reference date. Loaded segments are tracked by checksum in the target
+database, so segments are loaded only once and never override rows of a
+segment spooled later. Segments that can't be loaded because the database
+is unavailable remain in the spool for the next attempt.
+'''
+import os
+import time
+import logging
+import datetime
+import threading
+
+from sqlalchemy import select, and_, exc
+from sqlalchemy.types import Date, DateTime
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+import utils.spool_utils as spool_utils
+
+from table_defs.ags_service_layer_report import ags_service_layer_report_table_def
+from table_defs.mapapps_reports import mapapps_basemap_table_def
+from table_defs.mapapps_reports import mapapps_report_table_def
+from table_defs.mapapps_reports import mapapps_search_table_def
+from table_defs.mapapps_reports import mapapps_service_table_def
+from table_defs.spool_loads import spool_load_table_def
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+# table definitions by configuration key of spooled target tables
+SPOOL_TABLE_DEFS = {
+    'ags_tgt_table': ags_service_layer_report_table_def,
+    'ma_tgt_tbl': mapapps_report_table_def,
+    'ma_tgt_search_tbl': mapapps_search_table_def,
+    'ma_tgt_basemap_tbl': mapapps_basemap_table_def,
+    'ma_tgt_service_tbl': mapapps_service_table_def,
+}
+
+# loads within the same process are serialized
+LOCK = threading.Lock()
+
+
+def load_spool(args):
+    """
+    Loads all pending spool segments into the report tables.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+    return load_segments(cfg)
+
+
+def load_segments(cfg):
+    """
+    Loads all pending spool segments into the report tables. Returns whether
+    the spool has been emptied.
+    """
+    with LOCK:
+        segments = spool_utils.get_pending_segments(cfg)
+        if not segments:
+            logging.info("No spooled segments to be loaded")
+            return True
+
+        if cfg.get('dry_run'):
+            for header, segment_path in segments:
+                logging.info("%d rows for %s (%s, %s) would be loaded from %s" % (
+                    header['rows'], header['table'], header['env'], header['reference_date'], segment_path))
+            return True
+
+        t0 = time.time()
+        loaded_cnt = 0
+        try:
+            engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+            if not db_utils.table_exists(engine, cfg['spool_load_tbl']):
+                db_utils.drop_create_table_by_def(spool_load_table_def(cfg['spool_load_tbl']), engine)
+            load_tbl = db_utils.get_table_definition_with_engine(cfg['spool_load_tbl'], engine)
+
+            if cfg.get('initial'):
+                for tbl_key in sorted(set(header['table'] for header, _ in segments)):
+                    db_utils.drop_create_table_by_def(SPOOL_TABLE_DEFS[tbl_key](cfg[tbl_key]), engine, True)
+
+            # only the most recent segment per table, environment and reference
+            # date is loaded, earlier ones would be replaced anyway
+            latest = dict()
+            for header, segment_path in segments:
+                latest[(header['table'], header['env'], header['reference_date'])] = segment_path
+
+            for header, segment_path in segments:
+                if latest[(header['table'], header['env'], header['reference_date'])] != segment_path:
+                    logging.info("Skipping superseded segment %s" % segment_path)
+                    spool_utils.mark_loaded(cfg, segment_path)
+                elif load_segment(cfg, engine, load_tbl, header, segment_path):
+                    loaded_cnt += 1
+        except (exc.OperationalError, exc.InterfaceError) as e:
+            logging.warning("Target database unavailable, %d spooled segments remain to be loaded: %s" % (
+                len(spool_utils.get_pending_segments(cfg)), str(e).splitlines()[0]))
+            return False
+
+    logging.info("%d spooled segments loaded in %s" % (loaded_cnt, utils.format_interval(time.time() - t0)))
+    return True
+
+
+def load_segment(cfg, engine, load_tbl, header, segment_path):
+    """
+    Loads specified spool segment into its target table unless it has already
+    been loaded or has been superseded by a segment spooled later for the same
+    table, environment and reference date. Returns whether rows were loaded.
+    """
+    checksum = spool_utils.get_checksum(segment_path)
+    ref_date = datetime.date.fromisoformat(header['reference_date'])
+    created_at = datetime.datetime.fromisoformat(header['created_at'])
+
+    with engine.connect() as connection:
+        loaded = connection.execute(select([load_tbl.c.objectid]).where(load_tbl.c.checksum == checksum)).first()
+        superseded = connection.execute(select([load_tbl.c.objectid]).where(and_(
+            load_tbl.c.tgt_table == header['table'], load_tbl.c.env == header['env'],
+            load_tbl.c.reference_date == ref_date, load_tbl.c.created_at > created_at))).first()
+    if loaded or superseded:
+        logging.info("Skipping %s segment %s" % ('loaded' if loaded else 'superseded', segment_path))
+        spool_utils.mark_loaded(cfg, segment_path)
+        return False
+
+    tbl_key = header['table']
+    if not db_utils.table_exists(engine, cfg[tbl_key]):
+        db_utils.drop_create_table_by_def(SPOOL_TABLE_DEFS[tbl_key](cfg[tbl_key]), engine)
+    else:
+        db_utils.add_missing_columns(SPOOL_TABLE_DEFS[tbl_key](cfg[tbl_key]), engine)
+    tgt_table = db_utils.get_table_definition_with_engine(cfg[tbl_key], engine)
+
+    rows = decode_rows(tgt_table, spool_utils.read_rows(segment_path))
+    tgt_delete_stmt = tgt_table.delete().where(and_(
+        tgt_table.c.reference_date == ref_date, tgt_table.c.env == header['env']))
+
+    logging.info("Loading %d rows from %s into %s" % (len(rows), segment_path, cfg[tbl_key]))
+    if not db_utils.replace_rows(engine, tgt_table, rows, tgt_delete_stmt, cfg.get('load_mode') or 'direct'):
+        logging.error("Unable to load %s, keeping it spooled" % segment_path)
+        return False
+
+    with engine.connect() as connection:
+        connection.execute(load_tbl.insert().values(
+            checksum=checksum, segment=os.path.basename(segment_path), tgt_table=tbl_key, env=header['env'],
+            reference_date=ref_date, created_at=created_at, row_count=len(rows),
+            loaded_at=datetime.datetime.now()))
+    spool_utils.mark_loaded(cfg, segment_path)
+    return True
+
+
+def decode_rows(tgt_table, rows):
+    """
+    Restores dates and timestamps in spooled rows according to the column
+    types of the specified target table.
+    """
+    decoders = dict()
+    for col in tgt_table.columns:
+        if isinstance(col.type, DateTime):
+            decoders[col.name] = datetime.datetime.fromisoformat
+        elif isinstance(col.type, Date):
+            decoders[col.name] = datetime.date.fromisoformat
+
+    for row in rows:
+        for col_name, decoder in decoders.items():
+            if row.get(col_name) is not None:
+                row[col_name] = decoder(row[col_name])
+    return rows
@@ -2,42 +2,193 @@
 # -*- coding: utf-8 -*-
 
 import os
+import csv
+import gzip
+import time
 import logging
+import tempfile
+import threading
 
-from sqlalchemy import create_engine
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from requests.adapters import HTTPAdapter
 
 import utils.general_utils as utils
 import utils.db_utils as db_utils
+import utils.profiling as profiling
 
 from confluence.confluence_publisher import ConfluencePublisher
 
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
 ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
 
 TPL_DIR = os.path.join('confluence', 'templates')
 
+# maximum number of pooled connections to Confluence
+CFL_POOL_SIZE = 8
+
+PUBLISH_MODES = ['page', 'attachment']
+ATTACHMENT_FORMATS = {
+    'csv': ('csv.gz', 'application/gzip'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# publisher shared by all publications, using one keep-alive session
+PUBLISHER = None
+LOCK = threading.Lock()
+
+
+def publish_reports(args, report_types):
+    """
+    Publishes specified report types concurrently, using a shared Confluence
+    session.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+    publisher = get_publisher(cfg)
+
+    results = dict()
+    with ThreadPoolExecutor(max_workers=len(report_types), thread_name_prefix='publish') as executor:
+        futures = {
+            executor.submit(publish_report, dict(args, report_type=report_type), publisher): report_type
+            for report_type in report_types}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    for report_type, (status, duration) in sorted(results.items()):
+        logging.info("Report '%s': %s in %s" % (report_type, status, utils.format_interval(duration)))
+    return results
+
+
+def get_publisher(cfg):
+    """
+    Gets shared Confluence publisher with a keep-alive session and a bounded
+    connection pool.
+    """
+    global PUBLISHER
+    with LOCK:
+        if PUBLISHER is None:
+            pool_size = cfg.get('cfl_pool_size') or CFL_POOL_SIZE
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            PUBLISHER = ConfluencePublisher(cfg, session=session)
+    return PUBLISHER
 
-def publish_report(args):
+
+def publish_report(args, publisher=None):
     """
-    Publishes report.
+    Publishes report, returning its status and the time it took.
     """
+    t0 = time.time()
     cfg = utils.complete_configuration(ENV, args)
+    try:
+        do_publish_report(cfg, publisher or get_publisher(cfg))
+    except Exception:
+        logging.exception("Unable to publish report '%s'" % cfg['report_type'])
+        return 'failed', time.time() - t0
+    duration = time.time() - t0
+    logging.info("Report '%s' published in %s" % (cfg['report_type'], utils.format_interval(duration)))
+    return 'published', duration
+
 
+def do_publish_report(cfg, publisher):
+    """
+    Retrieves, renders and uploads the configured report.
+    """
     cfl_cfg = cfg['cfl_cfg'][cfg['report_type']]
 
-    engine = create_engine(db_utils.get_db_connection(cfg['db_cfg'], cfg['tgt_db']))
-    publisher = ConfluencePublisher(cfg)
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
 
-    raw_content = prepare_report(cfl_cfg, engine)
+    with profiling.stage('source_read'):
+        raw_content = prepare_report(cfl_cfg, engine)
 
     logging.info("%d rows retrieved to be published" % len(raw_content))
 
+    if (cfg.get('publish_mode') or cfl_cfg.get('publish_mode', 'page')) == 'attachment':
+        publish_report_as_attachment(cfg, cfl_cfg, publisher, raw_content)
+        return
+
+    # publishing one page per distinct value of the partition column, if
+    # configured, or a single page
+    if cfl_cfg.get('partition_col'):
+        partitions = defaultdict(list)
+        for row in raw_content:
+            partitions[row[cfl_cfg['partition_col']]].append(row)
+        pages = [
+            ("%s (%s)" % (cfl_cfg['title'], value), rows)
+            for value, rows in sorted(partitions.items(), key=lambda item: str(item[0]))]
+    else:
+        pages = [(cfl_cfg['title'], raw_content)]
+
+    # not publishing more pages concurrently than connections are pooled
+    max_workers = min(len(pages), cfg.get('cfl_pool_size') or CFL_POOL_SIZE) or 1
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='page') as executor:
+        futures = [executor.submit(publish_page, cfg, cfl_cfg, publisher, title, rows) for title, rows in pages]
+        for future in futures:
+            future.result()
+
+
+def publish_page(cfg, cfl_cfg, publisher, title, rows):
+    """
+    Renders specified rows and publishes them as page with the given title.
+    """
     # rendering content
-    content = publisher.render(template=os.path.join(TPL_DIR, cfl_cfg['report_tpl']), data=raw_content)
+    with profiling.stage('render'):
+        content = publisher.render(template=os.path.join(TPL_DIR, cfl_cfg['report_tpl']), data=rows)
 
     if 'dry_run' in cfg and cfg['dry_run']:
-        logging.info("The following content would be published: %s..." % content[:5000])
+        logging.info("The following content would be published as '%s': %s..." % (title, content[:5000]))
     else:
-        publisher.create_or_update_page(parent_id=cfl_cfg['page_id'], title=cfl_cfg['title'], content=content)
+        with profiling.stage('upload'):
+            publisher.create_or_update_page(parent_id=cfl_cfg['page_id'], title=title, content=content)
+
+
+def publish_report_as_attachment(cfg, cfl_cfg, publisher, rows):
+    """
+    Publishes report as a page containing aggregated summary tables only, with
+    the full report attached as a compressed CSV or XLSX file.
+    """
+    attachment_format = cfl_cfg.get('attachment_format', 'csv')
+    extension, content_type = ATTACHMENT_FORMATS[attachment_format]
+    attachment_name = "%s.%s" % (cfl_cfg['src_tbl'].split('.')[-1], extension)
+
+    # rendering summary content
+    with profiling.stage('render'):
+        summary = prepare_summary(cfg['report_type'], rows)
+        summary['attachment'] = attachment_name
+        content = publisher.render(template=os.path.join(TPL_DIR, cfl_cfg['summary_tpl']), data=summary)
+
+    if 'dry_run' in cfg and cfg['dry_run']:
+        logging.info("The following content would be published: %s..." % content[:5000])
+        logging.info("%d rows would be attached as %s" % (len(rows), attachment_name))
+        return
+
+    with profiling.stage('upload'):
+        response = publisher.create_or_update_page(
+            parent_id=cfl_cfg['page_id'], title=cfl_cfg['title'], content=content)
+    if 'id' not in response:
+        logging.warning("Unable to publish summary page, skipping upload of %s" % attachment_name)
+        return
+
+    with profiling.stage('upload'), tempfile.TemporaryDirectory() as tmp_dir:
+        attachment_path = os.path.join(tmp_dir, attachment_name)
+        if attachment_format == 'xlsx':
+            write_xlsx(attachment_path, rows)
+        else:
+            write_csv(attachment_path, rows)
+        logging.info("Uploading %d rows as %s (%d bytes)" % (
+            len(rows), attachment_name, os.path.getsize(attachment_path)))
+        publisher.attach_file(
+            response['id'], attachment_path, name=attachment_name, content_type=content_type,
+            comment="Report for %s" % summary['reference_date'])
 
 
 def prepare_report(cfl_cfg, engine):
@@ -59,3 +210,80 @@ def prepare_report(cfl_cfg, engine):
         rows = connection.execute(select_stmt).fetchall()
 
     return rows
+
+
+def prepare_summary(report_type, rows):
+    """
+    Aggregates specified report rows into summary tables, i.e. counts per
+    environment and folder for ArcGIS service layers or counts per environment
+    and a list of invalid or unsecured services for map.apps maps.
+    """
+    summary = {
+        'row_count': len(rows),
+        'reference_date': rows[0]['reference_date'] if rows else None,
+    }
+
+    if report_type == 'ags_service_layers':
+        services = defaultdict(set)
+        layers = Counter()
+        for row in rows:
+            services[(row['env'], row['svc_folder'])].add(row['svc_name'])
+            layers[(row['env'], row['svc_folder'])] += 1
+        summary['folders'] = [
+            {'env': env, 'svc_folder': folder, 'services': len(services[(env, folder)]),
+             'layers': layers[(env, folder)]}
+            for env, folder in sorted(layers, key=lambda k: (k[0] or '', k[1] or ''))]
+        return summary
+
+    envs = defaultdict(lambda: {'apps': set(), 'services': 0, 'invalid': 0, 'unsecured': 0})
+    summary['issues'] = list()
+    for row in rows:
+        env = envs[row['env']]
+        env['apps'].add(row['app_id'])
+        env['services'] += 1
+        # services without status information aren't reported as issues
+        invalid = row['valid'] is not None and not row['valid']
+        unsecured = bool(row['valid']) and row['secured'] is not None and not row['secured']
+        if invalid:
+            env['invalid'] += 1
+        if unsecured:
+            env['unsecured'] += 1
+        if invalid or unsecured:
+            summary['issues'].append(row)
+    summary['envs'] = [
+        dict(envs[env], env=env, apps=len(envs[env]['apps'])) for env in sorted(envs, key=lambda e: e or '')]
+    return summary
+
+
+def write_csv(csv_path, rows):
+    """
+    Writes specified rows to a gzip-compressed CSV file.
+    """
+    with gzip.open(csv_path, 'wt', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file, delimiter=';')
+        if rows:
+            writer.writerow(rows[0].keys())
+        writer.writerows(get_cell_values(row) for row in rows)
+
+
+def write_xlsx(xlsx_path, rows):
+    """
+    Writes specified rows to an Excel workbook.
+    """
+    if openpyxl is None:
+        raise RuntimeError("XLSX attachments require openpyxl to be installed")
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    if rows:
+        worksheet.append(list(rows[0].keys()))
+    for row in rows:
+        worksheet.append(get_cell_values(row))
+    workbook.save(xlsx_path)
+
+
+def get_cell_values(row):
+    """
+    Gets values of the specified row as written to attachments, i.e. with
+    list values (e.g. loaded bundles or shared groups) joined by commas.
+    """
+    return [",".join(str(v) for v in value) if isinstance(value, (list, tuple)) else value for value in row]
@@ -9,28 +9,50 @@ It is required to have an Administrator level user account to be able to log
 in into the ArcGIS Server Administrator Directory.
 '''
 import os
+import json
 import time
+import hashlib
 import logging
 import urllib3
 import datetime
+import itertools
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from lxml import etree
 
-from arcrest import AGSTokenSecurityHandler
-from arcrest.manageags import AGSAdministration
-from sqlalchemy import create_engine, and_
+from sqlalchemy import and_
 
 from table_defs.ags_service_layer_report import ags_service_layer_report_table_def
+from table_defs.row_records import ServiceLayerRecord
 
 import utils.general_utils as utils
 import utils.db_utils as db_utils
+import utils.http_utils as http_utils
+import utils.json_utils as json_utils
+import utils.recording as recording
+import utils.cache_utils as cache_utils
+import utils.profiling as profiling
+import utils.checkpoint_utils as checkpoint_utils
+import utils.progress_utils as progress_utils
+import utils.cost_utils as cost_utils
+import utils.archive_utils as archive_utils
+import utils.spool_utils as spool_utils
+import reports.crawl_queue as crawl_queue
+import reports.load_spool as load_spool
 
 ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
 
 # constants to be used throughout the process
 STD_PORT = 443
 TOKEN_URL = "https://%s/portal/sharing/rest/generateToken"
+ADMIN_URL = "https://%s/server/admin"
+# real-time state of services that are up and running
+STARTED_STATE = 'STARTED'
+
+STATUS_LOCK = threading.Lock()
 
 
 def query_ags_service_layers(args):
@@ -39,7 +61,8 @@ def query_ags_service_layers(args):
     server via JSON API.
     """
     # combining environment configuration and command line arguments
-    cfg = utils.complete_configuration(ENV, args)
+    with profiling.stage('config'):
+        cfg = utils.complete_configuration(ENV, args)
 
     t0 = time.time()
 
@@ -47,11 +70,14 @@ def query_ags_service_layers(args):
 
     # turning off notifications about insecure connections
     urllib3.disable_warnings()
+    # applying timeout, retry and circuit breaker settings for outbound requests
+    http_utils.configure(cfg)
     # retrieving current date
-    date = datetime.date.today()
+    cfg['ref_date'] = recording.record_call('ref_date', [cfg['query_environment']], datetime.date.today)
+    # replayed crawls never write rows, as these would replace current reports
+    if recording.is_replaying():
+        cfg['dry_run'] = True
 
-    # locating database configuration
-    db_cfg_path = cfg['db_cfg']
     query_env = cfg['environments'][cfg['query_environment']]
 
     if 'ags_host' not in query_env:
@@ -59,97 +85,244 @@ def query_ags_service_layers(args):
             "No ArcGIS server hostname specified for current query environment '%s'" % cfg['query_environment'])
         return
 
-    logging.info("Setting up connection to %s" % cfg['tgt_db'])
-    tgt_conn_str = db_utils.get_db_connection(db_cfg_path, cfg['tgt_db'])
-    tgt_engine = create_engine(tgt_conn_str)
-
-    if cfg['initial']:
-        db_utils.drop_create_table_by_def(ags_service_layer_report_table_def(cfg['ags_tgt_table']), tgt_engine, True)
-
-    if not db_utils.table_exists(tgt_engine, cfg['ags_tgt_table']):
-        db_utils.drop_create_table_by_def(ags_service_layer_report_table_def(cfg['ags_tgt_table']), tgt_engine)
-
-    logging.info("Analyzing target table %s" % cfg['ags_tgt_table'])
-    tgt_table = db_utils.get_table_definition_with_engine(cfg['ags_tgt_table'], tgt_engine)
-
-    logging.info("Preparing target insert statement")
-    tgt_insert_stmt = tgt_table.insert().values(dict())
-    logging.info("Preparing deletion statement for entries previously created today")
-    tgt_delete_stmt = tgt_table.delete().where(and_(
-        tgt_table.c.reference_date == date, tgt_table.c.env == cfg['query_environment']))
-
-    # setting up list for insert statements
-    inserts = list()
+    # setting up checkpoint for crawled services, adopting reference date of
+    # a previous crawl when resuming it
+    checkpoint = None
+    if not cfg.get('distributed'):
+        checkpoint = checkpoint_utils.prepare_checkpoint(cfg, 'ags_service_layers')
 
     logging.info("Working on '%s' environment at '%s'" % (cfg['query_environment'], query_env['ags_host']))
     # retrieving server token
-    token_url = TOKEN_URL % query_env['ags_host']
-    token = get_token(
-        query_env['ags_host'], query_env.get('port', STD_PORT), cfg['ags_user'], cfg['ags_pwd'], token_url)
-    # retrieving current services
-    services = get_services(
-        cfg, query_env['ags_host'], query_env.get('port', STD_PORT), cfg['ags_user'], cfg['ags_pwd'], token_url)
+    token = get_env_token(cfg, query_env)
+    # retrieving current services, as a complete list if required up front,
+    # otherwise streaming them into the crawl while folders are still listed
+    if cfg.get('distributed') or cfg.get('limit') or recording.MODE:
+        with profiling.stage('source_read'):
+            services = recording.record_call(
+                'services', [query_env['ags_host'], cfg['services_to_skip']], get_services, cfg, query_env, token,
+                checkpoint)
+        if cfg.get('limit'):
+            services = services[:cfg['limit']]
+    else:
+        services = iter_services(cfg, query_env, token, checkpoint)
+
+    # handing services over to distributed workers if requested
+    if cfg.get('distributed'):
+        enqueue_services(cfg, services)
+        return
+
+    get_item_key = functools.partial(crawl_queue.get_item_key, 'ags_service_layers')
+    item_states = checkpoint_utils.get_item_states(checkpoint)
 
-    svc_cnt = 0
     # for each service collecting information about datasets and resources
-    for service in services[:]:
-        logging.info("Working on '%s'" % service['serviceName'])
-        svc_cnt += 1
-        # retrieving service manifest
-        xml_string = get_service_manifest(token, service['URL'])
-        # retrieving datasets and MXD resource
-        datasets = get_datasets(xml_string)
-        mxd_resource = get_resource(xml_string)
-        # collecting information for each dataset
-        if not datasets:
-            logging.warning("No datasets found in '%s'" % service['serviceName'])
-        for dataset in datasets:
-            tokens = dataset.split('\\')
-            sde_conn = tokens[-2]
-            table_data = tokens[-1]
-            table_tokens = table_data.split('.')
-            if len(table_tokens) == 3:
-                db, schema, table = table_tokens
-            elif len(table_tokens) == 2:
-                db = 'oracle'
-                schema, table = table_tokens
-            else:
-                db = 'unknown',
-                schema = 'unknown'
-                table = table_tokens.pop(0)
-
-            single_insert = dict()
-            single_insert['svc_name'] = service['serviceName']
-            single_insert['svc_folder'] = service['folderName']
-            single_insert['env'] = cfg['query_environment']
-            single_insert['reference_date'] = date
-            single_insert['db'] = db
-            single_insert['db_schema'] = schema.lower()
-            single_insert['db_table'] = table.lower()
-            single_insert['sde'] = sde_conn
-            single_insert['mxd'] = mxd_resource
-            inserts.append(single_insert)
-
-        if 'limit' in cfg and cfg['limit']:
-            if svc_cnt >= cfg['limit']:
-                break
+    # concurrently, with requests per host being limited adaptively, and
+    # checkpointing resulting rows or the reason for failing, new services are
+    # started as soon as they are listed, all others once listing is complete
+    # longest (previous) crawl time first
+    cost_store = cost_utils.open_cost_store(cfg)
+    costs = cost_utils.get_costs(cost_store, 'ags_service_layers', cfg['query_environment'])
+    workers = cfg.get('crawl_workers') or 1
+    progress = progress_utils.Progress('Services', None, cfg.get('progress_interval'))
+    with profiling.stage('crawl'), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
+        estimates = list()
+        known = list()
+        for service in services:
+            if not checkpoint_utils.is_selected(cfg, item_states, get_item_key(service)):
+                continue
+            if cost_utils.get_estimate(costs, service, get_item_key, get_fingerprint) is not None:
+                known.append(service)
+                continue
+            cost = dict()
+            futures[executor.submit(cost_utils.measure_call, cost, crawl_service, cfg, token, service)] = (
+                service, cost)
+            estimates.append(None)
+        known, known_estimates = cost_utils.order_items(costs, known, get_item_key, get_fingerprint)
+        for service in known:
+            cost = dict()
+            futures[executor.submit(cost_utils.measure_call, cost, crawl_service, cfg, token, service)] = (
+                service, cost)
+        estimates.extend(known_estimates)
+        progress.total = len(futures)
+        logging.info("%d services selected for crawling (%d done previously)" % (
+            len(futures), list(s for s, _ in item_states.values()).count(checkpoint_utils.STATUS_DONE)))
+
+        for future in as_completed(futures):
+            service, cost = futures[future]
+            succeeded = store_result(checkpoint, get_item_key(service), service['serviceName'], future)
+            progress.update(failed=not succeeded)
+            # keeping previous estimates for services that couldn't be crawled
+            if succeeded:
+                cost_utils.save_cost(
+                    cost_store, 'ags_service_layers', cfg['query_environment'], get_item_key(service), cost,
+                    get_fingerprint(service))
+    cost_utils.log_makespan([cost for _, cost in futures.values()], workers, estimates)
+    cost_store.close()
+    http_utils.log_host_limits()
+    http_utils.log_failed_requests()
+
+    # collecting rows for all services crawled successfully, including the
+    # ones crawled by previous attempts
+    inserts = list()
+    for rows in checkpoint_utils.load_rows(checkpoint):
+        inserts.extend(rows)
+    failed = checkpoint_utils.get_failures(checkpoint)
+    checkpoint.close()
 
     logging.info("Information for %d service layer items collected" % len(inserts))
+    if failed:
+        logging.warning("Unable to query %d services (use --retry-failed to crawl them again):" % len(failed))
+        for service_name, reason in failed:
+            logging.warning("+ %s: %s" % (service_name, reason))
 
     if inserts:
         if cfg['dry_run']:
             logging.info("%d inserts would be made" % len(inserts))
         else:
-            with tgt_engine.connect() as connection:
-                logging.info("Deleting entries previously created today")
-                connection.execute(tgt_delete_stmt)
-                logging.info("Inserting new items")
-                connection.execute(tgt_insert_stmt, inserts)
+            with profiling.stage('spool'):
+                spool_utils.write_segment(cfg, 'ags_tgt_table', inserts)
+
+    # loading spooled rows, including the ones spooled by previous crawls
+    # while the target database was unavailable
+    if not cfg['dry_run']:
+        with profiling.stage('db_write'):
+            load_spool.load_segments(cfg)
 
     t1 = time.time()
     logging.info("Information collection finished in %s" % (utils.format_interval(t1 - t0)))
 
 
+def enqueue_services(cfg, services):
+    """
+    Enqueues specified services to be crawled by distributed workers, after
+    preparing the target table and removing rows previously created today.
+    """
+    logging.info("Setting up connection to %s" % cfg['tgt_db'])
+    tgt_engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+
+    if cfg['initial']:
+        db_utils.drop_create_table_by_def(ags_service_layer_report_table_def(cfg['ags_tgt_table']), tgt_engine, True)
+
+    if not db_utils.table_exists(tgt_engine, cfg['ags_tgt_table']):
+        db_utils.drop_create_table_by_def(ags_service_layer_report_table_def(cfg['ags_tgt_table']), tgt_engine)
+
+    if not cfg['dry_run']:
+        tgt_table = db_utils.get_table_definition_with_engine(cfg['ags_tgt_table'], tgt_engine)
+        with tgt_engine.connect() as connection:
+            connection.execute(tgt_table.delete().where(and_(
+                tgt_table.c.reference_date == cfg['ref_date'], tgt_table.c.env == cfg['query_environment'])))
+    crawl_queue.enqueue_items(cfg, tgt_engine, 'ags_service_layers', services)
+
+
+def store_result(checkpoint, item_key, service_name, future):
+    """
+    Checkpoints resulting rows of a finished crawl of the specified service or
+    the reason for failing. Returns whether the service was crawled
+    successfully.
+    """
+    reason = None
+    try:
+        checkpoint_utils.save_item(checkpoint, item_key, future.result())
+        logging.debug("Service '%s' crawled", service_name)
+        return True
+    except http_utils.RequestFailed as e:
+        reason = e.reason
+    except etree.XMLSyntaxError as e:
+        logging.warning("Unable to parse manifest for '%s': %s", service_name, e)
+        reason = "Invalid manifest (%s)" % e
+    except Exception as e:
+        logging.exception("Unexpected error while crawling '%s'", service_name)
+        reason = "Unexpected error (%s: %s)" % (e.__class__.__name__, e)
+    checkpoint_utils.save_item(checkpoint, item_key, reason=reason)
+    return False
+
+
+def crawl_service(cfg, token, service, cost=None):
+    """
+    Retrieves manifest of the specified service, archives it and extracts
+    information about its layers. Optionally collects size of the manifest
+    and number of layers in the given cost dictionary.
+    """
+    with profiling.stage('fetch'):
+        xml_string = cache_utils.cached_call(
+            'manifest', service['URL'], cache_utils.get_ttl(cfg, 'manifest'),
+            get_service_manifest, token, service['URL'])
+    with profiling.stage('archive'):
+        archive_utils.archive_body(
+            cfg, 'ags_service_layers', crawl_queue.get_item_key('ags_service_layers', service), service, xml_string)
+    with profiling.stage('extract'):
+        layers = extract_service_layers(cfg, service, xml_string)
+    if cost is not None:
+        cost['size'] = len(xml_string)
+        cost['rows'] = len(layers)
+    return layers
+
+
+def extract_service_layers(cfg, service, xml_string):
+    """
+    Extracts information about layers, i.e. datasets and MXD resource, from
+    the specified service manifest.
+    """
+    layers = list()
+
+    # retrieving datasets and MXD resource
+    datasets = get_datasets(xml_string)
+    mxd_resource = get_resource(xml_string)
+
+    # collecting information for each dataset
+    if not datasets:
+        logging.warning("No datasets found in '%s'", service['serviceName'])
+    for dataset in datasets:
+        tokens = dataset.split('\\')
+        sde_conn = tokens[-2]
+        table_data = tokens[-1]
+        table_tokens = table_data.split('.')
+        if len(table_tokens) == 3:
+            db, schema, table = table_tokens
+        elif len(table_tokens) == 2:
+            db = 'oracle'
+            schema, table = table_tokens
+        else:
+            db = 'unknown'
+            schema = 'unknown'
+            table = table_tokens.pop(0)
+
+        single_insert = ServiceLayerRecord()
+        single_insert['svc_name'] = service['serviceName']
+        single_insert['svc_folder'] = service['folderName']
+        single_insert['env'] = cfg['query_environment']
+        single_insert['reference_date'] = cfg['ref_date']
+        single_insert['db'] = db
+        single_insert['db_schema'] = schema.lower()
+        single_insert['db_table'] = table.lower()
+        single_insert['sde'] = sde_conn
+        single_insert['mxd'] = mxd_resource
+        layers.append(single_insert)
+
+    return layers
+
+
+def get_env_token(cfg, query_env):
+    """
+    Retrieves token for the ArcGIS server of the specified environment, re-using
+    a previously retrieved token if it hasn't expired yet.
+    """
+    token_url = TOKEN_URL % query_env['ags_host']
+    return cache_utils.cached_call(
+        'token', query_env['ags_host'], cache_utils.get_ttl(cfg, 'token'), recording.record_call,
+        'token', [query_env['ags_host']], get_token,
+        query_env['ags_host'], query_env.get('port', STD_PORT), cfg['ags_user'], cfg['ags_pwd'], token_url)
+
+
+def get_fingerprint(service):
+    """
+    Gets fingerprint of the specified service from its entry in the folder
+    listing, changing whenever e.g. its type or description is modified (the
+    manifest itself is only known after crawling the service).
+    """
+    return hashlib.sha1(json.dumps(service, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
 def get_service_manifest(token, service_url):
     """
     Returns service manifest, based on this url
@@ -159,7 +332,7 @@ def get_service_manifest(token, service_url):
     http://resources.arcgis.com/en/help/arcgis-rest-api/index.html#//02r3000001vt000000
     """
     metadata_url = '{0}/iteminfo/manifest/manifest.xml'.format(service_url)
-    xml_data = requests.get(metadata_url, params={'token': token}, verify=False).content
+    xml_data = http_utils.get(metadata_url, params={'token': token}, verify=False).content
     return xml_data
 
 
@@ -185,28 +358,132 @@ def get_resource(data):
         return
 
 
-def get_services(cfg, server, port, user, pwd, token_url):
+def get_services(cfg, query_env, token, checkpoint=None):
     """
     Returns a list of dictionaries with service name, folder, type and URL;
     the list is sorted by service name.
     """
-    ags_admin_url = r'https://{0}/server/admin'.format(server)
-    ags_security_handler = AGSTokenSecurityHandler(
-        username=user, password=pwd, org_url=ags_admin_url, token_url=token_url)
-    ags_security_handler.referer_url = ags_admin_url
-    ags_obj = AGSAdministration(ags_admin_url, ags_security_handler)
-    services = ags_obj.services.find_services(service_type='MAPSERVER')
-    services = [
-        s for s in services if s['serviceName'] not in cfg['services_to_skip']]
-    return sorted(services, key=lambda s: s['serviceName'])
+    return sorted(iter_services(cfg, query_env, token, checkpoint), key=lambda s: s['serviceName'])
+
+
+def iter_services(cfg, query_env, token, checkpoint=None):
+    """
+    Yields dictionaries with service name, folder, type and URL for all map
+    services on the ArcGIS server of the specified environment, except the
+    ones to be skipped. Folders are listed concurrently and their services
+    are yielded as soon as the listing of a folder is complete. Folders that
+    can't be listed are skipped and recorded as failed in the given
+    checkpoint, if any.
+    """
+    admin_url = ADMIN_URL % query_env['ags_host']
+    params = {'f': 'json', 'token': token}
+    root = get_admin_json("%s/services" % admin_url, params)
+    folders = root.get('folders', list())
+    logging.info("Listing services in %d folders from %s" % (len(folders) + 1, admin_url))
+
+    with ThreadPoolExecutor(max_workers=cfg.get('crawl_workers') or 1) as executor:
+        futures = {
+            executor.submit(get_admin_json, "%s/services/%s" % (admin_url, folder), params): folder
+            for folder in folders}
+        for listing in itertools.chain([root], iter_listings(futures, checkpoint)):
+            for entry in listing.get('services', list()):
+                if entry.get('type') != 'MapServer' or entry['serviceName'] in cfg['services_to_skip']:
+                    continue
+                folder = entry.get('folderName') or '/'
+                yield dict(entry, folderName=folder, URL="/".join(part for part in (
+                    admin_url, 'services', None if folder == '/' else folder,
+                    "%s.%s" % (entry['serviceName'], entry['type'])) if part))
+
+
+def iter_listings(futures, checkpoint=None):
+    """
+    Yields folder listings as soon as they are retrieved, skipping (and
+    checkpointing) folders that couldn't be listed.
+    """
+    for future in as_completed(futures):
+        folder = futures[future]
+        try:
+            yield future.result()
+        except http_utils.RequestFailed as e:
+            reason = e.reason
+        except ValueError as e:
+            reason = "Invalid folder listing (%s)" % e
+        else:
+            continue
+        logging.warning("Unable to list services in folder '%s': %s" % (folder, reason))
+        if checkpoint is not None:
+            checkpoint_utils.save_item(checkpoint, "%s/*" % folder, reason=reason)
+
+
+def get_admin_json(url, params):
+    """
+    Retrieves specified resource of the ArcGIS server admin directory as JSON.
+    """
+    response = json_utils.loads(http_utils.get(url, params=params, verify=False).content)
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response
+
+
+def get_service_status_table(cfg, query_env):
+    """
+    Gets real-time states of all services on the ArcGIS server of the
+    specified environment, keyed by lower-case folder and service name. The
+    table is retrieved once (per cache period) from the admin services reports
+    of all folders. Returns False if the table couldn't be retrieved.
+    """
+    # retrieving table only once if requested by multiple threads at a time
+    with STATUS_LOCK:
+        return cache_utils.cached_call(
+            'service_status', query_env['ags_host'], cache_utils.get_ttl(cfg, 'availability'),
+            retrieve_service_status_table, cfg, query_env)
+
+
+def retrieve_service_status_table(cfg, query_env):
+    """
+    Retrieves real-time states of all services on the ArcGIS server of the
+    specified environment from the admin services reports of all folders.
+    """
+    admin_url = ADMIN_URL % query_env['ags_host']
+    logging.info("Retrieving status of all services from %s" % admin_url)
+    try:
+        params = {'f': 'json', 'token': get_env_token(cfg, query_env)}
+        folders = get_admin_json("%s/services" % admin_url, params).get('folders', list())
+
+        # retrieving reports of all folders concurrently
+        report_params = dict(params, parameters='["status"]')
+        with ThreadPoolExecutor(max_workers=cfg.get('crawl_workers') or 1) as executor:
+            reports = list(executor.map(lambda folder: get_admin_json("/".join(
+                part for part in (admin_url, 'services', folder, 'report') if part), report_params),
+                [None] + folders))
+
+        status_table = dict()
+        for report in reports:
+            for entry in report.get('reports', list()):
+                key = ((entry.get('folderName') or '/').lower(), entry['serviceName'].lower())
+                status_table[key] = (entry.get('status') or dict()).get('realTimeState')
+    except Exception as e:
+        logging.warning("Unable to retrieve status of services from %s: %s" % (admin_url, e))
+        return False
+
+    logging.info("Status of %d services retrieved from %s" % (len(status_table), admin_url))
+    return status_table
 
 
 def get_token(server, port, user, pwd, token_url):
     """
-    Returns token issued from AGS as string.
+    Returns token issued from AGS as string, using configured timeouts and
+    retries.
     """
     ags_admin_url = "https://{0}/server/admin".format(server)
-    ags_security_handler = AGSTokenSecurityHandler(
-        username=user, password=pwd, org_url=ags_admin_url, token_url=token_url)
-    ags_security_handler.referer_url = ags_admin_url
-    return ags_security_handler.token
+    r = http_utils.post(token_url, data={
+        'username': user, 'password': pwd, 'client': 'referer', 'referer': ags_admin_url, 'f': 'json'},
+        headers={'Referer': ags_admin_url}, verify=False)
+    try:
+        response = json_utils.loads(r.content)
+    except ValueError:
+        raise http_utils.RequestFailed(token_url, "Invalid token response (HTTP status %d)" % r.status_code)
+    if 'token' not in response:
+        raise http_utils.RequestFailed(token_url, "Unable to retrieve token (%s)" % (
+            response.get('error', {}).get('message') or r.status_code))
+    return response['token']
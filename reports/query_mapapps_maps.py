@@ -2,29 +2,46 @@
 # # -*- coding: utf-8 -*-
 
 import os
-import re
+import zlib
 import logging
+import functools
 import urllib3
-import simplejson.errors
-from datetime import date
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
 
-import requests
-from sqlalchemy import create_engine, and_
+from sqlalchemy import and_, select, func, exc
 
 import utils.general_utils as utils
 import utils.db_utils as db_utils
+import utils.http_utils as http_utils
+import utils.json_utils as json_utils
+import utils.recording as recording
+import utils.cache_utils as cache_utils
+import utils.profiling as profiling
+import utils.checkpoint_utils as checkpoint_utils
+import utils.progress_utils as progress_utils
+import utils.cost_utils as cost_utils
+import utils.archive_utils as archive_utils
+import utils.spool_utils as spool_utils
+import reports.crawl_queue as crawl_queue
+import reports.load_spool as load_spool
+import reports.query_ags_service_layers as ags_query
+import utils.url_utils as url_utils
 
 from table_defs.mapapps_reports import mapapps_basemap_table_def
 from table_defs.mapapps_reports import mapapps_report_table_def
 from table_defs.mapapps_reports import mapapps_search_table_def
 from table_defs.mapapps_reports import mapapps_service_table_def
+from table_defs.row_records import MapRecord, SearchStoreRecord, BasemapRecord, ServiceRecord
 
 ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
 
 # constants to be used throughout the process
 MAP_URL_SUFFIX = "resources/apps/%s"
 MAP_CFG_FILE = 'app.json'
-SERVICE_REGEX = R"/rest/services/(.+)/(.+)/(?:Map|Feature)Server/?(\d+)?"
+# number of bytes read when probing service urls
+PROBE_SIZE = 4096
 
 SEARCH_STORE_MAPPING = {
     'title': 'title',
@@ -32,7 +49,7 @@ SEARCH_STORE_MAPPING = {
     'url': 'url',
     'id': 'search_id',
     'omniSearchSearchAttr': 'search_attribute',
-    'omniSearchLabelAttr': 'search_attribute_label',
+    'omniSearchLabelAttr': 'search_label_attribute',
     'omniSearchDefaultLabel': 'search_label',
     'omniSearchPriority': 'search_priority',
     'omniSearchPageSize': 'search_pagesize',
@@ -44,195 +61,176 @@ SEARCH_STORE_MAPPING = {
 }
 
 
+class InvalidConfiguration(ValueError):
+    """
+    Raised if the configuration of a map can't be decoded.
+    """
+    pass
+
+
 def query_mapapps_maps(args):
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-    cfg = utils.complete_configuration(ENV, args)
-    cfg['ref_date'] = date.today()
+    with profiling.stage('config'):
+        cfg = utils.complete_configuration(ENV, args)
+    # applying timeout, retry and circuit breaker settings for outbound requests
+    http_utils.configure(cfg)
+    cfg['ref_date'] = recording.record_call('ref_date', [cfg['query_environment']], date.today)
+    # replayed crawls never write rows, as these would replace current reports
+    if recording.is_replaying():
+        cfg['dry_run'] = True
+    # setting up checkpoint for crawled maps, adopting reference date of a
+    # previous crawl when resuming it
+    if not cfg.get('distributed'):
+        checkpoint = checkpoint_utils.prepare_checkpoint(cfg, 'mapapps_maps')
     # setting default arguments
     if 'limit' not in cfg:
         cfg['limit'] = 0
+    if not cfg.get('load_mode'):
+        cfg['load_mode'] = 'direct'
 
     logging.info("Querying information about configured maps in '%s' environment" % cfg['query_environment'])
+    logging.info("Decoding map configurations using %s" % json_utils.get_decoder_name())
 
     # locating database configuration
     db_cfg_path = cfg['db_cfg']
     query_env = cfg['environments'][cfg['query_environment']]
-    base_url = query_env['ma_base_url']
-
-    logging.info("Establishing databases")
-    conn_str = db_utils.get_db_connection(db_cfg_path, query_env['ma_db'])
-    src_engine = create_engine(conn_str)
-    tgt_conn_str = db_utils.get_db_connection(db_cfg_path, cfg['tgt_db'])
-    tgt_engine = create_engine(tgt_conn_str)
-
-    apps_tbl = db_utils.get_table_definition_with_engine(cfg['ma_src_tbl'], src_engine)
-    shared_groups_tbl = db_utils.get_table_definition_with_engine(cfg['ma_ref_group_tbl'], src_engine)
-
-    if cfg['initial']:
-        db_utils.drop_create_table_by_def(mapapps_report_table_def(cfg['ma_tgt_tbl']), tgt_engine, True)
-        db_utils.drop_create_table_by_def(mapapps_search_table_def(cfg['ma_tgt_search_tbl']), tgt_engine, True)
-        db_utils.drop_create_table_by_def(mapapps_basemap_table_def(cfg['ma_tgt_basemap_tbl']), tgt_engine, True)
-        db_utils.drop_create_table_by_def(mapapps_service_table_def(cfg['ma_tgt_service_tbl']), tgt_engine, True)
-
-    if not db_utils.table_exists(tgt_engine, cfg['ma_tgt_tbl']):
-        db_utils.drop_create_table_by_def(mapapps_report_table_def(cfg['ma_tgt_tbl']), tgt_engine)
-    if not db_utils.table_exists(tgt_engine, cfg['ma_tgt_search_tbl']):
-        db_utils.drop_create_table_by_def(mapapps_search_table_def(cfg['ma_tgt_search_tbl']), tgt_engine)
-    if not db_utils.table_exists(tgt_engine, cfg['ma_tgt_basemap_tbl']):
-        db_utils.drop_create_table_by_def(mapapps_basemap_table_def(cfg['ma_tgt_basemap_tbl']), tgt_engine)
-    if not db_utils.table_exists(tgt_engine, cfg['ma_tgt_service_tbl']):
-        db_utils.drop_create_table_by_def(mapapps_service_table_def(cfg['ma_tgt_service_tbl']), tgt_engine)
-
-    logging.info("Analyzing target tables")
-    tgt_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_tbl'], tgt_engine)
-    tgt_search_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_search_tbl'], tgt_engine)
-    tgt_basemap_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_basemap_tbl'], tgt_engine)
-    tgt_map_tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_service_tbl'], tgt_engine)
-
-    logging.info("Setting up target insert statements")
-    tgt_insert_stmt = tgt_tbl.insert().values(dict())
-    tgt_search_insert_stmt = tgt_search_tbl.insert().values(dict())
-    tgt_basemap_insert_stmt = tgt_basemap_tbl.insert().values(dict())
-    tgt_map_insert_stmt = tgt_map_tbl.insert().values(dict())
-
-    logging.info("Connecting to database")
-    with src_engine.connect() as connection:
-        if cfg['limit']:
-            logging.warn("Limiting results to %d rows" % cfg['limit'])
-            rows = connection.execute(apps_tbl.select().limit(cfg['limit']))
-        else:
-            rows = connection.execute(apps_tbl.select())
-
-        # preparing containers for table-specific inserts
-        inserts = list()
-        search_inserts = list()
-        service_inserts = list()
-        base_map_inserts = list()
 
+    logging.info("Establishing source database")
+    src_engine = db_utils.get_engine(db_cfg_path, query_env['ma_db'])
+
+    logging.info("Retrieving maps from source database")
+    with profiling.stage('source_read'):
+        rows = recording.record_call(
+            'db', [query_env['ma_db'], cfg['ma_src_tbl'], cfg['ma_ref_group_tbl'], cfg['limit']],
+            get_source_apps, cfg, src_engine)
+
+    # handing maps over to distributed workers if requested
+    if cfg.get('distributed'):
+        enqueue_apps(cfg, rows)
+        return
+
+    get_item_key = functools.partial(crawl_queue.get_item_key, 'mapapps_maps')
+    rows = checkpoint_utils.select_items(cfg, checkpoint, rows, get_item_key)
+
+    # retrieving last known validity of service urls that are only probed
+    # every few days when revalidating rotating slices of service urls
+    if (cfg.get('revalidation_slices') or 1) > 1:
+        cfg['validation_history'] = recording.record_call(
+            'validation_history', [cfg['query_environment']], get_validation_history, cfg)
+
+    # crawling maps concurrently, with requests per host being limited
+    # adaptively, and checkpointing resulting rows or the reason for failing,
+    # maps are scheduled longest (previous) crawl time first with maps
+    # modified since their previous crawl being started right away
+    cost_store = cost_utils.open_cost_store(cfg)
+    rows, estimates = cost_utils.order_items(
+        cost_utils.get_costs(cost_store, 'mapapps_maps', cfg['query_environment']), rows, get_item_key,
+        get_fingerprint)
+    workers = cfg.get('crawl_workers') or 1
+    progress = progress_utils.Progress('Maps', len(rows), cfg.get('progress_interval'))
+    with profiling.stage('crawl'), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
         for row in rows:
-            logging.info("Retrieving app information for '%s'" % row.id)
-
-            # retrieving basic map information from current database row
-            single_app_info = dict()
-            single_app_info['app_id'] = row.id
-            single_app_info['env'] = cfg['query_environment']
-            single_app_info['title'] = row.title
-            single_app_info['description'] = row.description
-            single_app_info['status'] = row.editstate
-            single_app_info['enabled'] = row.enabled
-            single_app_info['created_at'] = row.created_at
-            single_app_info['created_by'] = row.created_by
-            single_app_info['modified_at'] = row.modified_at
-            single_app_info['modified_by'] = row.modified_by
-            single_app_info['sharedgroups_count'] = row.sharedgroups_count
-            single_app_info['sharedgroups'] = get_shared_groups(shared_groups_tbl, row.id, connection)
-            single_app_info['url'] = "/".join((base_url, MAP_URL_SUFFIX % row.id))
-            single_app_info['reference_date'] = cfg['ref_date']
-
-            # retrieving map configuration
-            url = "/".join((single_app_info['url'], MAP_CFG_FILE))
-            logging.info("Retrieving map configuration from:\n  %s" % url)
-            r = requests.get(url, auth=(cfg['ma_user'], cfg['ma_pwd']), verify=False)
-            try:
-                app_json = r.json()
-            except simplejson.errors.JSONDecodeError:
-                logging.warn("+ Unable to retrieve JSON configuration for map '%s'" % row.id)
-                continue
-
-            # determining version of the current app by checking for
-            # a parameter that is only known to be present in
-            # maps of MapApps version 3
-            if 'map' in app_json['bundles']:
-                single_app_info['version'] = 3
-            elif 'map-init' in app_json['bundles']:
-                single_app_info['version'] = 4
-            else:
-                single_app_info['version'] = None
-
-            # retrieving loaded and configured bundles
-            single_app_info['loaded_bundles'] = sorted(app_json['load']['allowedBundles'])
-            single_app_info['configured_bundles'] = sorted(list(app_json['bundles'].keys()))
-            # retrieving utilized domain bundles
-            single_app_info['domain_bundles'] = list(filter(
-                lambda d: d.startswith('domain-'), single_app_info['loaded_bundles']))
-            if single_app_info['domain_bundles']:
-                single_app_info['domain_bundles_used'] = True
-            else:
-                single_app_info['domain_bundles_used'] = False
-
-            # retrieving searches
-            searches = retrieve_configured_search_stores(cfg, app_json, single_app_info)
-            search_inserts.extend(searches)
-
-            # retrieving basemaps
-            basemaps = retrieve_configured_basemaps(cfg, app_json, single_app_info)
-            base_map_inserts.extend(basemaps)
+            cost = dict()
+            futures[executor.submit(cost_utils.measure_call, cost, crawl_app, cfg, row)] = (row, cost)
+        for future in as_completed(futures):
+            row, cost = futures[future]
+            succeeded = store_result(checkpoint, get_item_key(row), row.id, future)
+            progress.update(failed=not succeeded)
+            # keeping previous estimates for maps that couldn't be crawled
+            if succeeded:
+                cost_utils.save_cost(
+                    cost_store, 'mapapps_maps', cfg['query_environment'], get_item_key(row), cost,
+                    get_fingerprint(row))
+    cost_utils.log_makespan([cost for _, cost in futures.values()], workers, estimates)
+    cost_store.close()
+    http_utils.log_host_limits()
+    http_utils.log_failed_requests()
+
+    # preparing containers for table-specific inserts from all maps crawled
+    # successfully, including the ones crawled by previous attempts
+    inserts = list()
+    search_inserts = list()
+    service_inserts = list()
+    base_map_inserts = list()
+    for single_app_info, searches, basemaps, maps in checkpoint_utils.load_rows(checkpoint):
+        inserts.append(single_app_info)
+        search_inserts.extend(searches)
+        base_map_inserts.extend(basemaps)
+        service_inserts.extend(maps)
+    failed = checkpoint_utils.get_failures(checkpoint)
+    checkpoint.close()
+
+    if failed:
+        logging.warning("Unable to query %d maps (use --retry-failed to crawl them again):" % len(failed))
+        for app_id, reason in failed:
+            logging.warning("+ %s: %s" % (app_id, reason))
+
+    # spooling collected data per target table, i.e. all configured maps and
+    # the searches, basemaps and services configured in them
+    for tbl_key, tbl_inserts in [
+            ('ma_tgt_tbl', inserts), ('ma_tgt_search_tbl', search_inserts),
+            ('ma_tgt_basemap_tbl', base_map_inserts), ('ma_tgt_service_tbl', service_inserts)]:
+        if not tbl_inserts:
+            continue
+        if cfg['dry_run']:
+            logging.info("%d inserts would be made into %s" % (len(tbl_inserts), cfg[tbl_key]))
+        else:
+            with profiling.stage('spool'):
+                spool_utils.write_segment(cfg, tbl_key, tbl_inserts)
 
-            # retrieving maps
-            maps = retrieve_configured_maps(cfg, app_json, single_app_info)
-            service_inserts.extend(maps)
+    # loading spooled rows, including the ones spooled by previous crawls
+    # while the target database was unavailable
+    if not cfg['dry_run']:
+        with profiling.stage('db_write'):
+            load_spool.load_segments(cfg)
 
-            # checking whether there are configured bundles that aren't loaded
-            check_loaded_configured_bundles(single_app_info)
 
-            inserts.append(single_app_info)
+def enqueue_apps(cfg, rows):
+    """
+    Enqueues specified maps to be crawled by distributed workers, after
+    preparing the target tables and removing rows previously created today.
+    """
+    tgt_engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+
+    for tbl_key, table_def in [
+            ('ma_tgt_tbl', mapapps_report_table_def), ('ma_tgt_search_tbl', mapapps_search_table_def),
+            ('ma_tgt_basemap_tbl', mapapps_basemap_table_def), ('ma_tgt_service_tbl', mapapps_service_table_def)]:
+        if cfg['initial']:
+            db_utils.drop_create_table_by_def(table_def(cfg[tbl_key]), tgt_engine, True)
+        if not db_utils.table_exists(tgt_engine, cfg[tbl_key]):
+            db_utils.drop_create_table_by_def(table_def(cfg[tbl_key]), tgt_engine)
         else:
+            db_utils.add_missing_columns(table_def(cfg[tbl_key]), tgt_engine)
+        if not cfg['dry_run']:
+            tgt_tbl = db_utils.get_table_definition_with_engine(cfg[tbl_key], tgt_engine)
             with tgt_engine.connect() as connection:
+                connection.execute(prepare_delete_statement(cfg, tgt_tbl, cfg['ref_date']))
+    crawl_queue.enqueue_items(cfg, tgt_engine, 'mapapps_maps', rows)
+
 
-                # inserting collected data into table containing all configured maps
-                if inserts:
-                    if cfg['dry_run']:
-                        logging.info("%d inserts would be made into %s" % (len(inserts), cfg['ma_tgt_tbl']))
-                    else:
-                        logging.info("Deleting entries previously created today")
-                        tgt_delete_stmt = prepare_delete_statement(cfg, tgt_tbl)
-                        connection.execute(tgt_delete_stmt)
-                        logging.info("Inserting new items")
-                        connection.execute(tgt_insert_stmt, inserts)
-
-                # inserting collected data into table containing all searches configured in maps
-                if search_inserts:
-                    if cfg['dry_run']:
-                        logging.info(
-                            "%d inserts would be made into %s" % (len(search_inserts), cfg['ma_tgt_search_tbl']))
-                    else:
-                        mandatory_keys = set()
-                        [mandatory_keys.update(insert_item.keys()) for insert_item in search_inserts]
-                        # not sure why we're doing this here, should have laid out my thinking
-                        # at the first implementation
-                        for item in search_inserts:
-                            [item.__setitem__(key, None) for key in mandatory_keys if key not in item.keys()]
-                        logging.info("Deleting entries previously created today")
-                        tgt_delete_stmt = prepare_delete_statement(cfg, tgt_search_tbl)
-                        connection.execute(tgt_delete_stmt)
-                        logging.info("Inserting new items")
-                        connection.execute(tgt_search_insert_stmt, search_inserts)
-
-                # inserting collected data into table containing all basemaps configured in maps
-                if base_map_inserts:
-                    if cfg['dry_run']:
-                        logging.info(
-                            "%d inserts would be made into %s" % (len(base_map_inserts), cfg['ma_tgt_basemap_tbl']))
-                    else:
-                        logging.info("Deleting entries previously created today")
-                        tgt_delete_stmt = prepare_delete_statement(cfg, tgt_basemap_tbl)
-                        connection.execute(tgt_delete_stmt)
-                        logging.info("Inserting new items")
-                        connection.execute(tgt_basemap_insert_stmt, base_map_inserts)
-
-                # inserting collected data into table containing all services configured in maps
-                if service_inserts:
-                    if cfg['dry_run']:
-                        logging.info(
-                            "%d inserts would be made into %s" % (len(service_inserts), cfg['ma_tgt_service_tbl']))
-                    else:
-                        logging.info("Deleting entries previously created today")
-                        tgt_delete_stmt = prepare_delete_statement(cfg, tgt_map_tbl)
-                        connection.execute(tgt_delete_stmt)
-                        logging.info("Inserting new items")
-                        connection.execute(tgt_map_insert_stmt, service_inserts)
+def store_result(checkpoint, item_key, app_id, future):
+    """
+    Checkpoints resulting rows of a finished crawl of the specified map or the
+    reason for failing. Returns whether the map was crawled successfully.
+    """
+    reason = None
+    try:
+        checkpoint_utils.save_item(checkpoint, item_key, future.result())
+        logging.debug("App information for '%s' retrieved", app_id)
+        return True
+    except http_utils.RequestFailed as e:
+        reason = e.reason
+    except InvalidConfiguration:
+        logging.warning("+ Unable to retrieve JSON configuration for map '%s'", app_id)
+        reason = "Invalid JSON configuration"
+    except Exception as e:
+        logging.exception("Unexpected error while crawling '%s'", app_id)
+        reason = "Unexpected error (%s: %s)" % (e.__class__.__name__, e)
+    checkpoint_utils.save_item(checkpoint, item_key, reason=reason)
+    return False
 
 
 def prepare_delete_statement(cfg, tgt_table, tgt_date=None):
@@ -248,17 +246,136 @@ def prepare_delete_statement(cfg, tgt_table, tgt_date=None):
     return tgt_delete_stmt
 
 
-def get_shared_groups(shared_group_tbl, app_id, connection):
+def crawl_app(cfg, row, cost=None):
+    """
+    Retrieves configuration of the map represented by the specified source
+    database row, archives it and extracts information about the map, its
+    search stores, basemaps and map services. Optionally collects size of the
+    configuration and number of resulting rows in the given cost dictionary.
+    """
+    url = "/".join((get_app_url(cfg, row.id), MAP_CFG_FILE))
+    logging.debug("Retrieving map configuration from:\n  %s", url)
+    with profiling.stage('fetch'):
+        r = http_utils.get(url, auth=(cfg['ma_user'], cfg['ma_pwd']), verify=False)
+    with profiling.stage('archive'):
+        archive_utils.archive_body(cfg, 'mapapps_maps', crawl_queue.get_item_key('mapapps_maps', row), row, r.content)
+    if cost is not None:
+        cost['size'] = len(r.content)
+    with profiling.stage('extract'):
+        # all decoders report invalid content using (subclasses of) ValueError
+        try:
+            app_json = json_utils.loads(r.content)
+        except ValueError as e:
+            raise InvalidConfiguration(str(e)) from e
+        single_app_info, searches, basemaps, maps = extract_app(cfg, row, app_json)
+    if cost is not None:
+        cost['rows'] = 1 + len(searches) + len(basemaps) + len(maps)
+    return single_app_info, searches, basemaps, maps
+
+
+def get_fingerprint(row):
+    """
+    Gets fingerprint of the map represented by the specified source database
+    row, changing whenever the map is modified.
+    """
+    return str(row.modified_at)
+
+
+def get_app_url(cfg, app_id):
+    """
+    Gets url of the specified map in the currently queried environment.
+    """
+    base_url = cfg['environments'][cfg['query_environment']]['ma_base_url']
+    return "/".join((base_url, MAP_URL_SUFFIX % app_id))
+
+
+def extract_app(cfg, row, app_json):
     """
-    Retrieves groups shared by the identified map from the specified table
-    using the given database connection.
+    Extracts information about the map represented by the specified source
+    database row, its search stores, basemaps and map services from the given
+    map configuration.
     """
-    shared_groups = list()
-    shared_group_select_w_stmt = shared_group_tbl.select().where(shared_group_tbl.c.app_id == app_id)
-    shared_groups_rows = connection.execute(shared_group_select_w_stmt)
-    for shared_groups_row in shared_groups_rows:
-        shared_groups.append(shared_groups_row.group_name)
-    return shared_groups
+    # retrieving basic map information from current database row
+    single_app_info = MapRecord()
+    single_app_info['app_id'] = row.id
+    single_app_info['env'] = cfg['query_environment']
+    single_app_info['title'] = row.title
+    single_app_info['description'] = row.description
+    single_app_info['status'] = row.editstate
+    single_app_info['enabled'] = row.enabled
+    single_app_info['created_at'] = row.created_at
+    single_app_info['created_by'] = row.created_by
+    single_app_info['modified_at'] = row.modified_at
+    single_app_info['modified_by'] = row.modified_by
+    single_app_info['sharedgroups_count'] = row.sharedgroups_count
+    single_app_info['sharedgroups'] = row.sharedgroups
+    single_app_info['url'] = get_app_url(cfg, row.id)
+    single_app_info['reference_date'] = cfg['ref_date']
+
+    # determining version of the current app by checking for
+    # a parameter that is only known to be present in
+    # maps of MapApps version 3
+    if 'map' in app_json['bundles']:
+        single_app_info['version'] = 3
+    elif 'map-init' in app_json['bundles']:
+        single_app_info['version'] = 4
+    else:
+        single_app_info['version'] = None
+
+    # retrieving loaded and configured bundles
+    single_app_info['loaded_bundles'] = sorted(app_json['load']['allowedBundles'])
+    single_app_info['configured_bundles'] = sorted(list(app_json['bundles'].keys()))
+    # retrieving utilized domain bundles
+    single_app_info['domain_bundles'] = list(filter(
+        lambda d: d.startswith('domain-'), single_app_info['loaded_bundles']))
+    if single_app_info['domain_bundles']:
+        single_app_info['domain_bundles_used'] = True
+    else:
+        single_app_info['domain_bundles_used'] = False
+
+    # retrieving searches
+    searches = retrieve_configured_search_stores(cfg, app_json, single_app_info)
+
+    # retrieving basemaps
+    basemaps = retrieve_configured_basemaps(cfg, app_json, single_app_info)
+
+    # retrieving maps
+    maps = retrieve_configured_maps(cfg, app_json, single_app_info)
+
+    # checking whether there are configured bundles that aren't loaded
+    check_loaded_configured_bundles(single_app_info)
+
+    return single_app_info, searches, basemaps, maps
+
+
+def get_source_apps(cfg, src_engine):
+    """
+    Retrieves maps and the groups they have been shared with from the map.apps
+    database using the specified engine.
+    """
+    apps_tbl = db_utils.get_table_definition_with_engine(cfg['ma_src_tbl'], src_engine)
+    shared_groups_tbl = db_utils.get_table_definition_with_engine(cfg['ma_ref_group_tbl'], src_engine)
+
+    apps_select_stmt = apps_tbl.select()
+    shared_groups_select_stmt = shared_groups_tbl.select()
+    if cfg['limit']:
+        logging.warn("Limiting results to %d rows" % cfg['limit'])
+        apps_select_stmt = apps_select_stmt.limit(cfg['limit'])
+
+    with src_engine.connect() as connection:
+        apps = [SimpleNamespace(**dict(zip(row.keys(), row))) for row in connection.execute(apps_select_stmt)]
+        if cfg['limit']:
+            shared_groups_select_stmt = shared_groups_select_stmt.where(
+                shared_groups_tbl.c.app_id.in_([app.id for app in apps]))
+        # retrieving groups for all maps at once
+        shared_groups = dict()
+        for shared_groups_row in connection.execute(shared_groups_select_stmt):
+            shared_groups.setdefault(shared_groups_row.app_id, list()).append(shared_groups_row.group_name)
+
+    for app in apps:
+        app.sharedgroups = shared_groups.get(app.id, list())
+
+    return apps
 
 
 def check_loaded_configured_bundles(single_app_info):
@@ -272,7 +389,7 @@ def check_loaded_configured_bundles(single_app_info):
     for bundle in sorted(list(c_bundles.difference(l_bundles))):
         if bundle == 'themes':
             continue
-        logging.warn("Bundle configured, but not loaded: %s" % bundle)
+        logging.warning("Bundle configured, but not loaded: %s", bundle)
 
 
 def retrieve_configured_search_stores(cfg, app_json, single_app_info):
@@ -291,7 +408,7 @@ def retrieve_configured_search_stores(cfg, app_json, single_app_info):
         return searches
 
     for search_store in orig_search_stores:
-        single_store_info = dict()
+        single_store_info = SearchStoreRecord()
         single_store_info['app_id'] = app_json['properties']['id']
         single_store_info['app_title'] = single_app_info['title']
         single_store_info['reference_date'] = cfg['ref_date']
@@ -301,22 +418,15 @@ def retrieve_configured_search_stores(cfg, app_json, single_app_info):
 
         # retrieving environment of underlying service by
         # analyzing host name
-        single_store_info['svc_env'] = None
-        for svc_env in cfg['environments']:
-            # skipping environment if no ArcGIS server has been configured for it
-            if 'ags_host' not in cfg['environments'][svc_env]:
-                continue
-            if 'url' in search_store and cfg['environments'][svc_env]['ags_host'] in search_store['url']:
-                single_store_info['svc_env'] = svc_env
-                break
+        url_info = url_utils.classify_url(get_url_index(cfg), search_store.get('url'))
+        single_store_info['svc_env'] = url_info['env']
 
         for key in search_store:
             if key == 'url' and search_store[key].startswith("http"):
-                match = re.search(SERVICE_REGEX, search_store[key])
-                if match:
-                    single_store_info['svc_directory'] = match.group(1)
-                    single_store_info['svc_name'] = match.group(2)
-                    single_store_info['svc_layer_id'] = int(match.group(3))
+                if url_info['name']:
+                    single_store_info['svc_directory'] = url_info['folder']
+                    single_store_info['svc_name'] = url_info['name']
+                    single_store_info['svc_layer_id'] = url_info['layer_id']
             if key == 'useIn':
                 if 'omnisearch' in search_store[key]:
                     single_store_info['used_in_search'] = True
@@ -326,7 +436,7 @@ def retrieve_configured_search_stores(cfg, app_json, single_app_info):
             if key in SEARCH_STORE_MAPPING:
                 single_store_info[SEARCH_STORE_MAPPING[key]] = search_store[key]
             else:
-                logging.debug("Unmapped search store key '%s' with value: %s" % (key, search_store[key]))
+                logging.debug("Unmapped search store key '%s' with value: %s", key, search_store[key])
         searches.append(single_store_info)
 
     return searches
@@ -357,7 +467,7 @@ def retrieve_configured_basemaps(cfg, app_json, single_app_info):
             svc_type = svc.get('type', '')
             if not svc_type or svc_type in ['AGS_DYNAMIC', 'AGS_FEATURE']:
                 continue
-            single_base_map = dict()
+            single_base_map = BasemapRecord()
             single_base_map['app_id'] = single_app_info['app_id']
             single_base_map['app_title'] = single_app_info['title']
             single_base_map['reference_date'] = cfg['ref_date']
@@ -376,7 +486,7 @@ def retrieve_configured_basemaps(cfg, app_json, single_app_info):
             config_basemaps = list()
 
         for svc in config_basemaps:
-            single_base_map = dict()
+            single_base_map = BasemapRecord()
             single_base_map['app_id'] = single_app_info['app_id']
             single_base_map['app_title'] = single_app_info['title']
             single_base_map['reference_date'] = cfg['ref_date']
@@ -394,7 +504,8 @@ def retrieve_configured_basemaps(cfg, app_json, single_app_info):
                 single_base_map['svc_url'] = sub_dict.get('url', None)
             base_maps.append(single_base_map)
     else:
-        logging.warn("Unable to retrieve basemaps for non-versioned map configuration: %s" % single_app_info['app_id'])
+        logging.warning(
+            "Unable to retrieve basemaps for non-versioned map configuration: %s", single_app_info['app_id'])
 
     return base_maps
 
@@ -415,7 +526,7 @@ def retrieve_configured_maps(cfg, app_json, single_app_info):
                 config_maps = map_cfg['layers']
 
         for svc in config_maps:
-            single_map = dict()
+            single_map = ServiceRecord()
             single_map['app_id'] = single_app_info['app_id']
             single_map['app_title'] = single_app_info['title']
             single_map['reference_date'] = cfg['ref_date']
@@ -425,11 +536,9 @@ def retrieve_configured_maps(cfg, app_json, single_app_info):
             single_map['svc_url'] = svc.get('url', None)
             single_map['env'] = cfg['query_environment']
 
-            match = re.search(SERVICE_REGEX, svc.get('url', ''))
-            if match:
-                single_map['svc_name'] = match.group(2)
-            else:
-                single_map['svc_name'] = None
+            url_info = url_utils.classify_url(get_url_index(cfg), svc.get('url'))
+            single_map['svc_name'] = url_info['name']
+            single_map['svc_folder'] = url_info['folder']
 
             check_service_status(cfg, single_map)
 
@@ -453,7 +562,7 @@ def retrieve_configured_maps(cfg, app_json, single_app_info):
             svc_type = svc.get('type', '')
             if not svc_type or svc_type not in ['AGS_DYNAMIC', 'AGS_FEATURE']:
                 continue
-            single_map = dict()
+            single_map = ServiceRecord()
             single_map['app_id'] = single_app_info['app_id']
             single_map['app_title'] = single_app_info['title']
             single_map['reference_date'] = cfg['ref_date']
@@ -461,42 +570,117 @@ def retrieve_configured_maps(cfg, app_json, single_app_info):
             single_map['svc_title'] = svc.get('title', None)
             single_map['svc_type'] = svc_type
             single_map['svc_url'] = svc.get('url', None)
-            single_map['svc_description'] = None
             single_map['env'] = cfg['query_environment']
 
-            match = re.search(SERVICE_REGEX, svc.get('url', ''))
-            if match:
-                single_map['svc_name'] = match.group(2)
-            else:
-                single_map['svc_name'] = None
+            url_info = url_utils.classify_url(get_url_index(cfg), svc.get('url'))
+            single_map['svc_name'] = url_info['name']
+            single_map['svc_folder'] = url_info['folder']
 
             check_service_status(cfg, single_map)
 
             maps.append(single_map)
     else:
-        logging.warn("Unable to retrieve basemaps for non-versioned map configuration: %s" % single_app_info['app_id'])
+        logging.warning(
+            "Unable to retrieve basemaps for non-versioned map configuration: %s", single_app_info['app_id'])
 
     return maps
 
 
 def check_availability(cfg, url):
     """
-    Checks whether specified service url is available.
+    Checks whether specified service url is available using a lightweight
+    probe, i.e. only reading the beginning of the response to detect errors.
     """
     url = url.split(": ")[-1]
-    suffix = '?f=pjson'
 
     try:
-        r = requests.get(url + suffix, auth=(cfg['ma_user'], cfg['ma_pwd']), verify=False)
-        payload = r.json()
-
-        if 'error' in payload.keys():
-            return False
-        else:
-            return True
+        r = http_utils.get(
+            url, params={'f': 'json'}, auth=(cfg['ma_user'], cfg['ma_pwd']), verify=False, stream=True)
+        try:
+            head = next(r.iter_content(PROBE_SIZE), b'')
+        finally:
+            r.close()
+        return r.status_code < 400 and b'"error"' not in head
     except Exception as e:
-        logging.warn("Unable to check availability of %s" % url)
-        logging.warn(e)
+        logging.warning("Unable to check availability of %s: %s", url, e)
+
+
+def get_availability(cfg, url, url_info):
+    """
+    Gets availability of the specified service url located on a configured
+    ArcGIS server from the server's service status table, falling back to a
+    probe if the table or the service's folder and name aren't available.
+    Returns availability and the date it was checked.
+    """
+    if url_info['name']:
+        status_table = ags_query.get_service_status_table(cfg, cfg['environments'][url_info['env']])
+        if status_table:
+            state = status_table.get((url_info['folder'].lower(), url_info['name'].lower()))
+            return state == ags_query.STARTED_STATE, cfg['ref_date']
+
+    return probe_availability(cfg, url)
+
+
+def probe_availability(cfg, url):
+    """
+    Probes availability of the specified service url, returning it along with
+    the date it was checked. When revalidating rotating slices of service urls
+    only urls in the current slice are probed, as well as new urls, urls that
+    weren't available at their last check and urls not checked for a whole
+    rotation. For all others their last known availability is carried forward.
+    """
+    slices = cfg.get('revalidation_slices') or 1
+    if slices > 1:
+        valid, checked = cfg.get('validation_history', dict()).get(url, (None, None))
+        if (
+            valid and checked > cfg['ref_date'] - timedelta(days=slices) and
+            not in_revalidation_slice(url, cfg['ref_date'], slices)
+        ):
+            return valid, checked
+
+    valid = cache_utils.cached_call(
+        'availability', url, cache_utils.get_ttl(cfg, 'availability'), check_availability, cfg, url)
+    return valid, cfg['ref_date']
+
+
+def in_revalidation_slice(url, ref_date, slices):
+    """
+    Checks whether the specified url is to be revalidated on the given date,
+    i.e. whether it belongs to the date's slice of all urls partitioned by
+    hash.
+    """
+    return zlib.crc32(url.encode('utf-8')) % slices == ref_date.toordinal() % slices
+
+
+def get_validation_history(cfg, until=None):
+    """
+    Gets last known validity and the date it was checked for all service urls
+    in the most recent map service report before the specified date, per
+    default the current reference date.
+    """
+    until = until or cfg['ref_date']
+    history = dict()
+    try:
+        engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+        if not db_utils.table_exists(engine, cfg['ma_tgt_service_tbl']):
+            return history
+        tbl = db_utils.get_table_definition_with_engine(cfg['ma_tgt_service_tbl'], engine)
+        if 'valid_checked' not in tbl.c:
+            return history
+        with engine.connect() as connection:
+            previous_date = connection.execute(select([func.max(tbl.c.reference_date)]).where(
+                tbl.c.reference_date < until)).scalar()
+            rows = connection.execute(select([tbl.c.svc_url, tbl.c.valid, tbl.c.valid_checked]).where(and_(
+                tbl.c.reference_date == previous_date, tbl.c.valid_checked.isnot(None))))
+            for url, valid, checked in rows:
+                if url not in history or checked > history[url][1]:
+                    history[url] = (valid, checked)
+    except (exc.OperationalError, exc.InterfaceError) as e:
+        logging.warning("Unable to retrieve previous validity of service urls, probing all: %s" % e)
+        return dict()
+
+    logging.info("Previous validity of %d service urls retrieved" % len(history))
+    return history
 
 
 def check_service_status(cfg, single_map):
@@ -504,24 +688,34 @@ def check_service_status(cfg, single_map):
     Checks service status, i.e. availability and security status, of specified map service
     """
     single_map['valid'] = None
+    single_map['valid_checked'] = None
     single_map['secured'] = None
     single_map['svc_env'] = None
 
-    # retrieving all existing ags hosts first
-    available_ags_hosts = set()
-    for svc_env in cfg['environments']:
-        # skipping environment if no ArcGIS server has been configured for it
-        if 'ags_host' not in cfg['environments'][svc_env]:
-            continue
-        available_ags_hosts.add(cfg['environments'][svc_env]['ags_host'])
-        # identifying service environment for current map service
-        if single_map['svc_url'] and cfg['environments'][svc_env]['ags_host'] in single_map['svc_url']:
-            single_map['svc_env'] = svc_env
-
-    if single_map['svc_url']:
-        if any([sub in single_map['svc_url'] for sub in available_ags_hosts]):
-            single_map['valid'] = check_availability(cfg, single_map['svc_url'])
-            if 'ags-relay' in single_map['svc_url']:
-                single_map['secured'] = True
-            else:
-                single_map['secured'] = False
+    # identifying service environment for current map service
+    url_info = url_utils.classify_url(get_url_index(cfg), single_map['svc_url'])
+    single_map['svc_env'] = url_info['env']
+
+    # adopting previously checked availability when extracting archived map
+    # configurations offline, otherwise checking services located on
+    # configured ArcGIS servers using their service status tables, services
+    # on other servers only if configured
+    if url_info['known_host']:
+        single_map['secured'] = url_info['secured']
+    if cfg.get('offline'):
+        single_map['valid'], single_map['valid_checked'] = cfg.get('validation_history', dict()).get(
+            single_map['svc_url'], (None, None))
+    elif url_info['known_host']:
+        single_map['valid'], single_map['valid_checked'] = get_availability(cfg, single_map['svc_url'], url_info)
+    elif cfg.get('check_foreign_hosts') and single_map['svc_url']:
+        single_map['valid'], single_map['valid_checked'] = probe_availability(cfg, single_map['svc_url'])
+
+
+def get_url_index(cfg):
+    """
+    Gets index to classify service urls, building it from the configured
+    environments if necessary.
+    """
+    if 'url_index' not in cfg:
+        cfg['url_index'] = url_utils.build_url_index(cfg['environments'])
+    return cfg['url_index']
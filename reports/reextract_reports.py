@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Re-extracts report rows for past reference dates from archived service
+manifests and map configurations, e.g. after fixing or extending the
+extraction of layers, searches or map services. Reference dates are processed
+in parallel without querying ArcGIS servers or map.apps, availability of map
+services is adopted from the existing reports. Resulting rows replace the
+report rows of the corresponding dates via the spool.
+'''
+import os
+import time
+import logging
+import datetime
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lxml import etree
+
+import utils.general_utils as utils
+import utils.json_utils as json_utils
+import utils.archive_utils as archive_utils
+import utils.spool_utils as spool_utils
+import reports.load_spool as load_spool
+import reports.query_ags_service_layers as ags_query
+import reports.query_mapapps_maps as mapapps_query
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+REPORT_TYPES = ['ags_service_layers', 'mapapps_maps']
+
+
+def reextract_reports(args):
+    """
+    Re-extracts report rows of the specified report type(s) and environment(s)
+    for all archived reference dates within the given date range.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+    t0 = time.time()
+
+    if not archive_utils.get_archive_dir(cfg):
+        logging.warning("Archiving of service manifests and map configurations is disabled")
+        return
+
+    report_types = REPORT_TYPES if cfg['report_type'] == 'all' else [cfg['report_type']]
+    envs = list(cfg['environments'].keys()) if cfg['query_environment'] == 'all' else [cfg['query_environment']]
+    from_date = cfg['from_date']
+    to_date = cfg.get('to_date') or from_date
+
+    jobs = list()
+    for report_type in report_types:
+        for env in envs:
+            for ref_date in archive_utils.get_archived_dates(cfg, report_type, env, from_date, to_date):
+                jobs.append((report_type, env, ref_date))
+    logging.info("Re-extracting %d archived reports between %s and %s from %s" % (
+        len(jobs), from_date, to_date, archive_utils.get_archive_dir(cfg)))
+    # worker processes open their own connections to the archive index
+    archive_utils.close()
+
+    failed_cnt = 0
+    with ProcessPoolExecutor(max_workers=cfg.get('reextract_workers') or None, initializer=init_worker) as executor:
+        futures = dict()
+        for report_type, env, ref_date in jobs:
+            job_cfg = dict(cfg, query_environment=env, ref_date=ref_date, offline=True)
+            # adopting availability of map services from the existing report
+            if report_type == 'mapapps_maps':
+                job_cfg['validation_history'] = mapapps_query.get_validation_history(
+                    job_cfg, ref_date + datetime.timedelta(days=1))
+            futures[executor.submit(reextract_report, job_cfg, report_type)] = (report_type, job_cfg)
+        for future in as_completed(futures):
+            report_type, job_cfg = futures[future]
+            rows, failed = future.result()
+            logging.info("%d rows re-extracted from archived %s items for %s (%s)" % (
+                sum(len(tbl_rows) for tbl_rows in rows.values()), report_type, job_cfg['ref_date'],
+                job_cfg['query_environment']))
+            for item_key, reason in failed:
+                logging.warning("+ Unable to re-extract '%s': %s" % (item_key, reason))
+            failed_cnt += len(failed)
+            for tbl_key, tbl_rows in rows.items():
+                if not tbl_rows:
+                    continue
+                if cfg['dry_run']:
+                    logging.info("%d rows would be replaced in %s" % (len(tbl_rows), cfg[tbl_key]))
+                else:
+                    spool_utils.write_segment(job_cfg, tbl_key, tbl_rows)
+
+    if failed_cnt:
+        logging.warning("Unable to re-extract %d archived items" % failed_cnt)
+
+    # loading re-extracted rows, replacing the ones of the original crawls
+    if not cfg['dry_run']:
+        load_spool.load_segments(cfg)
+
+    logging.info("Re-extraction finished in %s" % utils.format_interval(time.time() - t0))
+
+
+def init_worker():
+    """
+    Sets up console output of warnings in worker processes, as log records
+    of the main process are written by a thread not running in workers.
+    """
+    root_logger = logging.getLogger('')
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('+ %(message)s'))
+    root_logger.addHandler(console)
+    root_logger.setLevel(logging.WARNING)
+
+
+def reextract_report(cfg, report_type):
+    """
+    Re-extracts rows for all items archived for the specified report type in
+    the environment and on the reference date of the given configuration.
+    Returns rows by configuration key of the corresponding target table and
+    keys of the items that couldn't be extracted along with the reason.
+    """
+    if report_type == 'mapapps_maps':
+        rows = {
+            'ma_tgt_tbl': list(), 'ma_tgt_search_tbl': list(), 'ma_tgt_basemap_tbl': list(),
+            'ma_tgt_service_tbl': list()}
+    else:
+        rows = {'ags_tgt_table': list()}
+
+    failed = list()
+    for item_key, item, body in archive_utils.load_bodies(
+            cfg, report_type, cfg['query_environment'], cfg['ref_date']):
+        try:
+            if report_type == 'mapapps_maps':
+                single_app_info, searches, basemaps, maps = mapapps_query.extract_app(
+                    cfg, item, json_utils.loads(body))
+                rows['ma_tgt_tbl'].append(single_app_info)
+                rows['ma_tgt_search_tbl'].extend(searches)
+                rows['ma_tgt_basemap_tbl'].extend(basemaps)
+                rows['ma_tgt_service_tbl'].extend(maps)
+            else:
+                rows['ags_tgt_table'].extend(ags_query.extract_service_layers(cfg, item, body))
+        # all decoders report invalid content using (subclasses of) ValueError
+        except (ValueError, KeyError, etree.XMLSyntaxError) as e:
+            failed.append((item_key, "%s: %s" % (e.__class__.__name__, e)))
+
+    return rows, failed
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Daemon executing report jobs on configurable schedules within one long-running
+process. Database engines, reflected tables, server tokens, HTTP sessions and
+caches are kept warm between runs. Jobs for the same report and environment
+are never executed at the same time. A local (unix) control socket allows to
+query the daemon's status and to run jobs immediately. On SIGTERM or SIGINT
+the daemon stops after running jobs have finished.
+'''
+import os
+import json
+import time
+import signal
+import socket
+import logging
+import datetime
+import threading
+import socketserver
+
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+import utils.http_utils as http_utils
+import utils.cache_utils as cache_utils
+
+from reports.query_ags_service_layers import query_ags_service_layers
+from reports.query_mapapps_maps import query_mapapps_maps
+from reports.build_lineage import build_lineage
+from reports.summarize_reports import summarize_reports
+from reports.load_spool import load_spool
+from reports.publish_report import publish_reports
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+DEFAULT_DAEMON_CFG = {
+    # path to the control socket
+    'socket': 'report_daemon.sock',
+    # maximum number of jobs executed at the same time
+    'workers': 2,
+    # seconds between checks for due jobs
+    'poll_interval': 30,
+    'jobs': dict(),
+}
+# arguments for report functions, i.e. defaults of the corresponding scripts
+DEFAULT_JOB_ARGS = {
+    'dry_run': False,
+    'initial': False,
+    'load_mode': None,
+    'distributed': False,
+    'resume': False,
+    'retry_failed': False,
+    'limit': 0,
+    'publish_mode': None,
+}
+QUERY_FUNCTIONS = {
+    'ags_service_layers': query_ags_service_layers,
+    'mapapps_maps': query_mapapps_maps,
+}
+REPORT_TYPES = list(QUERY_FUNCTIONS.keys())
+
+# job name -> job state, i.e. configuration, schedule and most recent result
+JOBS = dict()
+# lock keys, i.e. (report type, environment), of currently running jobs
+BUSY = set()
+
+LOCK = threading.Lock()
+STOP = threading.Event()
+EXECUTOR = None
+
+
+def run_daemon(args):
+    """
+    Runs report jobs on their schedules until interrupted.
+    """
+    global EXECUTOR
+
+    cfg = utils.complete_configuration(ENV, args)
+    daemon_cfg = dict(DEFAULT_DAEMON_CFG, **(cfg.get('daemon_cfg') or dict()))
+    socket_path = os.path.abspath(daemon_cfg['socket'])
+
+    if not daemon_cfg['jobs']:
+        logging.warning("No jobs configured for report daemon")
+        return
+
+    now = datetime.datetime.now()
+    for name, job_cfg in daemon_cfg['jobs'].items():
+        JOBS[name] = {
+            'cfg': job_cfg, 'next_run': get_next_run(job_cfg, now), 'running': False, 'deferred': False,
+            'last_start': None, 'last_end': None, 'last_status': None, 'last_error': None}
+        logging.info("Scheduled job '%s' for %s" % (name, JOBS[name]['next_run']))
+
+    server = start_control_server(socket_path, args)
+    EXECUTOR = ThreadPoolExecutor(max_workers=daemon_cfg['workers'], thread_name_prefix='job')
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logging.info("Report daemon started with %d jobs, listening on %s" % (len(JOBS), socket_path))
+
+    try:
+        while not STOP.is_set():
+            now = datetime.datetime.now()
+            for name, job in JOBS.items():
+                # jobs remain due while another job for the same report is
+                # running, being submitted on one of the next polls
+                if job['next_run'] is not None and job['next_run'] <= now and trigger_job(args, name):
+                    job['next_run'] = get_next_run(job['cfg'], now)
+            STOP.wait(daemon_cfg['poll_interval'])
+    except KeyboardInterrupt:
+        logging.info("Stopping report daemon")
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        running = [name for name, job in JOBS.items() if job['running']]
+        if running:
+            logging.info("Waiting for running jobs to finish: %s" % ", ".join(sorted(running)))
+        EXECUTOR.shutdown(wait=True)
+        logging.info("Report daemon stopped")
+
+
+def request_stop(signum, frame):
+    """
+    Signals the daemon to stop once running jobs have finished.
+    """
+    logging.info("Stopping report daemon (signal %d)" % signum)
+    STOP.set()
+
+
+def get_next_run(job_cfg, after):
+    """
+    Gets next point in time to run the specified job after the given one,
+    either using an interval (in seconds) or a list of daily start times.
+    """
+    if job_cfg.get('every'):
+        return after + datetime.timedelta(seconds=job_cfg['every'])
+    if job_cfg.get('at'):
+        candidates = list()
+        for start_time in job_cfg['at']:
+            start_time = datetime.datetime.strptime(str(start_time), '%H:%M').time()
+            candidate = datetime.datetime.combine(after.date(), start_time)
+            if candidate <= after:
+                candidate += datetime.timedelta(days=1)
+            candidates.append(candidate)
+        return min(candidates)
+    # jobs without schedule are only run on request
+    return None
+
+
+def get_lock_keys(job_cfg):
+    """
+    Gets lock keys, i.e. combinations of report type and environment, that
+    are affected by the specified job. Loading spooled rows affects all
+    reports, publishing a report affects it in all environments.
+    """
+    job_type = job_cfg.get('type', 'query')
+    if job_type in ['lineage', 'summary']:
+        return {(job_type, 'all')}
+
+    report_types = REPORT_TYPES if job_cfg.get('report_type', 'all') == 'all' else [job_cfg['report_type']]
+    if job_type == 'load':
+        report_types = REPORT_TYPES
+
+    envs = job_cfg.get('environment', 'all')
+    envs = list(ENV['environments'].keys()) if envs == 'all' or job_type in ['load', 'publish'] else [envs]
+    lock_keys = {(report_type, env) for report_type in report_types for env in envs}
+    if job_type == 'publish':
+        lock_keys.update(('publish', report_type) for report_type in report_types)
+    return lock_keys
+
+
+def trigger_job(args, name):
+    """
+    Submits the specified job for execution unless a job for the same report
+    and environment is currently running. Returns whether the job has been
+    submitted.
+    """
+    job = JOBS[name]
+    lock_keys = get_lock_keys(job['cfg'])
+
+    with LOCK:
+        if lock_keys & BUSY:
+            if not job['deferred']:
+                logging.warning("Deferring job '%s', another job for the same report is running" % name)
+                job['deferred'] = True
+            return False
+        job['deferred'] = False
+        # starting with closed circuit breakers if no other job is running
+        if not BUSY:
+            http_utils.reset()
+        BUSY.update(lock_keys)
+        job['running'] = True
+
+    EXECUTOR.submit(execute_job, args, name, lock_keys)
+    return True
+
+
+def execute_job(args, name, lock_keys):
+    """
+    Executes the specified job, recording its result.
+    """
+    job = JOBS[name]
+    job['last_start'] = datetime.datetime.now()
+    logging.info("Starting job '%s'" % name)
+    t0 = time.time()
+    try:
+        run_job(args, job['cfg'])
+        job['last_status'] = 'succeeded'
+        job['last_error'] = None
+    except Exception as e:
+        logging.exception("Job '%s' failed" % name)
+        job['last_status'] = 'failed'
+        job['last_error'] = "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        job['last_end'] = datetime.datetime.now()
+        with LOCK:
+            BUSY.difference_update(lock_keys)
+            job['running'] = False
+    logging.info("Job '%s' %s in %s" % (name, job['last_status'], utils.format_interval(time.time() - t0)))
+
+
+def run_job(args, job_cfg):
+    """
+    Runs the report functions for the specified job configuration.
+    """
+    job_args = dict(DEFAULT_JOB_ARGS, **args)
+    job_args.update(job_cfg.get('args') or dict())
+    job_type = job_cfg.get('type', 'query')
+
+    if job_type == 'lineage':
+        build_lineage(job_args)
+        return
+    if job_type == 'summary':
+        summarize_reports(job_args)
+        return
+    if job_type == 'load':
+        if not load_spool(job_args):
+            raise RuntimeError("Target database unavailable, spooled rows remain to be loaded")
+        return
+
+    report_types = REPORT_TYPES if job_cfg.get('report_type', 'all') == 'all' else [job_cfg['report_type']]
+    if job_type == 'publish':
+        results = publish_reports(job_args, report_types)
+        failed = [report_type for report_type, (status, _) in results.items() if status == 'failed']
+        if failed:
+            raise RuntimeError("Unable to publish %s" % ", ".join(sorted(failed)))
+        return
+
+    # re-creating target tables, if requested, when querying the first
+    # environment only
+    for report_type in report_types:
+        envs = job_cfg.get('environment', 'all')
+        for i, env in enumerate(ENV['environments'].keys() if envs == 'all' else [envs]):
+            QUERY_FUNCTIONS[report_type](dict(
+                job_args, report_type=report_type, query_environment=env, initial=job_args['initial'] and not i))
+
+
+def get_status():
+    """
+    Gets status of the daemon, i.e. schedules and most recent results of all
+    jobs as well as cache statistics.
+    """
+    with LOCK:
+        jobs = {name: {k: v for k, v in job.items() if k != 'cfg'} for name, job in JOBS.items()}
+    return {
+        'jobs': jobs,
+        'caches': cache_utils.get_stats(),
+        'engines': len(db_utils.ENGINES),
+        'table_definitions': len(db_utils.TABLE_DEFS),
+        'open_circuits': sorted(http_utils.OPEN_CIRCUITS),
+        'host_limits': http_utils.get_host_limits(),
+    }
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single JSON-encoded command received via the control socket.
+    """
+    def handle(self):
+        try:
+            command = json.loads(self.rfile.readline().decode('utf-8'))
+            if command.get('command') == 'status':
+                response = get_status()
+            elif command.get('command') == 'run':
+                if command.get('job') not in JOBS:
+                    response = {'error': "Unknown job '%s'" % command.get('job')}
+                else:
+                    response = {'submitted': trigger_job(self.server.args, command['job'])}
+            else:
+                response = {'error': "Unknown command '%s'" % command.get('command')}
+        except ValueError as e:
+            response = {'error': "Invalid command (%s)" % e}
+        self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+
+
+def start_control_server(socket_path, args):
+    """
+    Starts serving the control socket at the specified path in a background
+    thread.
+    """
+    if os.path.exists(socket_path):
+        try:
+            send_command(socket_path, 'status')
+            raise RuntimeError("Another report daemon is already listening on %s" % socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # removing stale socket of a daemon that hasn't been stopped properly
+            os.remove(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, ControlHandler)
+    server.daemon_threads = True
+    server.args = args
+    threading.Thread(target=server.serve_forever, name='control', daemon=True).start()
+    return server
+
+
+def send_command(socket_path, command, **params):
+    """
+    Sends a command to a running daemon via its control socket and returns the
+    decoded response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(dict(params, command=command)).encode('utf-8') + b'\n')
+        with client.makefile('rb') as response:
+            return json.loads(response.readline().decode('utf-8'))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Maintains compact daily summary tables for trend dashboards, i.e. counts of
+services, maps and their status per environment and reference date as well as
+services added or removed since the previous reference date of the same
+environment. Summaries are updated incrementally, only processing reference
+dates that haven't been summarized yet or whose report rows have been loaded
+(again) through the spool since, e.g. by re-runs or re-extractions.
+'''
+import os
+import time
+import logging
+import datetime
+
+from collections import defaultdict
+
+from sqlalchemy import select, func, case, and_, distinct
+
+import utils.general_utils as utils
+import utils.db_utils as db_utils
+
+from table_defs.daily_summaries import service_summary_table_def, map_summary_table_def, service_change_table_def
+
+ENV = utils.get_environment(os.path.join(os.path.dirname(__file__), 'reports'))
+
+SUMMARY_TABLE_DEFS = {
+    'summary_service_tbl': service_summary_table_def,
+    'summary_map_tbl': map_summary_table_def,
+    'summary_change_tbl': service_change_table_def,
+}
+
+# configuration keys of the spooled report tables underlying the summaries
+SERVICE_REPORT_TBLS = ['ags_tgt_table']
+MAP_REPORT_TBLS = ['ma_tgt_tbl', 'ma_tgt_service_tbl', 'ma_tgt_search_tbl', 'ma_tgt_basemap_tbl']
+
+
+def summarize_reports(args):
+    """
+    Updates daily summary tables from service and map reports.
+    """
+    cfg = utils.complete_configuration(ENV, args)
+
+    t0 = time.time()
+
+    engine = db_utils.get_engine(cfg['db_cfg'], cfg['tgt_db'])
+
+    for cfg_key, table_def in SUMMARY_TABLE_DEFS.items():
+        if cfg.get('initial'):
+            db_utils.drop_create_table_by_def(table_def(cfg[cfg_key]), engine, True)
+        if not db_utils.table_exists(engine, cfg[cfg_key]):
+            db_utils.drop_create_table_by_def(table_def(cfg[cfg_key]), engine)
+        else:
+            db_utils.add_missing_columns(table_def(cfg[cfg_key]), engine)
+
+    ags_tbl = db_utils.get_table_definition_with_engine(cfg['ags_tgt_table'], engine)
+    map_tbls = {
+        'maps': db_utils.get_table_definition_with_engine(cfg['ma_tgt_tbl'], engine),
+        'services': db_utils.get_table_definition_with_engine(cfg['ma_tgt_service_tbl'], engine),
+        'searches': db_utils.get_table_definition_with_engine(cfg['ma_tgt_search_tbl'], engine),
+        'basemaps': db_utils.get_table_definition_with_engine(cfg['ma_tgt_basemap_tbl'], engine),
+    }
+    service_summary_tbl = db_utils.get_table_definition_with_engine(cfg['summary_service_tbl'], engine)
+    map_summary_tbl = db_utils.get_table_definition_with_engine(cfg['summary_map_tbl'], engine)
+    change_tbl = db_utils.get_table_definition_with_engine(cfg['summary_change_tbl'], engine)
+    load_tbl = None
+    if db_utils.table_exists(engine, cfg['spool_load_tbl']):
+        load_tbl = db_utils.get_table_definition_with_engine(cfg['spool_load_tbl'], engine)
+
+    with engine.connect() as connection:
+        service_dates = get_dates_to_summarize(
+            connection, ags_tbl, service_summary_tbl, load_tbl, SERVICE_REPORT_TBLS, True)
+        map_dates = get_dates_to_summarize(connection, map_tbls['maps'], map_summary_tbl, load_tbl, MAP_REPORT_TBLS)
+
+    logging.info("Summarizing service reports for %d and map reports for %d reference dates" % (
+        len(service_dates), len(map_dates)))
+
+    if cfg.get('dry_run'):
+        logging.info("Summaries would be updated for %s" % ", ".join(
+            str(d) for d in sorted(set(service_dates + map_dates))))
+        return
+
+    for ref_date in service_dates:
+        summarize_services(engine, ags_tbl, service_summary_tbl, change_tbl, ref_date)
+    for ref_date in map_dates:
+        summarize_maps(engine, map_tbls, map_summary_tbl, ref_date)
+
+    logging.info("Summaries updated in %s" % utils.format_interval(time.time() - t0))
+
+
+def get_dates_to_summarize(connection, src_tbl, summary_tbl, load_tbl, tbl_keys, with_successors=False):
+    """
+    Gets reference dates from the specified source table that haven't been
+    summarized yet or whose rows of the given report tables have been loaded
+    according to the spool ledger after they were summarized. Optionally
+    includes the reference date following each of these dates, as changes
+    recorded for it depend on the rows of the previous reference date.
+    """
+    src_dates = sorted(row[0] for row in connection.execute(
+        select([distinct(src_tbl.c.reference_date)])) if row[0] is not None)
+    summarized = dict(tuple(row) for row in connection.execute(select([
+        summary_tbl.c.reference_date, func.min(summary_tbl.c.summarized_at)]).group_by(summary_tbl.c.reference_date)))
+    loaded = dict()
+    if load_tbl is not None:
+        loaded = dict(tuple(row) for row in connection.execute(select([
+            load_tbl.c.reference_date, func.max(load_tbl.c.loaded_at)]).where(
+            load_tbl.c.tgt_table.in_(tbl_keys)).group_by(load_tbl.c.reference_date)))
+
+    dates = set()
+    for i, ref_date in enumerate(src_dates):
+        # summaries without timestamp have been created by previous versions
+        if ref_date not in summarized or summarized[ref_date] is None or (
+                loaded.get(ref_date) is not None and loaded[ref_date] > summarized[ref_date]):
+            dates.add(ref_date)
+            if with_successors and i + 1 < len(src_dates):
+                dates.add(src_dates[i + 1])
+    return sorted(dates)
+
+
+def summarize_services(engine, ags_tbl, summary_tbl, change_tbl, ref_date):
+    """
+    Summarizes service report for the specified reference date and records
+    services added or removed since the previous reference date of each
+    environment, i.e. environments missing on single reference dates don't
+    cause their services to be reported as removed and added again.
+    """
+    summarized_at = datetime.datetime.now()
+    summary_select = select([
+        ags_tbl.c.env,
+        func.count(distinct(ags_tbl.c.svc_folder)),
+        # folders are missing in reports created before they were recorded
+        func.count(distinct(func.coalesce(ags_tbl.c.svc_folder, '') + '/' + ags_tbl.c.svc_name)),
+        func.count(),
+        func.count(distinct(ags_tbl.c.db_schema + '.' + ags_tbl.c.db_table)),
+    ]).where(ags_tbl.c.reference_date == ref_date).group_by(ags_tbl.c.env)
+
+    with engine.begin() as connection:
+        summaries = [{
+            'reference_date': ref_date, 'env': env, 'folders': folders, 'services': services, 'layers': layers,
+            'db_tables': db_tables, 'summarized_at': summarized_at
+        } for env, folders, services, layers, db_tables in connection.execute(summary_select)]
+
+        previous_dates = dict(tuple(row) for row in connection.execute(select([
+            ags_tbl.c.env, func.max(ags_tbl.c.reference_date)]).where(
+            ags_tbl.c.reference_date < ref_date).group_by(ags_tbl.c.env)))
+        changes = list()
+        for summary in summaries:
+            env = summary['env']
+            previous_date = previous_dates.get(env)
+            if previous_date is None:
+                continue
+            current = get_services(connection, ags_tbl, env, ref_date)
+            previous = get_services(connection, ags_tbl, env, previous_date)
+            if any(folder for folder, _ in current) and any(folder for folder, _ in previous):
+                added, removed = current - previous, previous - current
+            else:
+                # comparing names only if folders haven't been recorded yet
+                current_names = set(name for _, name in current)
+                previous_names = set(name for _, name in previous)
+                added = set(s for s in current if s[1] not in previous_names)
+                removed = set(s for s in previous if s[1] not in current_names)
+            for change, services in [('added', added), ('removed', removed)]:
+                changes.extend({
+                    'reference_date': ref_date, 'previous_date': previous_date, 'env': env,
+                    'svc_folder': svc_folder, 'svc_name': svc_name, 'change': change
+                } for svc_folder, svc_name in sorted(services, key=lambda s: tuple(v or '' for v in s)))
+
+        connection.execute(summary_tbl.delete().where(summary_tbl.c.reference_date == ref_date))
+        connection.execute(change_tbl.delete().where(change_tbl.c.reference_date == ref_date))
+        if summaries:
+            connection.execute(summary_tbl.insert(), summaries)
+        if changes:
+            connection.execute(change_tbl.insert(), changes)
+
+    logging.info("Services for %s summarized (%d changes)" % (ref_date, len(changes)))
+
+
+def get_services(connection, ags_tbl, env, ref_date):
+    """
+    Gets folder and name of all services in the service report for the
+    specified environment and reference date.
+    """
+    return set(tuple(row) for row in connection.execute(
+        select([ags_tbl.c.svc_folder, ags_tbl.c.svc_name]).distinct().where(and_(
+            ags_tbl.c.env == env, ags_tbl.c.reference_date == ref_date))))
+
+
+def summarize_maps(engine, map_tbls, summary_tbl, ref_date):
+    """
+    Summarizes map reports for the specified reference date.
+    """
+    maps_tbl = map_tbls['maps']
+    services_tbl = map_tbls['services']
+    searches_tbl = map_tbls['searches']
+    basemaps_tbl = map_tbls['basemaps']
+
+    selects = {
+        ('maps', 'enabled_maps', 'domain_bundle_maps'): select([
+            maps_tbl.c.env, func.count(),
+            func.sum(case([(maps_tbl.c.enabled.is_(True), 1)], else_=0)),
+            func.sum(case([(maps_tbl.c.domain_bundles_used.is_(True), 1)], else_=0)),
+        ]).where(maps_tbl.c.reference_date == ref_date).group_by(maps_tbl.c.env),
+        ('map_services', 'invalid_services', 'unsecured_services'): select([
+            services_tbl.c.env, func.count(),
+            func.sum(case([(services_tbl.c.valid.is_(False), 1)], else_=0)),
+            func.sum(case([(and_(services_tbl.c.valid.is_(True), services_tbl.c.secured.is_(False)), 1)], else_=0)),
+        ]).where(services_tbl.c.reference_date == ref_date).group_by(services_tbl.c.env),
+        ('search_stores', 'search_maps'): select([
+            searches_tbl.c.env, func.count(), func.count(distinct(searches_tbl.c.app_id)),
+        ]).where(searches_tbl.c.reference_date == ref_date).group_by(searches_tbl.c.env),
+        ('basemaps', ): select([
+            basemaps_tbl.c.env, func.count(),
+        ]).where(basemaps_tbl.c.reference_date == ref_date).group_by(basemaps_tbl.c.env),
+    }
+
+    summarized_at = datetime.datetime.now()
+
+    with engine.begin() as connection:
+        summaries = defaultdict(lambda: {col.name: 0 for col in summary_tbl.c if col.name not in [
+            'objectid', 'reference_date', 'env', 'summarized_at']})
+        for cols, summary_select in selects.items():
+            for row in connection.execute(summary_select):
+                summaries[row[0]].update(zip(cols, (v or 0 for v in row[1:])))
+
+        connection.execute(summary_tbl.delete().where(summary_tbl.c.reference_date == ref_date))
+        if summaries:
+            connection.execute(summary_tbl.insert(), [
+                dict(summary, reference_date=ref_date, env=env, summarized_at=summarized_at)
+                for env, summary in summaries.items()])
+
+    logging.info("Maps for %s summarized" % ref_date)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+
+from reports.crawl_worker import run_worker
+
+import utils.general_utils as utils
+
+env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
+query_environments = list(env['environments'].keys())
+
+CHOICES = ['ags_service_layers', 'mapapps_maps']
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Crawl items enqueued for distributed crawling"))
+    parser.add_argument(
+        '-e', '--environment', dest='worker_env', required=False, default=None,
+        choices=query_environments, help='Only crawl items of the specified environment')
+    parser.add_argument(
+        '-r', '--report-type', dest='worker_report_type', required=False, default=None,
+        choices=CHOICES, help='Only crawl items for the specified kind of report')
+    parser.add_argument(
+        '--exit-when-idle', dest='exit_when_idle', required=False, default=False,
+        action='store_true', help='Exit as soon as no items are left to be crawled')
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', required=False, default=False,
+        action='store_true', help='Log details for every single item')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True, verbose=args['verbose'])
+
+    run_worker(args)
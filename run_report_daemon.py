@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import argparse
+
+from reports.report_daemon import run_daemon, send_command, DEFAULT_DAEMON_CFG
+
+import utils.general_utils as utils
+
+env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
+socket_path = (env.get('daemon_cfg') or dict()).get('socket', DEFAULT_DAEMON_CFG['socket'])
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Run report jobs on schedules in a long-running process"))
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='Conduct dry runs only')
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', required=False, default=False,
+        action='store_true', help='Log details for every single item')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('start', help='Start daemon (default)')
+    subparsers.add_parser('status', help='Show status of a running daemon')
+    run_parser = subparsers.add_parser('run', help='Run job of a running daemon now')
+    run_parser.add_argument(dest='job', help='Name of the job to be run')
+
+    args = vars(parser.parse_args())
+
+    if args['command'] in ['status', 'run']:
+        response = send_command(os.path.abspath(socket_path), args['command'], job=args.get('job'))
+        print(json.dumps(response, indent=2))
+    else:
+        utils.prepare_logging(__file__, verbose=args['verbose'])
+        run_daemon({'dry_run': args['dry_run']})
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+
+from reports.export_snapshot import export_snapshot
+
+import utils.general_utils as utils
+
+env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
+query_environments = list(env['environments'].keys())
+query_environments.append('all')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Export report snapshots to Parquet files"))
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='Conduct a dry run only')
+    parser.add_argument(
+        '-e', '--environment', dest='query_environment', required=False, default=query_environments[-1],
+        choices=query_environments, help='Name of the environment to be exported')
+    parser.add_argument(
+        '-d', '--date', dest='ref_date', required=False, default=None,
+        help='Reference date (YYYY-MM-DD) of the snapshot to be exported, defaults to the most recent one')
+    parser.add_argument(
+        '-o', '--output', dest='export_dir', required=False, default=None,
+        help='Target directory for exported files')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    export_snapshot(args)
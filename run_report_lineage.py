@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+
+from reports.build_lineage import build_lineage, get_apps_by_table, get_tables_by_app
+
+import utils.general_utils as utils
+
+env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
+query_environments = list(env['environments'].keys())
+query_environments.append('all')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Analyze lineage of maps, map services and database tables"))
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='Conduct a dry run only')
+    parser.add_argument(
+        '-e', '--environment', dest='query_environment', required=False, default=query_environments[-1],
+        choices=query_environments, help='Name of the environment to be queried')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='(Re-)Build lineage from most recent reports')
+    build_parser.add_argument(
+        '--initial', dest='initial', required=False, default=False,
+        action='store_true', help='(Re-)Create target table initially')
+    apps_parser = subparsers.add_parser('apps', help='List maps using the specified database table')
+    apps_parser.add_argument(
+        dest='db_table', help='Name of the database table, optionally qualified by schema and database')
+    tables_parser = subparsers.add_parser('tables', help='List database tables used by the specified map')
+    tables_parser.add_argument(dest='app_id', help='ID of the map')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    if args['command'] == 'build':
+        build_lineage(args)
+    elif args['command'] == 'apps':
+        rows = get_apps_by_table(args)
+        for row in rows:
+            print("%-6s %-40s %-8s %s/%s (%s) - %s" % (
+                row.app_env, row.app_id, row.source, row.svc_folder, row.svc_name, row.svc_env, row.app_title))
+        print("%d maps found using table '%s'" % (len(set((r.app_env, r.app_id) for r in rows)), args['db_table']))
+    elif args['command'] == 'tables':
+        rows = get_tables_by_app(args)
+        for row in rows:
+            print("%-6s %s.%s.%s via %s/%s (%s, %s)" % (
+                row.app_env, row.db, row.db_schema, row.db_table, row.svc_folder, row.svc_name, row.svc_env,
+                row.source))
+        print("%d tables found for map '%s'" % (
+            len(set((r.db, r.db_schema, r.db_table) for r in rows)), args['app_id']))
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from reports.load_spool import load_spool
+
+import utils.general_utils as utils
+
+from utils.db_utils import LOAD_MODES
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Load spooled rows of previous crawls into report tables"))
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='List spooled segments to be loaded only')
+    parser.add_argument(
+        '--load-mode', dest='load_mode', required=False, default=None,
+        choices=LOAD_MODES, help='Mode for loading spooled rows into target tables')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    if not load_spool(args):
+        raise SystemExit(1)
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import sys
 import argparse
 
-from reports.publish_report import publish_report
+from reports.publish_report import publish_report, publish_reports, PUBLISH_MODES
 
 import utils.general_utils as utils
+import utils.profiling as profiling
 
 CHOICES = ['ags_service_layers', 'mapapps_maps', 'all']
 
@@ -16,6 +18,12 @@ if __name__ == '__main__':
     parser.add_argument(
         '--dry-run', dest='dry_run', required=False, default=False,
         action='store_true', help='Conduct a dry run only')
+    parser.add_argument(
+        '-m', '--mode', dest='publish_mode', required=False, default=None, choices=PUBLISH_MODES,
+        help='Publish all rows on the page or a summary page with all rows attached')
+    parser.add_argument(
+        '--profile', dest='profile', required=False, default=False,
+        action='store_true', help='Profile stages of the run, writing results to the log directory')
     parser.add_argument(
         dest='report_type', help='The kind of report to be created',
         choices=CHOICES)
@@ -24,11 +32,17 @@ if __name__ == '__main__':
 
     utils.prepare_logging(__file__, screen_only=True)
 
-    if args['report_type'] == 'all':
-        for choice in CHOICES:
-            if choice == 'all':
-                continue
-            args['report_type'] = choice
-            publish_report(args)
-    else:
-        publish_report(args)
+    if args['profile']:
+        profiling.enable(__file__)
+
+    try:
+        if args['report_type'] == 'all':
+            results = publish_reports(args, [choice for choice in CHOICES if choice != 'all'])
+            statuses = [status for status, _ in results.values()]
+        else:
+            statuses = [publish_report(args)[0]]
+    finally:
+        profiling.finish()
+
+    if 'failed' in statuses:
+        sys.exit(1)
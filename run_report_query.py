@@ -7,8 +7,14 @@ import argparse
 
 from reports.query_ags_service_layers import query_ags_service_layers
 from reports.query_mapapps_maps import query_mapapps_maps
+from reports.build_lineage import build_lineage
+from reports.summarize_reports import summarize_reports
 
 import utils.general_utils as utils
+import utils.profiling as profiling
+import utils.recording as recording
+
+from utils.db_utils import LOAD_MODES
 
 env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
 query_environments = list(env['environments'].keys())
@@ -16,6 +22,37 @@ query_environments.append('all')
 
 CHOICES = ['ags_service_layers', 'mapapps_maps', 'all']
 
+
+def run_report_query(args):
+    """
+    Queries information for the specified report type(s) and environment(s).
+    Target tables are (re-)created initially, if requested, when querying the
+    first environment only.
+    """
+    if args['report_type'] in ['ags_service_layers', 'all']:
+        if args['query_environment'] == 'all':
+            for i, e in enumerate(e for e in query_environments if e != 'all'):
+                logging.info("Quering ArcGIS server layers for environment: %s\n" % e)
+                query_ags_service_layers(dict(args, query_environment=e, initial=args['initial'] and not i))
+        else:
+            logging.info("Querying ArcGIS server layers for single environment: %s\n" % args['query_environment'])
+            query_ags_service_layers(args)
+    if args['report_type'] in ['mapapps_maps', 'all']:
+        if args['query_environment'] == 'all':
+            for i, e in enumerate(e for e in query_environments if e != 'all'):
+                logging.info("Quering map.apps for environment: %s\n" % e)
+                query_mapapps_maps(dict(args, query_environment=e, initial=args['initial'] and not i))
+        else:
+            logging.info("Querying map.apps for single environment: %s\n" % args['query_environment'])
+            query_mapapps_maps(args)
+    if args['report_type'] == 'all' and not args.get('distributed'):
+        logging.info("Building lineage of maps, services and database tables\n")
+        build_lineage(args)
+        logging.info("Updating daily summaries of reports\n")
+        # keeping summaries of previous reference dates when report tables are re-created
+        summarize_reports(dict(args, initial=False))
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description=("Query information about GIS configuration"))
@@ -25,43 +62,54 @@ if __name__ == '__main__':
     parser.add_argument(
         '--initial', dest='initial', required=False, default=False,
         action='store_true', help='(Re-)Create target table initially')
+    parser.add_argument(
+        '--load-mode', dest='load_mode', required=False, default=None,
+        choices=LOAD_MODES, help='Mode for loading collected rows into target tables')
+    parser.add_argument(
+        '--distributed', dest='distributed', required=False, default=False,
+        action='store_true', help='Enqueue items to be crawled by distributed workers')
+    parser.add_argument(
+        '--resume', dest='resume', required=False, default=False,
+        action='store_true', help='Resume most recent interrupted crawl from its checkpoint')
+    parser.add_argument(
+        '--retry-failed', dest='retry_failed', required=False, default=False,
+        action='store_true', help='Crawl items again that failed in the most recent crawl')
+    recording_group = parser.add_mutually_exclusive_group()
+    recording_group.add_argument(
+        '--record', dest='record', required=False, default=None, metavar='ARCHIVE',
+        help='Record all HTTP exchanges and source database reads into the specified archive')
+    recording_group.add_argument(
+        '--replay', dest='replay', required=False, default=None, metavar='ARCHIVE',
+        help='Replay HTTP exchanges and source database reads from the specified archive, without writing rows')
     parser.add_argument(
         '-e', '--environment', dest='query_environment', required=False, default=query_environments[-1],
         choices=query_environments, help='Name of the environment to be queried')
     parser.add_argument(
         '-l', '--limit', dest='limit', default=0, type=int, nargs='?',
         help='Maximum number of source entries to be processed')
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', required=False, default=False,
+        action='store_true', help='Log details for every single item')
+    parser.add_argument(
+        '--profile', dest='profile', required=False, default=False,
+        action='store_true', help='Profile stages of the run, writing results to the log directory')
     parser.add_argument(
         dest='report_type', help='The kind of report to be created',
         choices=CHOICES)
 
     args = vars(parser.parse_args())
 
-    utils.prepare_logging(__file__, screen_only=True)
+    utils.prepare_logging(__file__, screen_only=True, verbose=args['verbose'])
 
-    if args['report_type'] in ['ags_service_layers', 'all']:
-        if args['query_environment'] == 'all':
-            for e in query_environments:
-                if e == 'all':
-                    continue
-                args['query_environment'] = e
-                logging.info("Quering ArcGIS server layers for environment: %s\n" % e)
-                query_ags_service_layers(args)
-            else:
-                # re-setting query_environment to make it work for all environments again below
-                # TODO: this is somewhat dumb, have to think of something better later
-                args['query_environment'] = 'all'
-        else:
-            logging.info("Querying ArcGIS server layers for single environment: %s\n" % args['query_environment'])
-            query_ags_service_layers(args)
-    if args['report_type'] in ['mapapps_maps', 'all']:
-        if args['query_environment'] == 'all':
-            for e in query_environments:
-                if e == 'all':
-                    continue
-                args['query_environment'] = e
-                logging.info("Quering map.apps for environment: %s\n" % e)
-                query_mapapps_maps(args)
-        else:
-            logging.info("Querying map.apps for single environment: %s\n" % args['query_environment'])
-            query_mapapps_maps(args)
+    if args['record']:
+        recording.start_recording(args['record'])
+    elif args['replay']:
+        recording.start_replay(args['replay'])
+    if args['profile']:
+        profiling.enable(__file__)
+
+    try:
+        run_report_query(args)
+    finally:
+        recording.stop()
+        profiling.finish()
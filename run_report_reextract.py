@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import datetime
+
+from reports.reextract_reports import reextract_reports, REPORT_TYPES
+
+import utils.general_utils as utils
+
+env = utils.get_environment(os.path.join(".", 'reports', 'reports'))
+query_environments = list(env['environments'].keys())
+query_environments.append('all')
+
+CHOICES = REPORT_TYPES + ['all']
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=(
+        "Re-extract report rows for past reference dates from archived service manifests and map configurations"))
+    parser.add_argument(
+        '-t', '--report-type', dest='report_type', required=False, default='all',
+        choices=CHOICES, help='Report type(s) to re-extract')
+    parser.add_argument(
+        '-e', '--environment', dest='query_environment', required=False, default='all',
+        choices=query_environments, help='Environment(s) to re-extract reports for')
+    parser.add_argument(
+        '-f', '--from', dest='from_date', required=True, type=datetime.date.fromisoformat,
+        help='First reference date to re-extract reports for (YYYY-MM-DD)')
+    parser.add_argument(
+        '-u', '--until', dest='to_date', required=False, default=None, type=datetime.date.fromisoformat,
+        help='Last reference date to re-extract reports for (YYYY-MM-DD, default: first reference date)')
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='Re-extract rows without replacing existing report rows')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    reextract_reports(args)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from reports.summarize_reports import summarize_reports
+
+import utils.general_utils as utils
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=("Update daily summary tables of service and map reports"))
+    parser.add_argument(
+        '--dry-run', dest='dry_run', required=False, default=False,
+        action='store_true', help='Conduct a dry run only')
+    parser.add_argument(
+        '--initial', dest='initial', required=False, default=False,
+        action='store_true', help='(Re-)Create summary tables, summarizing all available reference dates')
+
+    args = vars(parser.parse_args())
+
+    utils.prepare_logging(__file__, screen_only=True)
+
+    summarize_reports(args)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Column types portable across the supported target database backends.
+'''
+from sqlalchemy.types import TypeDecorator, String, JSON
+from sqlalchemy.dialects.postgresql import ARRAY
+
+# dialects with native support for arrays
+ARRAY_DIALECTS = ['postgresql', 'duckdb']
+
+
+class StringArray(TypeDecorator):
+    """
+    Array of strings, stored as native array where supported and as JSON
+    otherwise, e.g. in SQLite.
+    """
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name in ARRAY_DIALECTS:
+            return dialect.type_descriptor(ARRAY(String))
+        return dialect.type_descriptor(JSON())
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+from sqlalchemy.schema import Column, Table, Index, MetaData
+from sqlalchemy.types import Integer, String, Date, DateTime, LargeBinary
+
+import utils.general_utils as utils
+
+
+def crawl_queue_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    crawl_queue_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('report_type', String(32), comment='Type of report the item is crawled for.'),
+        Column('env', String(32), comment='Environment of the item.'),
+        Column('reference_date', Date, comment='Reference date of the crawl.'),
+        Column('item_key', String(512), comment='Identifier of the item, e.g. service path or map id.'),
+        Column('payload', LargeBinary, comment='JSON-serialized item as handed over to the worker.'),
+        Column('status', String(10), comment='Processing status, i.e. queued, claimed, done or failed.'),
+        Column('worker', String(255), comment='Worker that most recently claimed the item.'),
+        Column('attempts', Integer, comment='Number of times the item has been claimed.'),
+        Column('lease_expires', DateTime, comment='Time after which a claimed item may be claimed again.'),
+        Column('reason', String(1024), comment='Reason for failing to crawl the item.'),
+        Column('enqueued_at', DateTime, comment='Time the item was enqueued.'),
+        Column('finished_at', DateTime, comment='Time the item was processed.'),
+        Index("crawl_queue_status_idx_%s" % utils.get_random_string().lower(), 'status', 'report_type', 'env'),
+        schema=schema,
+        comment='Work queue for distributed crawling of services and maps.'
+    )
+
+    return crawl_queue_table_def
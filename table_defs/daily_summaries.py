@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+from sqlalchemy.schema import Column, Table, Index, MetaData
+from sqlalchemy.types import Integer, String, Date, DateTime
+
+import utils.general_utils as utils
+
+
+def service_summary_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    service_summary_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('reference_date', Date, comment='Reference date of the underlying service report.'),
+        Column('env', String(32), comment='Service environment.'),
+        Column('folders', Integer, comment='Number of service directories.'),
+        Column('services', Integer, comment='Number of map services.'),
+        Column('layers', Integer, comment='Number of service layers.'),
+        Column('db_tables', Integer, comment='Number of distinct database tables used by service layers.'),
+        Column('summarized_at', DateTime, comment='Time the service report was summarized.'),
+        Index("svc_summary_idx_%s" % utils.get_random_string().lower(), 'reference_date', 'env'),
+        schema=schema,
+        comment='Daily summary of ArcGIS server services per environment.'
+    )
+
+    return service_summary_table_def
+
+
+def map_summary_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    map_summary_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('reference_date', Date, comment='Reference date of the underlying map reports.'),
+        Column('env', String(32), comment='Environment of the maps.'),
+        Column('maps', Integer, comment='Number of maps.'),
+        Column('enabled_maps', Integer, comment='Number of enabled maps.'),
+        Column('domain_bundle_maps', Integer, comment='Number of maps using domain bundles.'),
+        Column('map_services', Integer, comment='Number of map services used in maps.'),
+        Column('invalid_services', Integer, comment='Number of invalid map services used in maps.'),
+        Column('unsecured_services', Integer, comment='Number of valid, but unsecured map services used in maps.'),
+        Column('search_stores', Integer, comment='Number of search stores configured in maps.'),
+        Column('search_maps', Integer, comment='Number of maps with search stores.'),
+        Column('basemaps', Integer, comment='Number of basemaps configured in maps.'),
+        Column('summarized_at', DateTime, comment='Time the map reports were summarized.'),
+        Index("map_summary_idx_%s" % utils.get_random_string().lower(), 'reference_date', 'env'),
+        schema=schema,
+        comment='Daily summary of configured maps per environment.'
+    )
+
+    return map_summary_table_def
+
+
+def service_change_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    service_change_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('reference_date', Date, comment='Reference date of the underlying service report.'),
+        Column('previous_date', Date, comment='Reference date of the service report compared to.'),
+        Column('env', String(32), comment='Service environment.'),
+        Column('svc_folder', String(100), comment='Directory of the map service.'),
+        Column('svc_name', String(100), comment='Name of the map service.'),
+        Column('change', String(10), comment='Type of change, i.e. added or removed.'),
+        Index("svc_change_idx_%s" % utils.get_random_string().lower(), 'reference_date', 'env'),
+        schema=schema,
+        comment='Map services added or removed since the previous service report.'
+    )
+
+    return service_change_table_def
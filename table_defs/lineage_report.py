@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+from sqlalchemy.schema import Column, Table, Index, MetaData
+from sqlalchemy.types import Integer, String, Date
+
+import utils.general_utils as utils
+
+
+def lineage_report_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    suffix = utils.get_random_string().lower()
+
+    lineage_report_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('app_id', String(255), comment='ID of the map.'),
+        Column('app_title', String(512), comment='Title of the map.'),
+        Column('app_env', String(32), comment='Environment of the map.'),
+        Column('source', String(10), comment='Usage of the service within the map, i.e. map or search.'),
+        Column('app_layer_id', String(255), comment='ID of the map service or search store within the map.'),
+        Column('svc_env', String(32), comment='Environment of the underlying map service.'),
+        Column('svc_folder', String(100), comment='Directory of the underlying map service.'),
+        Column('svc_name', String(100), comment='Name of the underlying map service.'),
+        Column('svc_layer_id', Integer, comment='ID of the layer in the map service, if applicable.'),
+        Column('db', String(50), comment='Source database for service layer.'),
+        Column('db_schema', String(50), comment='Source database schema for service layer.'),
+        Column('db_table', String(50), comment='Source database table for service layer.'),
+        Column('reference_date', Date, comment='Reference date of the underlying map report.'),
+        Index("lineage_tbl_idx_%s" % suffix, 'db_table', 'db_schema'),
+        Index("lineage_app_idx_%s" % suffix, 'app_id'),
+        schema=schema,
+        comment='Links between maps, map services and database tables for the most recent reports.'
+    )
+
+    return lineage_report_table_def
@@ -4,7 +4,8 @@
 
 from sqlalchemy.schema import Column, Table, MetaData
 from sqlalchemy.types import Integer, String, DateTime, Boolean, Date
-from sqlalchemy.dialects.postgresql import ARRAY
+
+from table_defs.column_types import StringArray
 
 
 def mapapps_service_table_def(table_name, schema=None):
@@ -30,9 +31,11 @@ def mapapps_service_table_def(table_name, schema=None):
         Column('svc_url', String(512), comment=(
             'URL of the underlying map service, as specified in the map configuration.')),
         Column('svc_name', String(100), comment='Name of the underlying map service.'),
+        Column('svc_folder', String(100), comment='ArcGIS server directory of the underlying map service.'),
         Column('svc_env', String(32), comment='Environment of underlying map service.'),
         Column('valid', Boolean, comment='Indicates whether the service url is valid.'),
         Column('secured', Boolean, comment='Indicates whether the service is secured via Security Manager.'),
+        Column('valid_checked', Date, comment='Date the validity of the service url was last checked.'),
         Column('reference_date', Date, comment='Reference date of most recent data update.'),
         schema=schema,
         comment='Information about configured map services in maps.'
@@ -137,9 +140,9 @@ def mapapps_report_table_def(table_name, schema=None):
         Column('version', Integer, comment='MapApps version of the map, i.e. 3 or 4'),
         Column('description', String(2048), comment='Description of the map.'),
         Column('status', String(255), comment='Status of the map.'),
-        Column('loaded_bundles', ARRAY(String), comment='Bundles loaded in the map.'),
-        Column('configured_bundles', ARRAY(String), comment='Bundles configured in the map.'),
-        Column('domain_bundles', ARRAY(String), comment='Domain bundles registered in the map.'),
+        Column('loaded_bundles', StringArray, comment='Bundles loaded in the map.'),
+        Column('configured_bundles', StringArray, comment='Bundles configured in the map.'),
+        Column('domain_bundles', StringArray, comment='Domain bundles registered in the map.'),
         Column('domain_bundles_used', Boolean, comment='Indicator whether the map is currently using domain bundles.'),
         Column('enabled', Boolean, comment='Indicator whether the map is currently enabled.'),
         Column('created_at', DateTime, comment='Time of map creation.'),
@@ -147,7 +150,7 @@ def mapapps_report_table_def(table_name, schema=None):
         Column('modified_at', DateTime, comment='Time of last map modification.'),
         Column('modified_by', String(512), comment='Name of the one last modifiying the map.'),
         Column('sharedgroups_count', String(512), comment='Number of groups the map was made accessible to.'),
-        Column('sharedgroups', ARRAY(String), comment='The groups the map was made accessible to.'),
+        Column('sharedgroups', StringArray, comment='The groups the map was made accessible to.'),
         Column('url', String(512), comment='URL of the map.'),
         Column('reference_date', Date, comment='Reference date of most recent data update.'),
         schema=schema,
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+'''
+Compact, slotted record types for rows collected by the crawlers. Each record
+type provides exactly one attribute per column of the corresponding target
+table (except for the primary key), i.e. all rows share the same fixed schema
+and columns not explicitly set are filled with None at construction.
+'''
+from operator import attrgetter
+
+from table_defs.ags_service_layer_report import ags_service_layer_report_table_def
+from table_defs.mapapps_reports import mapapps_basemap_table_def
+from table_defs.mapapps_reports import mapapps_report_table_def
+from table_defs.mapapps_reports import mapapps_search_table_def
+from table_defs.mapapps_reports import mapapps_service_table_def
+
+
+class RowRecord:
+
+    __slots__ = ()
+    fields = ()
+    getter = None
+
+    def __init__(self, **kwargs):
+        for field in self.fields:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError("Unknown column(s) for %s: %s" % (self.__class__.__name__, ", ".join(kwargs)))
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            self.__class__.__name__, ", ".join("%s=%r" % (f, getattr(self, f)) for f in self.fields))
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.fields
+
+    def as_tuple(self):
+        return self.getter(self)
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.getter(self)))
+
+
+def get_record_type(type_name, table_def):
+    """
+    Creates a slotted record type for the columns of the specified table
+    definition, omitting the primary key column.
+    """
+    fields = tuple(c.name for c in table_def.columns if not c.primary_key)
+    # retrieving all values at once (always as tuple, even for a single column)
+    getter = attrgetter(*fields) if len(fields) > 1 else (lambda r: (getattr(r, fields[0]),))
+    return type(type_name, (RowRecord,), {'__slots__': fields, 'fields': fields, 'getter': staticmethod(getter)})
+
+
+ServiceLayerRecord = get_record_type(
+    'ServiceLayerRecord', ags_service_layer_report_table_def('arcgis_service_report'))
+MapRecord = get_record_type('MapRecord', mapapps_report_table_def('mapapps_report'))
+SearchStoreRecord = get_record_type('SearchStoreRecord', mapapps_search_table_def('mapapps_search_report'))
+BasemapRecord = get_record_type('BasemapRecord', mapapps_basemap_table_def('mapapps_basemap_report'))
+ServiceRecord = get_record_type('ServiceRecord', mapapps_service_table_def('mapapps_service_report'))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# # -*- coding: utf-8 -*-
+
+from sqlalchemy.schema import Column, Table, Index, MetaData
+from sqlalchemy.types import Integer, String, Date, DateTime
+
+import utils.general_utils as utils
+
+
+def spool_load_table_def(table_name, schema=None):
+
+    if schema is None:
+        try:
+            schema, table_name = table_name.split(".")
+        except ValueError as e:
+            schema = None
+
+    meta = MetaData()
+
+    spool_load_table_def = Table(
+        table_name, meta,
+        Column('objectid', Integer, primary_key=True, comment='Unique key.'),
+        Column('checksum', String(64), unique=True, comment='SHA-256 checksum of the spool segment.'),
+        Column('segment', String(255), comment='File name of the spool segment.'),
+        Column('tgt_table', String(64), comment='Configuration key of the target table loaded into.'),
+        Column('env', String(32), comment='Environment of the spooled rows.'),
+        Column('reference_date', Date, comment='Reference date of the spooled rows.'),
+        Column('created_at', DateTime, comment='Time the segment was spooled.'),
+        Column('row_count', Integer, comment='Number of rows loaded from the segment.'),
+        Column('loaded_at', DateTime, comment='Time the segment was loaded.'),
+        Index(
+            "spool_load_tbl_idx_%s" % utils.get_random_string().lower(), 'tgt_table', 'env', 'reference_date'),
+        schema=schema,
+        comment='Spool segments loaded into report tables.'
+    )
+
+    return spool_load_table_def
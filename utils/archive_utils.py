@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Content-addressed archive of raw configurations retrieved while crawling,
+i.e. service manifests and map configurations (app.json). Bodies are stored
+gzip-compressed once per SHA-256 digest of their content, so unchanged
+configurations don't take up additional space. A SQLite index keeps track of
+the body retrieved for each item, environment and reference date along with
+the item itself (e.g. a service or a source database row), allowing to
+re-extract report rows for past reference dates without network access.
+
+Note: Archived items are pickled, only use archives from trusted sources.
+'''
+import os
+import gzip
+import pickle
+import sqlite3
+import hashlib
+import logging
+import datetime
+import threading
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+OBJECTS_DIR = 'objects'
+INDEX_FILE = 'index.sqlite'
+
+# archive directory -> index connection
+INDEXES = dict()
+
+LOCK = threading.Lock()
+
+
+def get_archive_dir(cfg):
+    """
+    Gets configured archive directory, None if archiving has been disabled.
+    """
+    if cfg.get('archive_dir') is False:
+        return None
+    return cfg.get('archive_dir') or DEFAULT_ARCHIVE_DIR
+
+
+def get_index(archive_dir):
+    """
+    Gets (lazily opened) index of the specified archive directory.
+    """
+    with LOCK:
+        if archive_dir not in INDEXES:
+            if not os.path.isdir(archive_dir):
+                os.makedirs(archive_dir)
+            connection = sqlite3.connect(os.path.join(archive_dir, INDEX_FILE), check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bodies ("
+                "report_type TEXT, env TEXT, reference_date TEXT, item_key TEXT, digest TEXT, item BLOB, "
+                "archived_at TEXT, PRIMARY KEY (report_type, env, reference_date, item_key))")
+            connection.commit()
+            INDEXES[archive_dir] = connection
+        return INDEXES[archive_dir]
+
+
+def close():
+    """
+    Closes indexes of all archives used in this process.
+    """
+    with LOCK:
+        for connection in INDEXES.values():
+            connection.close()
+        INDEXES.clear()
+
+
+def get_object_path(archive_dir, digest):
+    """
+    Gets path of the object holding the body with the specified digest.
+    """
+    return os.path.join(archive_dir, OBJECTS_DIR, digest[:2], "%s.gz" % digest)
+
+
+def archive_body(cfg, report_type, item_key, item, body):
+    """
+    Archives specified body retrieved for the given item in the currently
+    queried environment on the current reference date. The body itself is
+    only written if no identical body has been archived before.
+    """
+    archive_dir = get_archive_dir(cfg)
+    if not archive_dir:
+        return
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()
+
+    # failing to archive a body doesn't affect the crawl itself
+    try:
+        object_path = get_object_path(archive_dir, digest)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = "%s.%d.%d.tmp" % (object_path, os.getpid(), threading.get_ident())
+            with gzip.open(tmp_path, 'wb') as object_file:
+                object_file.write(body)
+            os.replace(tmp_path, object_path)
+
+        index = get_index(archive_dir)
+        with LOCK:
+            index.execute(
+                "INSERT OR REPLACE INTO bodies (report_type, env, reference_date, item_key, digest, item, "
+                "archived_at) VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                    report_type, cfg['query_environment'], cfg['ref_date'].isoformat(), item_key, digest,
+                    pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL), datetime.datetime.now().isoformat()))
+            index.commit()
+    except (OSError, sqlite3.Error) as e:
+        logging.warning("Unable to archive body for '%s': %s", item_key, e)
+
+
+def get_archived_dates(cfg, report_type, env, from_date, to_date):
+    """
+    Gets all reference dates within the specified range with bodies archived
+    for the given report type and environment.
+    """
+    index = get_index(get_archive_dir(cfg))
+    with LOCK:
+        return [datetime.date.fromisoformat(ref_date) for ref_date, in index.execute(
+            "SELECT DISTINCT reference_date FROM bodies WHERE report_type = ? AND env = ? "
+            "AND reference_date BETWEEN ? AND ? ORDER BY reference_date",
+            (report_type, env, from_date.isoformat(), to_date.isoformat()))]
+
+
+def load_bodies(cfg, report_type, env, ref_date):
+    """
+    Loads all items and their bodies archived for the specified report type,
+    environment and reference date.
+    """
+    archive_dir = get_archive_dir(cfg)
+    index = get_index(archive_dir)
+    with LOCK:
+        entries = index.execute(
+            "SELECT item_key, digest, item FROM bodies WHERE report_type = ? AND env = ? AND reference_date = ? "
+            "ORDER BY item_key", (report_type, env, ref_date.isoformat())).fetchall()
+    for item_key, digest, item in entries:
+        with gzip.open(get_object_path(archive_dir, digest), 'rb') as object_file:
+            yield item_key, pickle.loads(item), object_file.read()
+
+
+def get_stats(cfg):
+    """
+    Gets number of archived bodies, distinct objects and their total size on
+    disk.
+    """
+    archive_dir = get_archive_dir(cfg)
+    index = get_index(archive_dir)
+    with LOCK:
+        bodies, objects = index.execute("SELECT COUNT(*), COUNT(DISTINCT digest) FROM bodies").fetchone()
+    size = 0
+    for dir_path, _, file_names in os.walk(os.path.join(archive_dir, OBJECTS_DIR)):
+        size += sum(os.path.getsize(os.path.join(dir_path, file_name)) for file_name in file_names)
+    return {'bodies': bodies, 'objects': objects, 'size': size}
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Named in-process caches with a time to live for their entries, e.g. for server
+tokens, service manifests or availability checks. Within a single run these
+avoid repeated requests for the same resource, in daemon mode they are kept
+warm across runs. Expired entries are evicted periodically when new entries
+are added.
+'''
+import time
+import threading
+
+# default time to live (in seconds) per cache, may be overridden by a
+# 'cache_cfg' section in the process configuration
+DEFAULT_TTLS = {
+    'token': 1800,
+    'manifest': 3600,
+    'availability': 3600,
+}
+
+# cache name -> key -> (expiry timestamp, value)
+CACHES = dict()
+# cache name -> [hits, misses]
+STATS = dict()
+# cache name -> timestamp of the next eviction of expired entries
+EVICTIONS = dict()
+
+LOCK = threading.Lock()
+
+
+def get_ttl(cfg, name):
+    """
+    Gets configured time to live for the named cache.
+    """
+    return (cfg.get('cache_cfg') or dict()).get("%s_ttl" % name, DEFAULT_TTLS.get(name, 0))
+
+
+def cached_call(name, key, ttl, fn, *args, **kwargs):
+    """
+    Returns cached value for the specified key from the named cache, or calls
+    the specified function and caches its result for the given number of
+    seconds. A time to live of zero disables caching, empty (None) results
+    aren't cached.
+    """
+    if not ttl:
+        return fn(*args, **kwargs)
+
+    with LOCK:
+        cache = CACHES.setdefault(name, dict())
+        stats = STATS.setdefault(name, [0, 0])
+        expires, value = cache.get(key, (0, None))
+        if expires > time.time():
+            stats[0] += 1
+            return value
+        stats[1] += 1
+
+    value = fn(*args, **kwargs)
+    if value is not None:
+        with LOCK:
+            now = time.time()
+            cache[key] = (now + ttl, value)
+            # evicting expired entries at most once per time to live
+            if EVICTIONS.get(name, 0) <= now:
+                for expired_key in [k for k, (expires, _) in cache.items() if expires <= now]:
+                    del cache[expired_key]
+                EVICTIONS[name] = now + ttl
+    return value
+
+
+def clear(name=None):
+    """
+    Clears the named cache or all caches.
+    """
+    with LOCK:
+        for cache_name in ([name] if name else list(CACHES.keys())):
+            CACHES.pop(cache_name, None)
+            STATS.pop(cache_name, None)
+            EVICTIONS.pop(cache_name, None)
+
+
+def get_stats():
+    """
+    Gets number of entries, hits and misses for all caches.
+    """
+    with LOCK:
+        return {
+            name: {'entries': len(CACHES.get(name, dict())), 'hits': hits, 'misses': misses}
+            for name, (hits, misses) in STATS.items()}
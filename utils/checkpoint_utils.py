@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Durable per-item checkpoints for crawls. For every crawled item its status,
+i.e. done or failed, the reason for failing and the resulting rows are stored
+in a local SQLite database per report type, environment and reference date.
+Interrupted crawls may be resumed from these checkpoints and items that failed
+may be crawled again selectively. Checkpoints are removed once they are older
+than the configured retention period.
+'''
+import os
+import glob
+import pickle
+import sqlite3
+import logging
+import datetime
+
+DEFAULT_CHECKPOINT_DIR = 'checkpoint'
+# days to keep checkpoints of previous crawls
+DEFAULT_RETENTION = 7
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def get_checkpoint_path(cfg, report_type, ref_date):
+    """
+    Gets path to the checkpoint database for the specified report type and
+    reference date in the currently queried environment.
+    """
+    return os.path.join(
+        cfg.get('checkpoint_dir') or DEFAULT_CHECKPOINT_DIR,
+        "%s_%s_%s.sqlite" % (report_type, cfg['query_environment'], ref_date.strftime('%Y%m%d')))
+
+
+def find_checkpoints(cfg, report_type):
+    """
+    Finds all checkpoint databases for the specified report type in the
+    currently queried environment, returning their paths and reference dates
+    in chronological order.
+    """
+    checkpoint_paths = sorted(glob.glob(os.path.join(
+        cfg.get('checkpoint_dir') or DEFAULT_CHECKPOINT_DIR,
+        "%s_%s_????????.sqlite" % (report_type, cfg['query_environment']))))
+    return [(
+        checkpoint_path, datetime.datetime.strptime(os.path.splitext(checkpoint_path)[0][-8:], '%Y%m%d').date()
+    ) for checkpoint_path in checkpoint_paths]
+
+
+def find_latest_checkpoint(cfg, report_type):
+    """
+    Finds most recent checkpoint database for the specified report type in the
+    currently queried environment, returning its path and reference date.
+    """
+    checkpoints = find_checkpoints(cfg, report_type)
+    if not checkpoints:
+        return None, None
+    return checkpoints[-1]
+
+
+def remove_old_checkpoints(cfg, report_type):
+    """
+    Removes checkpoint databases for the specified report type in the currently
+    queried environment with reference dates older than the configured
+    retention period.
+    """
+    retention = cfg.get('checkpoint_retention', DEFAULT_RETENTION)
+    min_date = cfg['ref_date'] - datetime.timedelta(days=retention)
+    for checkpoint_path, ref_date in find_checkpoints(cfg, report_type):
+        if ref_date >= min_date:
+            continue
+        logging.debug("Removing checkpoint %s", checkpoint_path)
+        for path in (checkpoint_path, "%s-wal" % checkpoint_path, "%s-shm" % checkpoint_path):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def prepare_checkpoint(cfg, report_type):
+    """
+    Opens checkpoint database for the current crawl. When resuming or retrying
+    failed items the most recent checkpoint is used and its reference date is
+    adopted for the current crawl, otherwise a new checkpoint is created for
+    the current reference date.
+    """
+    if cfg.get('resume') or cfg.get('retry_failed'):
+        checkpoint_path, ref_date = find_latest_checkpoint(cfg, report_type)
+        if checkpoint_path:
+            logging.info("Continuing crawl for %s from checkpoint %s" % (ref_date, checkpoint_path))
+            cfg['ref_date'] = ref_date
+            return open_checkpoint(checkpoint_path)
+        logging.warning("No checkpoint found to continue from, starting new crawl")
+
+    remove_old_checkpoints(cfg, report_type)
+    return open_checkpoint(get_checkpoint_path(cfg, report_type, cfg['ref_date']), reset=True)
+
+
+def open_checkpoint(checkpoint_path, reset=False):
+    """
+    Opens (and optionally resets) the specified checkpoint database.
+    """
+    checkpoint_dir = os.path.dirname(checkpoint_path)
+    if checkpoint_dir and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    if reset and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    connection = sqlite3.connect(checkpoint_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS items ("
+        "item_key TEXT PRIMARY KEY, status TEXT, reason TEXT, rows BLOB, updated_at TEXT)")
+    connection.commit()
+    return connection
+
+
+def get_item_states(connection):
+    """
+    Gets status and reason for failing (if applicable) for all items in the
+    specified checkpoint.
+    """
+    return {
+        item_key: (status, reason)
+        for item_key, status, reason in connection.execute("SELECT item_key, status, reason FROM items")}
+
+
+def select_items(cfg, connection, items, key_func):
+    """
+    Selects items to be crawled from all specified items, depending on their
+    status in the given checkpoint. When resuming, items that haven't been
+    crawled yet are selected, when retrying failed items the ones that
+    previously failed are selected.
+    """
+    if not (cfg.get('resume') or cfg.get('retry_failed')):
+        return items
+
+    item_states = get_item_states(connection)
+    selected = [item for item in items if is_selected(cfg, item_states, key_func(item))]
+
+    logging.info("%d of %d items selected for crawling (%d done previously)" % (
+        len(selected), len(items), list(s for s, _ in item_states.values()).count(STATUS_DONE)))
+    return selected
+
+
+def is_selected(cfg, item_states, item_key):
+    """
+    Checks whether the item with the specified key is to be crawled, depending
+    on the given item states of a checkpoint.
+    """
+    if not (cfg.get('resume') or cfg.get('retry_failed')):
+        return True
+    status, _ = item_states.get(item_key, (None, None))
+    if status is None:
+        return bool(cfg.get('resume'))
+    return status == STATUS_FAILED and bool(cfg.get('retry_failed'))
+
+
+def save_item(connection, item_key, rows=None, reason=None):
+    """
+    Durably saves resulting rows of a crawled item (or the reason for failing
+    to crawl it) to the specified checkpoint.
+    """
+    connection.execute(
+        "INSERT OR REPLACE INTO items (item_key, status, reason, rows, updated_at) VALUES (?, ?, ?, ?, ?)", (
+            item_key, STATUS_FAILED if reason else STATUS_DONE, reason,
+            None if reason else pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL),
+            datetime.datetime.now().isoformat()))
+    connection.commit()
+
+
+def load_rows(connection):
+    """
+    Loads resulting rows of all items crawled successfully from the specified
+    checkpoint.
+    """
+    for (rows, ) in connection.execute("SELECT rows FROM items WHERE status = ? ORDER BY item_key", (STATUS_DONE, )):
+        yield pickle.loads(rows)
+
+
+def get_failures(connection):
+    """
+    Gets keys and reasons for all items in the specified checkpoint that
+    couldn't be crawled.
+    """
+    return connection.execute(
+        "SELECT item_key, reason FROM items WHERE status = ? ORDER BY item_key", (STATUS_FAILED, )).fetchall()
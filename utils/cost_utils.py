@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Per-item crawl costs, i.e. elapsed time, size of the retrieved configuration
+and number of resulting rows, persisted in a local SQLite database across
+runs. Costs of previous runs are used to schedule crawls longest processing
+time first (LPT), starting new or changed items (with unknown costs) right
+away, so that a few large items don't start late and delay the whole crawl.
+'''
+import os
+import time
+import heapq
+import sqlite3
+import logging
+import datetime
+
+import utils.general_utils as utils
+
+DEFAULT_COST_STORE = os.path.join('checkpoint', 'crawl_costs.sqlite')
+
+
+def open_cost_store(cfg):
+    """
+    Opens configured cost store database.
+    """
+    store_path = cfg.get('cost_store') or DEFAULT_COST_STORE
+    store_dir = os.path.dirname(store_path)
+    if store_dir and not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    connection = sqlite3.connect(store_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS costs ("
+        "report_type TEXT, env TEXT, item_key TEXT, fingerprint TEXT, elapsed REAL, size INTEGER, "
+        "row_count INTEGER, updated_at TEXT, PRIMARY KEY (report_type, env, item_key))")
+    connection.commit()
+    return connection
+
+
+def get_costs(connection, report_type, env):
+    """
+    Gets fingerprint and elapsed time of the most recent crawl for all items
+    of the specified report type and environment.
+    """
+    return {
+        item_key: (fingerprint, elapsed) for item_key, fingerprint, elapsed in connection.execute(
+            "SELECT item_key, fingerprint, elapsed FROM costs WHERE report_type = ? AND env = ?",
+            (report_type, env))}
+
+
+def order_items(costs, items, key_func, fingerprint_func=None):
+    """
+    Orders specified items for crawling, i.e. new items and items changed
+    since their most recent crawl first, followed by all other items in
+    descending order of their previous crawl time. Returns ordered items and
+    the estimated crawl time for each of them (None if unknown).
+    """
+    new_items = list()
+    known_items = list()
+    for item in items:
+        elapsed = get_estimate(costs, item, key_func, fingerprint_func)
+        if elapsed is None:
+            new_items.append((item, costs.get(key_func(item), (None, None))[1]))
+        else:
+            known_items.append((item, elapsed))
+    known_items.sort(key=lambda entry: -entry[1])
+
+    logging.info("Scheduling %d new or changed items first, %d items by previous crawl time" % (
+        len(new_items), len(known_items)))
+    ordered = new_items + known_items
+    return [item for item, _ in ordered], [elapsed for _, elapsed in ordered]
+
+
+def get_estimate(costs, item, key_func, fingerprint_func=None):
+    """
+    Gets estimated crawl time of the specified item from its previous crawl,
+    or None if the item is new or has changed since.
+    """
+    fingerprint, elapsed = costs.get(key_func(item), (None, None))
+    if fingerprint_func and fingerprint != fingerprint_func(item):
+        return None
+    return elapsed
+
+
+def save_cost(connection, report_type, env, item_key, cost, fingerprint=None):
+    """
+    Saves measured cost, i.e. elapsed time, size and number of rows, of the
+    most recent crawl of the specified item.
+    """
+    connection.execute(
+        "INSERT OR REPLACE INTO costs (report_type, env, item_key, fingerprint, elapsed, size, row_count, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            report_type, env, item_key, fingerprint, cost.get('elapsed'), cost.get('size'), cost.get('rows'),
+            datetime.datetime.now().isoformat()))
+    connection.commit()
+
+
+def measure_call(cost, fn, *args):
+    """
+    Calls specified crawl function, passing the given dictionary to collect
+    item-specific costs and adding start and elapsed time to it.
+    """
+    cost['started'] = time.time()
+    t0 = time.perf_counter()
+    try:
+        return fn(*args, cost=cost)
+    finally:
+        cost['elapsed'] = time.perf_counter() - t0
+
+
+def get_lpt_makespan(durations, workers):
+    """
+    Gets makespan of scheduling jobs with the specified durations in the given
+    order on the given number of workers, each job starting on the worker
+    becoming available first.
+    """
+    finish_times = [0.0] * max(workers, 1)
+    for duration in durations:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + duration)
+    return max(finish_times)
+
+
+def log_makespan(costs, workers, estimates=None):
+    """
+    Logs achieved makespan of a crawl, i.e. the time from starting the first
+    item until now, compared to the lower bound for the measured item
+    durations, i.e. the longest single item or all items evenly distributed
+    across workers, and to the makespan estimated from previous crawl times.
+    """
+    if not costs:
+        return
+    makespan = time.time() - min(cost['started'] for cost in costs)
+    durations = [cost['elapsed'] for cost in costs]
+    lower_bound = max(max(durations), sum(durations) / max(workers, 1))
+    logging.info("Crawl makespan %s, ideal %s (%.2fx) for %d items on %d workers" % (
+        utils.format_interval(makespan), utils.format_interval(lower_bound),
+        makespan / lower_bound if lower_bound else 1.0, len(durations), workers))
+    known_estimates = [estimate for estimate in (estimates or list()) if estimate is not None]
+    if known_estimates:
+        logging.info("Estimated makespan for %d items with known crawl times: %s" % (
+            len(known_estimates), utils.format_interval(get_lpt_makespan(known_estimates, workers))))
@@ -1,11 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import time
 import yaml
 import logging
+import functools
 
-from sqlalchemy import MetaData, Table
-from sqlalchemy import select, func
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Sequence, DefaultClause
+from sqlalchemy import select, func, text
+from sqlalchemy.types import Integer
+
+import utils.general_utils as utils
+
+LOAD_MODES = ['direct', 'staging']
+# dialects of embedded databases stored in a local file, i.e. not requiring a
+# database server
+EMBEDDED_DIALECTS = ['sqlite', 'duckdb']
+# number of rows handed over to the database driver at once
+INSERT_BATCH_SIZE = 10000
+
+# pooled engines and reflected table definitions, kept for the lifetime of the
+# process to be re-used by subsequent runs in daemon mode
+ENGINES = dict()
+TABLE_DEFS = dict()
+
+
+def get_db_config(cfg_src, section):
+    """
+    Gets specified section from a database configuration file.
+    """
+    cfg_base = yaml.safe_load(open(cfg_src))
+    return cfg_base[section]
 
 
 def get_db_connection(cfg_src, section):
@@ -13,8 +39,11 @@ def get_db_connection(cfg_src, section):
     Gets database connection parameters (usable for sqlalchemy) from specified
     section in a configuration file.
     """
-    cfg_base = yaml.safe_load(open(cfg_src))
-    cfg = cfg_base[section]
+    cfg = get_db_config(cfg_src, section)
+
+    # embedded databases are specified by the path to the database file
+    if cfg['api_dialect'] in EMBEDDED_DIALECTS:
+        return "%s:///%s" % (cfg['api_dialect'], cfg['path'])
 
     user = cfg['user']
     password = cfg['password']
@@ -44,6 +73,43 @@ def get_db_connection(cfg_src, section):
     return conn_string
 
 
+def get_engine(cfg_src, section):
+    """
+    Gets (pooled) database engine for the connection specified by the given
+    section in a configuration file, re-using a previously created engine for
+    the same connection.
+    """
+    key = (cfg_src, section)
+    if key not in ENGINES:
+        cfg = get_db_config(cfg_src, section)
+        if cfg['api_dialect'] in EMBEDDED_DIALECTS:
+            db_dir = os.path.dirname(cfg['path'])
+            if db_dir and not os.path.isdir(db_dir):
+                os.makedirs(db_dir)
+        engine = create_engine(get_db_connection(cfg_src, section), pool_pre_ping=True)
+        if cfg['api_dialect'] in EMBEDDED_DIALECTS:
+            event.listen(engine, 'connect', functools.partial(
+                prepare_schemas, cfg['api_dialect'], cfg['path'], cfg.get('schemas') or list()))
+        ENGINES[key] = engine
+    return ENGINES[key]
+
+
+def prepare_schemas(dialect, db_path, schemas, dbapi_connection, connection_record):
+    """
+    Makes specified schemas available on a new connection to an embedded
+    database, i.e. attaches a separate database file per schema to SQLite
+    databases and creates missing schemas in DuckDB databases.
+    """
+    cursor = dbapi_connection.cursor()
+    for schema in schemas:
+        if dialect == 'sqlite':
+            db_stem, db_ext = os.path.splitext(db_path)
+            cursor.execute("ATTACH DATABASE ? AS \"%s\"" % schema, ("%s.%s%s" % (db_stem, schema, db_ext), ))
+        else:
+            cursor.execute("CREATE SCHEMA IF NOT EXISTS \"%s\"" % schema)
+    cursor.close()
+
+
 def get_table_definition_with_engine(table_name, engine, schema=None, custom_cols=None):
     """
     Retrieves table definition for given table name using specified database
@@ -57,10 +123,14 @@ def get_table_definition_with_engine(table_name, engine, schema=None, custom_col
         try:
             schema, table_name = table_name.split(".")
         except ValueError:
-            schema = ''
+            schema = None
 
     if custom_cols is None:
-        return Table(table_name, meta, schema=schema, autoload_with=engine, autoload=True)
+        # re-using previously reflected definitions
+        key = (str(engine.url), schema or '', table_name)
+        if key not in TABLE_DEFS:
+            TABLE_DEFS[key] = Table(table_name, meta, schema=schema, autoload_with=engine, autoload=True)
+        return TABLE_DEFS[key]
     else:
         return Table(table_name, meta, *custom_cols, schema=schema, autoload_with=engine, autoload=True)
 
@@ -74,7 +144,7 @@ def table_exists(engine, table_name, schema=None):
         try:
             schema, table_name = table_name.split(".")
         except ValueError:
-            schema = ''
+            schema = None
     with engine.connect() as connection:
         return engine.dialect.has_table(connection, table_name, schema=schema)
 
@@ -87,6 +157,9 @@ def drop_create_table_by_def(table_def, engine, drop=False, schema=None):
     table_name = table_def.name
     schema = table_def.schema
 
+    # discarding previously reflected definition
+    TABLE_DEFS.pop((str(engine.url), schema or '', table_name), None)
+
     if engine.dialect.has_table(engine.connect(), table_name, schema):
         logging.info("Table '%s' already exists" % table_name)
         if drop:
@@ -100,10 +173,41 @@ def drop_create_table_by_def(table_def, engine, drop=False, schema=None):
             logging.info("Retaining existing table '%s'" % table_name)
             return
 
+    # DuckDB doesn't support serial columns, i.e. integer primary keys are
+    # populated by sequences instead
+    if engine.dialect.name == 'duckdb':
+        for col in table_def.primary_key.columns:
+            if isinstance(col.type, Integer):
+                seq = Sequence("%s_%s_seq" % (table_name, col.name), schema=schema)
+                seq.create(engine, checkfirst=True)
+                col.server_default = DefaultClause(seq.next_value())
+                col.autoincrement = False
+
     logging.info("Creating table '%s'" % table_name)
     table_def.create(engine)
 
 
+def add_missing_columns(table_def, engine):
+    """
+    Adds columns of the given table definition that are missing in the
+    existing database table, e.g. after extending a report table.
+    """
+    tbl = get_table_definition_with_engine(table_def.name, engine, table_def.schema)
+    missing_cols = [c for c in table_def.columns if c.name not in tbl.c]
+    if not missing_cols:
+        return
+
+    preparer = engine.dialect.identifier_preparer
+    with engine.connect() as connection:
+        for col in missing_cols:
+            logging.info("Adding column '%s' to table '%s'" % (col.name, table_def.name))
+            connection.execute(text("ALTER TABLE %s ADD COLUMN %s %s" % (
+                preparer.format_table(tbl), preparer.format_column(col), col.type.compile(dialect=engine.dialect))))
+
+    # discarding previously reflected definition
+    TABLE_DEFS.pop((str(engine.url), table_def.schema or '', table_def.name), None)
+
+
 def get_most_recent_date(tbl, date_col, engine):
     """
     Gets most recent date stored in given column by querying via provided
@@ -123,3 +227,95 @@ def get_most_recent_date(tbl, date_col, engine):
             logging.info("Most recent date found: %s" % max_date)
 
     return max_date
+
+
+def replace_rows(engine, tgt_table, rows, delete_stmt, load_mode='direct'):
+    """
+    Replaces the rows matched by the given deletion statement in the specified
+    table with the provided rows. Depending on the load mode rows are either
+    written directly into the target table or loaded into a staging table
+    first that are copied into place in a single transaction afterwards.
+    """
+    if load_mode == 'staging':
+        if engine.dialect.name == 'postgresql':
+            return replace_rows_via_staging(engine, tgt_table, rows, delete_stmt)
+        logging.info("Staging is only supported for PostgreSQL, loading rows directly")
+
+    with engine.connect() as connection:
+        logging.info("Deleting entries previously created today")
+        connection.execute(delete_stmt)
+        logging.info("Inserting new items")
+        insert_rows(connection, tgt_table, rows)
+
+    return True
+
+
+def replace_rows_via_staging(engine, tgt_table, rows, delete_stmt):
+    """
+    Loads provided rows into an unlogged staging table that is structurally
+    identical to the specified target table. After validating the number of
+    staged rows, the rows matched by the given deletion statement are replaced
+    by copies of the staged ones in a single transaction, i.e. readers never see
+    a partially loaded day. Rows are transferred from the client outside of
+    this transaction, so locks on the target table are held while deleting and
+    copying the rows of the affected day only. Returns whether rows have been
+    replaced.
+    """
+    preparer = engine.dialect.identifier_preparer
+    stg_table_name = "%s_stg_%s" % (tgt_table.name, utils.get_random_string(lower=True))
+    stg_table = Table(
+        stg_table_name, MetaData(),
+        *[Column(c.name, c.type) for c in tgt_table.columns if not c.primary_key],
+        schema=tgt_table.schema)
+    stg_table_fqn = preparer.format_table(stg_table)
+
+    logging.info("Creating staging table %s" % stg_table_fqn)
+    with engine.connect() as connection:
+        # not including defaults, as these would draw values from the target
+        # table's sequence for every staged row
+        connection.execute(text("CREATE UNLOGGED TABLE %s (LIKE %s)" % (
+            stg_table_fqn, preparer.format_table(tgt_table))))
+
+    try:
+        with engine.connect() as connection:
+            logging.info("Inserting new items into staging table")
+            insert_rows(connection, stg_table, rows)
+            staged_cnt = connection.execute(select([func.count()]).select_from(stg_table)).scalar()
+
+        if staged_cnt != len(rows):
+            logging.error(
+                "Staging table %s contains %d instead of %d rows, retaining current entries" % (
+                    stg_table_fqn, staged_cnt, len(rows)))
+            return False
+
+        col_names = [c.name for c in stg_table.columns]
+        t0 = time.time()
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            connection.execute(delete_stmt)
+            inserted_cnt = connection.execute(
+                tgt_table.insert().from_select(col_names, select(list(stg_table.columns)))).rowcount
+            if inserted_cnt != staged_cnt:
+                transaction.rollback()
+                logging.error("%d instead of %d staged rows copied into %s, retaining current entries" % (
+                    inserted_cnt, staged_cnt, preparer.format_table(tgt_table)))
+                return False
+            transaction.commit()
+        logging.info("Replaced rows of %s by %d staged items in %.3f seconds" % (
+            preparer.format_table(tgt_table), staged_cnt, time.time() - t0))
+    finally:
+        with engine.connect() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS %s" % stg_table_fqn))
+
+    return True
+
+
+def insert_rows(connection, tgt_table, rows, batch_size=INSERT_BATCH_SIZE):
+    """
+    Inserts provided rows, i.e. dictionaries or row records, into the
+    specified table in batches of the given size.
+    """
+    insert_stmt = tgt_table.insert().values(dict())
+    for i in range(0, len(rows), batch_size):
+        batch = [row.as_dict() if hasattr(row, 'as_dict') else row for row in rows[i:i + batch_size]]
+        connection.execute(insert_stmt, batch)
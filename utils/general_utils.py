@@ -3,11 +3,17 @@
 
 import os
 import yaml
+import queue
+import atexit
 import string
 import random
 import logging
 
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
+
+# listener writing queued log records in a background thread
+LOG_LISTENER = None
 
 
 def get_environment(py_src):
@@ -53,10 +59,15 @@ def complete_configuration(env, args):
     return cfg
 
 
-def prepare_logging(code_file, suffix=None, screen_only=False):
+def prepare_logging(code_file, suffix=None, screen_only=False, verbose=False):
     """
-    Prepares logging for the spefified Python code file.
+    Prepares logging for the spefified Python code file. Log records are
+    handed over to a queue and written to file and console by a background
+    thread, debug messages (e.g. per-item details) are only emitted if
+    verbose output was requested.
     """
+    global LOG_LISTENER
+
     # retrieving current timestamp
     now = "%04d%02d%02d_%02d%02d%02d" % (
         datetime.now().year, datetime.now().month, datetime.now().day,
@@ -71,25 +82,45 @@ def prepare_logging(code_file, suffix=None, screen_only=False):
         suffix = ''.join(c for c in str(suffix) if c.isalnum())
         logfile = "%s_%s_%s.log" % (now, os.path.splitext(os.path.basename(code_file))[0], suffix)
 
-    # sending log output to dev/null if only screen output was configured
-    if screen_only:
-        logpath = os.devnull
-    else:
-        logpath = os.path.join(logdir, logfile)
+    handlers = list()
 
-    # preparing logging configuration for file output
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-        filename=logpath,
-        filemode='w')
+    # preparing file output unless only screen output was configured
+    if not screen_only:
+        file_handler = logging.FileHandler(os.path.join(logdir, logfile), mode='w')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s'))
+        handlers.append(file_handler)
 
     # adding console output
     console = logging.StreamHandler()
-    console.setLevel(logging.INFO)
     formatter = logging.Formatter('+ %(message)s')
     console.setFormatter(formatter)
-    logging.getLogger('').addHandler(console)
+    handlers.append(console)
+
+    # replacing handlers of a previous configuration
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+    else:
+        atexit.register(stop_logging)
+    root_logger = logging.getLogger('')
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    LOG_LISTENER = QueueListener(log_queue, *handlers)
+    LOG_LISTENER.start()
+
+
+def stop_logging():
+    """
+    Stops writing log records, flushing the ones still queued.
+    """
+    global LOG_LISTENER
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
 
 
 def format_interval(seconds):
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import logging
+import threading
+
+from urllib.parse import urlsplit
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+
+import requests
+
+import utils.recording as recording
+
+# default settings for outbound requests, may be overridden by an 'http_cfg'
+# section in the process configuration
+DEFAULT_HTTP_CFG = {
+    # seconds to wait for a connection to be established
+    'connect_timeout': 10,
+    # seconds to wait for the server to send data
+    'read_timeout': 120,
+    # number of retries after a failed attempt
+    'retries': 2,
+    # base and maximum delay (in seconds) for jittered exponential backoff
+    'backoff_factor': 1.0,
+    'backoff_max': 30,
+    # seconds after which a second (hedged) request is issued if the first one
+    # hasn't returned yet, zero disables hedging
+    'hedge_after': 0,
+    # number of consecutive failed requests after which a host isn't queried
+    # anymore for the rest of the run
+    'breaker_threshold': 5,
+    # initial, minimum and maximum number of concurrent requests per host,
+    # adapted by additive increase and multiplicative decrease (AIMD)
+    'concurrency_initial': 2,
+    'concurrency_min': 1,
+    'concurrency_max': 16,
+    # seconds of response time regarded as a latency spike
+    'latency_threshold': 5.0,
+    # factor applied to a host's limit on throttling or latency spikes
+    'decrease_factor': 0.5,
+}
+# status codes indicating a (presumably) transient server-side problem
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# status codes indicating an overloaded or throttling server
+THROTTLE_STATUS_CODES = [429, 503]
+
+HTTP_CFG = dict(DEFAULT_HTTP_CFG)
+
+# per-host count of consecutive failures and hosts with open circuit breakers
+HOST_FAILURES = dict()
+OPEN_CIRCUITS = set()
+# failed requests including the reason for failing
+FAILED_REQUESTS = list()
+# per-host concurrency limiters
+HOST_LIMITERS = dict()
+
+LOCK = threading.Lock()
+HEDGE_EXECUTOR = None
+# per-thread sessions keeping connections to hosts alive between requests
+SESSIONS = threading.local()
+
+
+class RequestFailed(Exception):
+    """
+    Raised if a request couldn't be completed successfully, neither initially
+    nor after retrying.
+    """
+    def __init__(self, url, reason):
+        super().__init__("%s: %s" % (reason, url))
+        self.url = url
+        self.reason = reason
+
+
+class HostLimiter:
+    """
+    Adaptive limit for concurrent requests to a single host. The limit grows
+    additively while responses are fast and successful and shrinks
+    multiplicatively on throttling responses, timeouts or latency spikes.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.limit = float(HTTP_CFG['concurrency_initial'])
+        self.in_flight = 0
+        self.requests = 0
+        self.decreases = 0
+        self.peak = 0
+        self.last_decrease = 0
+        # smoothed response time of successful requests
+        self.round_trip = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, blocking=True):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                if not blocking:
+                    return False
+                self.condition.wait()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def abandon(self):
+        # releasing the slot of a request that has never been issued
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def release(self, latency, congested):
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            previous = int(self.limit)
+            if congested or latency > HTTP_CFG['latency_threshold']:
+                # decreasing once per round trip only, as all requests in
+                # flight are likely to experience the same congestion
+                if time.time() - self.last_decrease > self.round_trip:
+                    self.limit = max(HTTP_CFG['concurrency_min'], self.limit * HTTP_CFG['decrease_factor'])
+                    self.last_decrease = time.time()
+                    self.decreases += 1
+                    logging.info("Reducing concurrency limit for %s to %d", self.host, int(self.limit))
+            else:
+                self.round_trip = 0.8 * self.round_trip + 0.2 * latency if self.round_trip else latency
+                # increasing by one per full window of successful requests
+                self.limit = min(HTTP_CFG['concurrency_max'], self.limit + 1.0 / self.limit)
+                if int(self.limit) != previous:
+                    logging.debug("Raising concurrency limit for %s to %d", self.host, int(self.limit))
+            self.condition.notify_all()
+
+    def get_metrics(self):
+        return {
+            'limit': int(self.limit), 'in_flight': self.in_flight, 'peak': self.peak,
+            'requests': self.requests, 'decreases': self.decreases}
+
+
+def configure(cfg):
+    """
+    Applies settings from the 'http_cfg' section of the specified process
+    configuration.
+    """
+    HTTP_CFG.update(DEFAULT_HTTP_CFG)
+    HTTP_CFG.update(cfg.get('http_cfg') or dict())
+
+
+def reset():
+    """
+    Resets circuit breakers and recorded failures.
+    """
+    with LOCK:
+        HOST_FAILURES.clear()
+        OPEN_CIRCUITS.clear()
+        del FAILED_REQUESTS[:]
+        HOST_LIMITERS.clear()
+
+
+def get(url, **kwargs):
+    """
+    Issues a GET request to the specified url using configured timeouts,
+    retries and hedging. Raises RequestFailed if no valid response could be
+    retrieved or the circuit breaker for the url's host is open. Requests and
+    responses are recorded or replayed if requested.
+    """
+    if not recording.MODE:
+        return fetch(url, **kwargs)
+
+    # tokens change from run to run and aren't part of the recording key
+    params = {k: v for k, v in (kwargs.get('params') or dict()).items() if k != 'token'}
+    key = [url, params]
+
+    if recording.is_replaying():
+        try:
+            entry = recording.load_entry('http', key)
+        except KeyError:
+            raise RequestFailed(url, "Request not found in archive")
+        if 'reason' in entry:
+            raise RequestFailed(url, entry['reason'])
+        return get_response(entry)
+
+    try:
+        r = fetch(url, **kwargs)
+    except RequestFailed as e:
+        recording.save_entry('http', key, {'reason': e.reason})
+        raise
+    recording.save_entry('http', key, {
+        'url': r.url, 'status_code': r.status_code, 'headers': dict(r.headers),
+        'encoding': r.encoding, 'content': r.content})
+    return r
+
+
+def post(url, **kwargs):
+    """
+    Issues a POST request to the specified url using configured timeouts and
+    retries, but without hedging. Raises RequestFailed if no valid response
+    could be retrieved or the circuit breaker for the url's host is open.
+    """
+    return fetch(url, method='post', **kwargs)
+
+
+def get_response(entry):
+    """
+    Re-creates a response object from the specified recorded entry.
+    """
+    r = requests.Response()
+    r.url = entry['url']
+    r.status_code = entry['status_code']
+    r.headers.update(entry['headers'])
+    r.encoding = entry['encoding']
+    r._content = entry['content']
+    r._content_consumed = True
+    return r
+
+
+def fetch(url, method='get', **kwargs):
+    """
+    Actually issues a request, applying circuit breakers, timeouts, retries
+    and (for GET requests) hedging.
+    """
+    host = urlsplit(url).hostname
+
+    if host in OPEN_CIRCUITS:
+        raise RequestFailed(url, "Circuit breaker open for host %s" % host)
+
+    kwargs.setdefault('timeout', (HTTP_CFG['connect_timeout'], HTTP_CFG['read_timeout']))
+
+    reason = None
+    for attempt in range(HTTP_CFG['retries'] + 1):
+        if attempt:
+            time.sleep(get_backoff_delay(attempt))
+            logging.debug("Retrying (%d/%d) %s", attempt, HTTP_CFG['retries'], url)
+        limiter = get_host_limiter(host)
+        limiter.acquire()
+        try:
+            if method == 'get' and HTTP_CFG['hedge_after']:
+                r = hedged_get(limiter, url, **kwargs)
+            else:
+                r = limited_request(limiter, method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            reason = "Request timed out"
+            continue
+        except requests.exceptions.ConnectionError:
+            reason = "Unable to connect"
+            continue
+        except requests.exceptions.RequestException as e:
+            reason = "Request failed (%s)" % e.__class__.__name__
+            break
+        if r.status_code in RETRY_STATUS_CODES:
+            reason = "HTTP status %d" % r.status_code
+            r.close()
+            continue
+        register_success(host)
+        return r
+
+    register_failure(host, url, reason)
+    raise RequestFailed(url, reason)
+
+
+def limited_request(limiter, method, url, **kwargs):
+    """
+    Issues a request using a slot previously acquired from the specified host
+    limiter, releasing the slot as soon as the request has finished.
+    """
+    t0 = time.time()
+    r = None
+    try:
+        r = session_request(method, url, **kwargs)
+        return r
+    finally:
+        limiter.release(time.time() - t0, r is None or r.status_code in THROTTLE_STATUS_CODES)
+
+
+def hedged_get(limiter, url, **kwargs):
+    """
+    Issues a GET request to the specified url using a slot previously acquired
+    from the given host limiter. If the request hasn't finished in time and
+    another slot is available, a second identical request is issued and the
+    first successful response is returned. The losing request is cancelled if
+    it hasn't been issued yet, otherwise its response is closed once received.
+    """
+    executor = get_hedge_executor()
+    futures = [executor.submit(limited_request, limiter, 'get', url, **kwargs)]
+    done, _ = wait(futures, timeout=HTTP_CFG['hedge_after'])
+    if not done:
+        if limiter.acquire(blocking=False):
+            logging.debug("Hedging request to %s", url)
+            futures.append(executor.submit(limited_request, limiter, 'get', url, **kwargs))
+        else:
+            logging.debug("Not hedging request to %s, concurrency limit reached", url)
+
+    error = None
+    winner = None
+    for future in as_completed(futures):
+        error = future.exception()
+        if error is None:
+            winner = future
+            break
+
+    for future in futures:
+        if future is winner or future.done() and future.exception() is not None:
+            continue
+        if future.cancel():
+            limiter.abandon()
+        else:
+            future.add_done_callback(close_response)
+
+    if winner is None:
+        raise error
+    return winner.result()
+
+
+def close_response(future):
+    """
+    Closes the response of a finished request that isn't used, releasing its
+    connection.
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def session_request(method, url, **kwargs):
+    """
+    Issues a request using the session of the current thread.
+    """
+    session = getattr(SESSIONS, 'session', None)
+    if session is None:
+        session = SESSIONS.session = requests.Session()
+    return session.request(method, url, **kwargs)
+
+
+def get_hedge_executor():
+    """
+    Lazily sets up the thread pool used for hedged requests.
+    """
+    global HEDGE_EXECUTOR
+    with LOCK:
+        if HEDGE_EXECUTOR is None:
+            HEDGE_EXECUTOR = ThreadPoolExecutor(thread_name_prefix='hedge')
+    return HEDGE_EXECUTOR
+
+
+def get_host_limiter(host):
+    """
+    Gets concurrency limiter for the specified host.
+    """
+    limiter = HOST_LIMITERS.get(host)
+    if limiter is None:
+        with LOCK:
+            limiter = HOST_LIMITERS.setdefault(host, HostLimiter(host))
+    return limiter
+
+
+def get_host_limits():
+    """
+    Gets current concurrency limits and request metrics for all hosts.
+    """
+    return {host: limiter.get_metrics() for host, limiter in sorted(HOST_LIMITERS.items())}
+
+
+def log_host_limits():
+    """
+    Logs current concurrency limits and request metrics for all hosts.
+    """
+    for host, metrics in get_host_limits().items():
+        logging.info(
+            "%s: concurrency limit %d (peak %d), %d requests, %d decreases" % (
+                host, metrics['limit'], metrics['peak'], metrics['requests'], metrics['decreases']))
+
+
+def log_failed_requests():
+    """
+    Logs number of requests that failed (after retrying) since failures were
+    last logged, per host and reason.
+    """
+    with LOCK:
+        failures = Counter((failure['host'], failure['reason']) for failure in FAILED_REQUESTS)
+        del FAILED_REQUESTS[:]
+    if failures:
+        logging.warning("%d requests failed:" % sum(failures.values()))
+    for (host, reason), cnt in sorted(failures.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+        logging.warning("+ %s: %s (%d requests)" % (host, reason, cnt))
+
+
+def get_backoff_delay(attempt):
+    """
+    Gets delay (in seconds) before the specified retry attempt using
+    exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(HTTP_CFG['backoff_max'], HTTP_CFG['backoff_factor'] * 2 ** (attempt - 1)))
+
+
+def register_success(host):
+    """
+    Resets count of consecutive failures for the specified host.
+    """
+    if HOST_FAILURES.get(host):
+        with LOCK:
+            HOST_FAILURES[host] = 0
+
+
+def register_failure(host, url, reason):
+    """
+    Records a failed request and opens the circuit breaker for the specified
+    host if the configured number of consecutive failures has been reached.
+    """
+    with LOCK:
+        FAILED_REQUESTS.append({'url': url, 'host': host, 'reason': reason})
+        HOST_FAILURES[host] = HOST_FAILURES.get(host, 0) + 1
+        if HTTP_CFG['breaker_threshold'] and HOST_FAILURES[host] >= HTTP_CFG['breaker_threshold']:
+            if host not in OPEN_CIRCUITS:
+                logging.warning(
+                    "Opening circuit breaker for host %s after %d consecutive failures" % (
+                        host, HOST_FAILURES[host]))
+            OPEN_CIRCUITS.add(host)
+    logging.warning("%s: %s", reason, url)
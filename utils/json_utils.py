@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+# using orjson as considerably faster decoder if available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def loads(content):
+    """
+    Decodes specified JSON content (bytes or string) using the fastest
+    available decoder, ignoring a leading UTF-8 byte order mark. Raises a
+    ValueError if content can't be decoded.
+    """
+    if isinstance(content, (bytes, bytearray)):
+        if content.startswith(UTF8_BOM):
+            content = content[len(UTF8_BOM):]
+    elif content.startswith('\ufeff'):
+        content = content[1:]
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def get_decoder_name():
+    """
+    Gets name of the JSON decoder currently in use.
+    """
+    if orjson is not None:
+        return "orjson %s" % orjson.__version__
+    return "json (standard library)"
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Optional profiling of the stages of a run, e.g. reading sources, fetching and
+extracting items, writing to the database, rendering or uploading. When
+enabled, every stage is profiled using cProfile and tracemalloc and all
+threads are sampled periodically to create flame-graph-compatible collapsed
+stacks. Results are written to the log directory when the run is finished.
+When disabled, stages are no-op context managers.
+'''
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+import tracemalloc
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# seconds between samples of all threads' stacks
+SAMPLE_INTERVAL = 0.005
+# number of functions and allocation sites written per stage
+TOP_ENTRIES = 40
+
+ENABLED = False
+PREFIX = None
+
+# stage name -> merged call profile, allocation differences and wall times
+STAGE_STATS = dict()
+STAGE_ALLOCATIONS = defaultdict(list)
+STAGE_TIMES = defaultdict(list)
+# thread id -> names of currently active (nested) stages
+ACTIVE_STAGES = defaultdict(list)
+# collapsed stacks -> number of samples
+SAMPLES = Counter()
+
+NULL_STAGE = contextlib.nullcontext()
+LOCK = threading.Lock()
+STOP = threading.Event()
+LOCAL = threading.local()
+
+
+def enable(code_file):
+    """
+    Enables profiling for the run of the specified Python code file, results
+    are written to its log directory.
+    """
+    global ENABLED, PREFIX
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(code_file)), 'log')
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    PREFIX = os.path.join(log_dir, "%s_%s_profile" % (
+        datetime.now().strftime('%Y%m%d_%H%M%S'), os.path.splitext(os.path.basename(code_file))[0]))
+
+    tracemalloc.start()
+    threading.Thread(target=sample_stacks, name='profiler', daemon=True).start()
+    ENABLED = True
+    logging.info("Profiling enabled, writing results to %s*" % PREFIX)
+
+
+def stage(name):
+    """
+    Gets context manager profiling the enclosed code as the named stage.
+    """
+    if not ENABLED:
+        return NULL_STAGE
+    return profiled_stage(name)
+
+
+@contextlib.contextmanager
+def profiled_stage(name):
+    """
+    Profiles the enclosed code as the named stage. Call profiles are only
+    recorded for the outermost stage within each thread, allocation sites only
+    for outermost stages in the main thread.
+    """
+    thread_stages = ACTIVE_STAGES[threading.get_ident()]
+    outermost = not thread_stages
+    snapshot = None
+    profile = None
+
+    if outermost and threading.current_thread() is threading.main_thread():
+        snapshot = tracemalloc.take_snapshot()
+    if getattr(LOCAL, 'profile', None) is None:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            LOCAL.profile = profile
+        except ValueError:
+            # another profiler is already active (Python 3.12+)
+            profile = None
+
+    thread_stages.append(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        thread_stages.pop()
+        if profile is not None:
+            profile.disable()
+            LOCAL.profile = None
+        allocations = None
+        if snapshot is not None:
+            allocations = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')[:TOP_ENTRIES]
+        with LOCK:
+            STAGE_TIMES[name].append(elapsed)
+            if profile is not None:
+                if name in STAGE_STATS:
+                    STAGE_STATS[name].add(profile)
+                else:
+                    STAGE_STATS[name] = pstats.Stats(profile)
+            if allocations:
+                STAGE_ALLOCATIONS[name].append(allocations)
+
+
+def sample_stacks():
+    """
+    Samples stacks of all threads periodically, prefixed by the innermost
+    active stage of each thread.
+    """
+    own_id = threading.get_ident()
+    while not STOP.wait(SAMPLE_INTERVAL):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            thread_stages = ACTIVE_STAGES.get(thread_id)
+            stack.append(thread_stages[-1] if thread_stages else 'other')
+            with LOCK:
+                SAMPLES[';'.join(reversed(stack))] += 1
+
+
+def finish():
+    """
+    Stops profiling and writes call profiles, allocation sites, collapsed
+    stacks and a summary of stage durations to the log directory.
+    """
+    global ENABLED
+    if not ENABLED:
+        return
+    ENABLED = False
+    STOP.set()
+    tracemalloc.stop()
+
+    with LOCK:
+        for name, stats in STAGE_STATS.items():
+            stats.dump_stats("%s_%s.prof" % (PREFIX, name))
+            with open("%s_%s.txt" % (PREFIX, name), 'w') as output:
+                stats.stream = output
+                stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+
+        for name, allocation_lists in STAGE_ALLOCATIONS.items():
+            with open("%s_%s_alloc.txt" % (PREFIX, name), 'w') as output:
+                for allocations in allocation_lists:
+                    output.write("\n".join(str(allocation) for allocation in allocations) + "\n\n")
+
+        with open("%s.collapsed" % PREFIX, 'w') as output:
+            for stack, cnt in SAMPLES.most_common():
+                output.write("%s %d\n" % (stack, cnt))
+
+        with open("%s_stages.txt" % PREFIX, 'w') as output:
+            output.write("%-16s %8s %12s %12s\n" % ('stage', 'count', 'total (s)', 'max (s)'))
+            for name, times in sorted(STAGE_TIMES.items(), key=lambda item: -sum(item[1])):
+                output.write("%-16s %8d %12.3f %12.3f\n" % (name, len(times), sum(times), max(times)))
+
+    logging.info("Profiling results written to %s*" % PREFIX)
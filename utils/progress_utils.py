@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Periodic progress summaries for long-running crawls, replacing log messages
+for every single item. Progress, throughput and (if the total number of items
+is known) the estimated remaining time are logged at most once per interval.
+'''
+import time
+import logging
+import threading
+
+# default seconds between progress summaries
+DEFAULT_INTERVAL = 30
+
+
+class Progress:
+    """
+    Counts processed items of a named task and logs progress summaries.
+    """
+    def __init__(self, name, total=None, interval=None):
+        self.name = name
+        self.total = total
+        self.interval = interval or DEFAULT_INTERVAL
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_log = self.start
+        self.lock = threading.Lock()
+
+    def update(self, failed=False):
+        """
+        Registers a processed item, logging a summary if the interval has
+        passed or all items have been processed.
+        """
+        with self.lock:
+            self.done += 1
+            if failed:
+                self.failed += 1
+            now = time.monotonic()
+            if now - self.last_log < self.interval and self.done != self.total:
+                return
+            self.last_log = now
+            done, failed_cnt, elapsed = self.done, self.failed, now - self.start
+        self.log(done, failed_cnt, elapsed)
+
+    def log(self, done, failed, elapsed):
+        """
+        Logs progress summary for the specified counts.
+        """
+        rate = done / elapsed if elapsed else 0.0
+        if self.total:
+            remaining = (self.total - done) / rate if rate else 0
+            logging.info(
+                "%s: %d of %d items processed (%d failed), %.1f items/s, %d s remaining",
+                self.name, done, self.total, failed, rate, remaining)
+        else:
+            logging.info("%s: %d items processed (%d failed), %.1f items/s", self.name, done, failed, rate)
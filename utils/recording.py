@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Recording and replaying of external interactions, i.e. HTTP exchanges and
+source database reads. While recording, results of all interactions are stored
+in a compressed (zip) archive, keyed by kind and a request-specific key. While
+replaying, results are retrieved from a previously recorded archive instead,
+allowing to re-run a crawl completely offline. Entries are stored as JSON,
+i.e. replaying an archive never executes anything read from it.
+'''
+import json
+import base64
+import hashlib
+import logging
+import zipfile
+import datetime
+import threading
+
+from types import SimpleNamespace
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+MODE = None
+ARCHIVE = None
+ENTRIES = set()
+
+LOCK = threading.Lock()
+
+
+def start_recording(archive_path):
+    """
+    Starts recording all external interactions into the specified archive.
+    """
+    global MODE, ARCHIVE
+    logging.info("Recording external interactions to %s" % archive_path)
+    ARCHIVE = zipfile.ZipFile(archive_path, 'a', compression=zipfile.ZIP_DEFLATED)
+    ENTRIES.update(ARCHIVE.namelist())
+    MODE = MODE_RECORD
+
+
+def start_replay(archive_path):
+    """
+    Starts replaying external interactions from the specified archive.
+    """
+    global MODE, ARCHIVE
+    logging.info("Replaying external interactions from %s" % archive_path)
+    ARCHIVE = zipfile.ZipFile(archive_path, 'r')
+    ENTRIES.update(ARCHIVE.namelist())
+    MODE = MODE_REPLAY
+
+
+def stop():
+    """
+    Stops recording or replaying and closes the current archive.
+    """
+    global MODE, ARCHIVE
+    with LOCK:
+        if ARCHIVE is not None:
+            logging.info("Closing archive with %d entries" % len(ENTRIES))
+            ARCHIVE.close()
+        MODE = None
+        ARCHIVE = None
+        ENTRIES.clear()
+
+
+def is_recording():
+    return MODE == MODE_RECORD
+
+
+def is_replaying():
+    return MODE == MODE_REPLAY
+
+
+def get_entry_name(kind, key):
+    """
+    Gets name of the archive entry for the specified kind and (JSON
+    serializable) key.
+    """
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return "%s/%s" % (kind, digest)
+
+
+def save_entry(kind, key, obj):
+    """
+    Saves specified object to the archive, unless an entry with the same
+    kind and key already exists.
+    """
+    name = get_entry_name(kind, key)
+    with LOCK:
+        if name in ENTRIES:
+            return
+        ARCHIVE.writestr(name, json.dumps(encode_value(obj)))
+        ENTRIES.add(name)
+
+
+def load_entry(kind, key):
+    """
+    Loads object for the specified kind and key from the archive. Raises a
+    KeyError if no such entry has been recorded.
+    """
+    name = get_entry_name(kind, key)
+    if name not in ENTRIES:
+        raise KeyError("No %s entry recorded for %s" % (kind, key))
+    with LOCK:
+        content = ARCHIVE.read(name)
+    return json.loads(content.decode('utf-8'), object_hook=decode_value)
+
+
+def encode_value(value):
+    """
+    Encodes specified value into a JSON serializable structure, tagging values
+    not natively supported by JSON, e.g. binary content, dates, tuples or
+    source database rows.
+    """
+    if isinstance(value, dict):
+        return {str(k): encode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode_value(v) for v in value]}
+    if isinstance(value, SimpleNamespace):
+        return {'__namespace__': encode_value(vars(value))}
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError("Unable to record value of type %s" % type(value).__name__)
+
+
+def decode_value(obj):
+    """
+    Restores tagged values of a recorded entry.
+    """
+    if '__tuple__' in obj:
+        return tuple(obj['__tuple__'])
+    if '__namespace__' in obj:
+        return SimpleNamespace(**obj['__namespace__'])
+    if '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def record_call(kind, key, fn, *args, **kwargs):
+    """
+    Calls specified function and records its result, or returns the recorded
+    result instead of calling the function when replaying.
+    """
+    if MODE == MODE_REPLAY:
+        return load_entry(kind, key)
+    result = fn(*args, **kwargs)
+    if MODE == MODE_RECORD:
+        save_entry(kind, key, result)
+    return result
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Local append-only spool for crawled rows. Rows for a target table are written
+as gzip-compressed JSON Lines segments per table, environment and reference
+date, decoupling crawls from the availability of the target database. Each
+segment starts with a header line describing its content. Segments are
+written atomically, i.e. a segment is either complete or not visible at all,
+and moved to a subdirectory once loaded.
+'''
+import os
+import glob
+import gzip
+import json
+import time
+import hashlib
+import logging
+import datetime
+
+DEFAULT_SPOOL_DIR = 'spool'
+LOADED_DIR = 'loaded'
+SEGMENT_SUFFIX = '.jsonl.gz'
+# days to keep loaded segments before removing them
+DEFAULT_RETENTION = 7
+
+
+def get_spool_dir(cfg):
+    """
+    Gets configured spool directory.
+    """
+    return cfg.get('spool_dir') or DEFAULT_SPOOL_DIR
+
+
+def encode_value(value):
+    """
+    Encodes values not natively supported by JSON, i.e. dates and timestamps.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError("Unable to spool value of type %s" % type(value).__name__)
+
+
+def write_segment(cfg, tbl_key, rows):
+    """
+    Writes specified rows, i.e. dictionaries or row records, for the target
+    table with the given configuration key as a new spool segment. Returns the
+    path to the segment.
+    """
+    spool_dir = get_spool_dir(cfg)
+    if not os.path.isdir(spool_dir):
+        os.makedirs(spool_dir)
+
+    created_at = datetime.datetime.now()
+    header = {
+        'table': tbl_key, 'env': cfg['query_environment'], 'reference_date': cfg['ref_date'].isoformat(),
+        'created_at': created_at.isoformat(), 'rows': len(rows)}
+    segment_path = os.path.join(spool_dir, "%s_%s_%s_%s%s" % (
+        tbl_key, cfg['query_environment'], cfg['ref_date'].strftime('%Y%m%d'),
+        created_at.strftime('%Y%m%d%H%M%S%f'), SEGMENT_SUFFIX))
+    tmp_path = "%s.tmp" % segment_path
+
+    with open(tmp_path, 'wb') as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode='wb') as segment_file:
+            segment_file.write((json.dumps(header) + "\n").encode('utf-8'))
+            for row in rows:
+                row = row.as_dict() if hasattr(row, 'as_dict') else dict(row)
+                segment_file.write((json.dumps(row, default=encode_value) + "\n").encode('utf-8'))
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+    os.replace(tmp_path, segment_path)
+
+    logging.info("%d rows for %s spooled to %s" % (len(rows), tbl_key, segment_path))
+    return segment_path
+
+
+def read_header(segment_path):
+    """
+    Reads header of the specified spool segment.
+    """
+    with gzip.open(segment_path, 'rt', encoding='utf-8') as segment_file:
+        return json.loads(segment_file.readline())
+
+
+def read_rows(segment_path):
+    """
+    Reads all rows from the specified spool segment.
+    """
+    with gzip.open(segment_path, 'rt', encoding='utf-8') as segment_file:
+        # skipping header
+        segment_file.readline()
+        return [json.loads(line) for line in segment_file if line.strip()]
+
+
+def get_checksum(segment_path):
+    """
+    Gets SHA-256 checksum of the specified spool segment.
+    """
+    checksum = hashlib.sha256()
+    with open(segment_path, 'rb') as segment_file:
+        for chunk in iter(lambda: segment_file.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_pending_segments(cfg):
+    """
+    Gets headers and paths of all segments that haven't been loaded yet, in
+    the order they were spooled.
+    """
+    segments = list()
+    for segment_path in glob.glob(os.path.join(get_spool_dir(cfg), "*%s" % SEGMENT_SUFFIX)):
+        try:
+            segments.append((read_header(segment_path), segment_path))
+        except (OSError, EOFError, ValueError) as e:
+            logging.error("Unable to read spool segment %s: %s" % (segment_path, e))
+    return sorted(segments, key=lambda segment: (segment[0]['created_at'], segment[1]))
+
+
+def mark_loaded(cfg, segment_path):
+    """
+    Moves specified segment out of the spool after loading it and removes
+    loaded segments older than the configured retention period.
+    """
+    loaded_dir = os.path.join(get_spool_dir(cfg), LOADED_DIR)
+    if not os.path.isdir(loaded_dir):
+        os.makedirs(loaded_dir)
+    os.replace(segment_path, os.path.join(loaded_dir, os.path.basename(segment_path)))
+
+    retention = cfg.get('spool_retention', DEFAULT_RETENTION)
+    for loaded_path in glob.glob(os.path.join(loaded_dir, "*%s" % SEGMENT_SUFFIX)):
+        if os.path.getmtime(loaded_path) < time.time() - retention * 86400:
+            os.remove(loaded_path)
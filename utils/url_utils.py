@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+from urllib.parse import urlsplit
+
+# pattern to identify folder, name and (optional) layer id of ArcGIS server services
+SERVICE_PATTERN = re.compile(R"/rest/services/(.+)/(.+)/(?:Map|Feature)Server/?(\d+)?")
+# indicator for services that are accessed via (secured) relay
+RELAY_MARKER = 'ags-relay'
+
+
+def build_url_index(environments):
+    """
+    Builds index to classify service urls from the specified environment
+    configuration, i.e. a mapping of ArcGIS server host names to environment
+    names and a cache for already classified urls.
+    """
+    hosts = dict()
+    for env_name, env_cfg in environments.items():
+        # skipping environment if no ArcGIS server has been configured for it
+        if 'ags_host' not in env_cfg:
+            continue
+        hosts.setdefault(env_cfg['ags_host'].lower(), env_name)
+
+    return {'hosts': hosts, 'urls': dict()}
+
+
+def classify_url(url_index, url):
+    """
+    Classifies specified service url using the given index. Returns a
+    dictionary containing environment, folder, name and layer id of the
+    service as well as indicators whether the service is located on a
+    configured ArcGIS server and whether it is accessed via relay.
+    """
+    if url in url_index['urls']:
+        return url_index['urls'][url]
+
+    info = {
+        'env': None, 'folder': None, 'name': None, 'layer_id': None,
+        'known_host': False, 'relay': False, 'secured': None}
+
+    if url:
+        # removing optional prefix preceding the actual url
+        bare_url = url.split(": ")[-1]
+        try:
+            host = urlsplit(bare_url).hostname
+        except ValueError:
+            host = None
+        env_name = url_index['hosts'].get(host)
+        # falling back to substring search for host names not matched exactly,
+        # e.g. if a host name has been configured including a port
+        if env_name is None:
+            for ags_host, ags_env_name in url_index['hosts'].items():
+                if ags_host in bare_url.lower():
+                    env_name = ags_env_name
+                    break
+        if env_name is not None:
+            info['env'] = env_name
+            info['known_host'] = True
+            info['relay'] = RELAY_MARKER in url
+            info['secured'] = info['relay']
+
+        match = SERVICE_PATTERN.search(url)
+        if match:
+            info['folder'] = match.group(1)
+            info['name'] = match.group(2)
+            if match.group(3) is not None:
+                info['layer_id'] = int(match.group(3))
+
+    url_index['urls'][url] = info
+
+    return info